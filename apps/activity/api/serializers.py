@@ -50,6 +50,26 @@ class EntrySerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class EntryPersonSerializer(serializers.Serializer):
+    """
+    A person that enters an activity: a member, given by its note, or a guest.
+    """
+    note = serializers.IntegerField(required=False)
+    guest = serializers.IntegerField(required=False)
+
+    def validate(self, attrs):
+        if ("note" in attrs) == ("guest" in attrs):
+            raise serializers.ValidationError("Give either a note or a guest.")
+        return attrs
+
+
+class EntryBatchSerializer(serializers.Serializer):
+    """
+    A batch of people that enter an activity.
+    """
+    people = EntryPersonSerializer(many=True, allow_empty=False)
+
+
 class GuestTransactionSerializer(serializers.ModelSerializer):
     """
     REST API Serializer for Special transactions.
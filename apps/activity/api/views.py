@@ -2,10 +2,16 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 from api.viewsets import ReadProtectedModelViewSet
+from django.core.exceptions import ValidationError
 from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import status
+from rest_framework.decorators import action
 from rest_framework.filters import SearchFilter
+from rest_framework.response import Response
 
-from .serializers import ActivitySerializer, ActivityTypeSerializer, EntrySerializer, GuestSerializer
+from .serializers import ActivitySerializer, ActivityTypeSerializer, EntryBatchSerializer, EntrySerializer, \
+    GuestSerializer
+from ..bulk import register_entries
 from ..models import Activity, ActivityType, Entry, Guest
 
 
@@ -38,6 +44,27 @@ class ActivityViewSet(ReadProtectedModelViewSet):
                      '$organizer__note__alias__normalized_name', '$attendees_club__name', '$attendees_club__email',
                      '$attendees_club__note__alias__name', '$attendees_club__note__alias__normalized_name', ]
 
+    @action(detail=True, methods=["post"])
+    def entries(self, request, pk=None):
+        """
+        Register the entries of several people at once, eg. the queue at the door.
+        The body contains the list "people", of objects with either the primary key of the note of a member ("note")
+        or the primary key of a guest ("guest"). The response gives the result of each person, in the same order:
+        the created entry and its time, or the error that refused this person.
+        """
+        serializer = EntryBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            results = register_entries(request, self.get_object(), serializer.validated_data["people"])
+        except ValidationError as e:
+            return Response({"detail": " ".join(e.messages)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "count": sum(result["entry"] is not None for result in results),
+            "results": results,
+        })
+
 
 class GuestViewSet(ReadProtectedModelViewSet):
     """
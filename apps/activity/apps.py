@@ -2,9 +2,28 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.utils.translation import gettext_lazy as _
 
 
 class ActivityConfig(AppConfig):
     name = 'activity'
     verbose_name = _('activity')
+
+    def ready(self):
+        """
+        Keep the index of the attendees of the open activities and the cached events up to date
+        """
+        from django.contrib.auth.models import User
+        from member.models import Club, Membership
+        from note.models import Alias
+        from . import signals
+        from .models import Entry
+
+        post_save.connect(signals.update_membership_attendees, sender=Membership)
+        post_delete.connect(signals.update_membership_attendees, sender=Membership)
+        post_save.connect(signals.update_alias_attendees, sender=Alias)
+        post_save.connect(signals.update_user_attendees, sender=User)
+        pre_save.connect(signals.update_club_activities, sender=Club)
+        post_save.connect(signals.save_entry_attendee, sender=Entry)
+        post_delete.connect(signals.delete_entry_attendee, sender=Entry)
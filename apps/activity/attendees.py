@@ -0,0 +1,130 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Index of the members that can attend the open activities.
+
+At the door, each keystroke searched the members of the attendees club through the aliases, the users and
+the memberships, with regular expressions. The index stores, for each open activity, the aliases and the names
+of the members with a current membership, and whether they already entered. The search is then a prefix match
+on normalized names, with one indexed query, whatever the size of the membership table.
+
+The index is built when the activity is opened, dropped when it is closed, and the signals of the memberships,
+aliases, users and entries keep it up to date.
+"""
+
+from django.db.models import Case, F, IntegerField, Max, Min, Q, Value, When
+from django.utils import timezone
+from member.models import Membership
+from note.models import Alias
+
+from .models import Activity, Attendee, Entry
+
+
+def _build_rows(activity, user_ids=None):
+    """
+    Build the lines of the index of an activity, for all the members or only for the given users.
+    """
+    memberships = Membership.objects.filter(club_id=activity.attendees_club_id,
+                                            date_end__gte=timezone.localdate())
+    if user_ids is not None:
+        memberships = memberships.filter(user_id__in=user_ids)
+    periods = {row["user_id"]: (row["start"], row["end"]) for row in memberships.order_by().values("user_id")
+               .annotate(start=Min("date_start"), end=Max("date_end"))}
+    if not periods:
+        return []
+
+    entered = set(Entry.objects.filter(activity=activity, guest=None, note__user_id__in=periods.keys())
+                  .values_list("note_id", flat=True))
+
+    rows = []
+    for alias in Alias.objects.filter(note__noteuser__user_id__in=periods.keys())\
+            .values("pk", "name", "normalized_name", "note_id", "note__noteuser__user_id",
+                    "note__noteuser__user__username", "note__noteuser__user__last_name",
+                    "note__noteuser__user__first_name"):
+        start, end = periods[alias["note__noteuser__user_id"]]
+        last_name, first_name = alias["note__noteuser__user__last_name"], alias["note__noteuser__user__first_name"]
+        rows.append(Attendee(
+            activity=activity,
+            note_id=alias["note_id"],
+            alias_id=alias["pk"],
+            note_name=alias["name"],
+            normalized_name=alias["normalized_name"],
+            username=alias["note__noteuser__user__username"],
+            last_name=last_name,
+            first_name=first_name,
+            normalized_last_name=Alias.normalize(last_name)[:150],
+            normalized_first_name=Alias.normalize(first_name)[:150],
+            membership_start=start,
+            membership_end=end,
+            entered=alias["note_id"] in entered,
+        ))
+    return rows
+
+
+def build_index(activity):
+    """
+    Build the index of the attendees of an activity, with a few queries.
+    """
+    Attendee.objects.filter(activity=activity).delete()
+    Attendee.objects.bulk_create(_build_rows(activity))
+
+
+def drop_index(activity):
+    Attendee.objects.filter(activity=activity).delete()
+
+
+def ensure_index(activity):
+    """
+    Build the index of an open activity if it doesn't exist, eg. if the activity was opened before the index existed.
+    """
+    if activity.open and not Attendee.objects.filter(activity=activity).exists():
+        build_index(activity)
+
+
+def refresh_users(user_ids, activities=None):
+    """
+    Update the lines of the given users in the index of the open activities.
+    """
+    if activities is None:
+        activities = Activity.objects.filter(open=True)
+    for activity in activities:
+        Attendee.objects.filter(activity=activity, note__user_id__in=user_ids).delete()
+        Attendee.objects.bulk_create(_build_rows(activity, user_ids))
+
+
+def search(activity, pattern, limit=20, alias_filter=None):
+    """
+    Search the members that can attend an activity, by a prefix of their aliases or of their names.
+    The current memberships are selected at query time, then the index stays valid when a membership expires.
+    :param alias_filter: A filter on the aliases that can be returned, eg. the permissions of the user.
+                         It is applied in the query, before the results are limited.
+    :return: The lines of the index, at most one per note, annotated with the balance of the note
+    """
+    pattern = Alias.normalize(pattern)
+    if not pattern:
+        return []
+
+    today = timezone.localdate()
+    queryset = Attendee.objects.filter(activity=activity, membership_start__lte=today, membership_end__gte=today)\
+        .filter(Q(normalized_name__startswith=pattern)
+                | Q(normalized_last_name__startswith=pattern)
+                | Q(normalized_first_name__startswith=pattern))\
+        .annotate(balance=F("note__balance"),
+                  alias_match=Case(When(normalized_name__startswith=pattern, then=Value(0)), default=Value(1),
+                                   output_field=IntegerField()))\
+        .order_by("alias_match", "last_name", "first_name", "note_name")
+    if alias_filter:
+        queryset = queryset.filter(alias__in=Alias.objects.filter(alias_filter))
+
+    # A note can have many aliases: keep the best line of each note
+    attendees = {}
+    for attendee in queryset[:limit * 10]:
+        attendees.setdefault(attendee.note_id, attendee)
+        if len(attendees) >= limit:
+            break
+    return list(attendees.values())
+
+
+def set_entered(activity_id, note_id, entered):
+    Attendee.objects.filter(activity_id=activity_id, note_id=note_id).update(entered=entered)
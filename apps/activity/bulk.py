@@ -0,0 +1,130 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Register many entries to an activity at once.
+
+At the door, each entry was a request that checks the duplicates, locks the notes and, for a guest,
+creates an invitation transaction through the whole ledger. Here a batch of people is validated
+with one query for the duplicates, the entries are created with bulk_create, and the invitation fees
+are charged with one balance update per inviter. Each person gets its own result: a refused person
+doesn't prevent the others from entering.
+"""
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from note.bulk import create_transactions
+from note.models import Note, NoteUser
+
+from .models import Activity, Attendee, Entry, Guest, GuestTransaction
+
+
+@transaction.atomic
+def register_entries(request, activity, people):
+    """
+    Register the entries of several people to an open activity.
+    The checks are the same as when an entry is saved: a person can't enter twice, and the note
+    of the member, or of the inviter of a guest, must not be negative. The guests are charged the
+    invitation fee of the activity.
+    :param request: The current request, or None if the entries are registered in a shell
+    :param activity: The activity
+    :param people: A list of dictionaries, that contain the primary key of the note of a member ("note")
+                   or the primary key of a guest ("guest")
+    :return: A list with the result of each person, in the same order: a dictionary with the note and the guest,
+             the primary key of the created entry and its time, or the error that refused the entry
+    """
+    from permission.backends import PermissionBackend
+    from permission.bulk import bulk_save
+
+    activity = Activity.objects.select_related("activity_type", "organizer__note").get(pk=activity.pk)
+    if not activity.activity_type.manage_entries:
+        raise ValidationError(_("This activity does not support activity entries."))
+    if not activity.open:
+        raise ValidationError(_("This activity is closed."))
+
+    guest_ids = [person["guest"] for person in people if person.get("guest") is not None]
+    guests = Guest.objects.filter(activity=activity).in_bulk(guest_ids)
+    note_ids = [person["note"] for person in people if person.get("guest") is None]
+
+    # The duplicates of the whole batch are found with one query
+    entered = {}
+    for note_id, guest_id, time in Entry.objects.filter(activity=activity)\
+            .filter(Q(guest=None, note_id__in=note_ids) | Q(guest_id__in=guest_ids))\
+            .values_list("note_id", "guest_id", "time"):
+        entered[("guest", guest_id) if guest_id else ("note", note_id)] = time
+
+    # Lock the notes of the members and of the inviters, the balances are tracked during the batch
+    notes = {note.pk: note for note in Note.objects.select_for_update()
+             .filter(pk__in=note_ids + [guest.inviter_id for guest in guests.values()]).order_by("pk")}
+    balances = {note_id: note.balance for note_id, note in notes.items()}
+
+    now = timezone.now()
+    results = []
+    entries = []
+    for person in people:
+        guest = guests.get(person.get("guest"))
+        result = dict(note=person.get("note"), guest=person.get("guest"), entry=None, time=None, error=None)
+        results.append(result)
+
+        if result["guest"] is not None and guest is None:
+            result["error"] = str(_("This guest is not invited to this activity."))
+            continue
+        if guest is not None:
+            result["note"] = guest.inviter_id
+        key = ("guest", guest.pk) if guest is not None else ("note", result["note"])
+
+        if key in entered:
+            result["error"] = str(_("Already entered on ") + _("{:%Y-%m-%d %H:%M:%S}").format(entered[key], ))
+            continue
+        if not isinstance(notes.get(result["note"]), NoteUser):
+            result["error"] = str(_("This note is not the note of a user."))
+            continue
+        if balances[result["note"]] < 0:
+            result["error"] = str(_("The balance is negative."))
+            continue
+
+        entered[key] = now
+        if guest is not None:
+            balances[guest.inviter_id] -= activity.activity_type.guest_entry_fee
+        entry = Entry(activity=activity, time=now, note_id=result["note"], guest=guest)
+        entry._result = result
+        entries.append(entry)
+
+    # The entries that the request can't add are refused, the other ones are checked by the same query
+    if request is not None:
+        denied = PermissionBackend.check_add_perms(request, entries)
+        for entry in denied:
+            entry._result["error"] = str(_("You don't have the permission to add an instance of model "
+                                           "{app_label}.{model_name}.")
+                                         .format(app_label="activity", model_name="entry"))
+        entries = [entry for entry in entries if entry not in denied]
+        for entry in entries:
+            entry._force_save = True
+
+    bulk_save(request, entries)
+    for entry in entries:
+        entry._result.update(entry=entry.pk, time=entry.time)
+
+    # The index of the attendees is updated as the signals would do
+    Attendee.objects.filter(activity=activity,
+                            note_id__in=[entry.note_id for entry in entries if entry.guest is None])\
+        .update(entered=True)
+
+    # The invitation fees are charged together, with one balance update per inviter
+    create_transactions(request, [
+        GuestTransaction(
+            source_id=entry.note_id,
+            destination_id=activity.organizer.note.pk,
+            quantity=1,
+            amount=activity.activity_type.guest_entry_fee,
+            reason="Invitation " + activity.name + " " + entry.guest.first_name + " " + entry.guest.last_name,
+            valid=True,
+            entry=entry,
+        )
+        for entry in entries if entry.guest is not None
+    ])
+
+    return results
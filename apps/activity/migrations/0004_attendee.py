@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('note', '0001_initial'),
+        ('activity', '0003_auto_20220818_1105'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Attendee',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('note_name', models.CharField(max_length=255, verbose_name='alias')),
+                ('normalized_name', models.CharField(max_length=255)),
+                ('username', models.CharField(max_length=150, verbose_name='username')),
+                ('last_name', models.CharField(max_length=150, verbose_name='last name')),
+                ('first_name', models.CharField(max_length=150, verbose_name='first name')),
+                ('normalized_last_name', models.CharField(max_length=150)),
+                ('normalized_first_name', models.CharField(max_length=150)),
+                ('membership_start', models.DateField(verbose_name='membership starts on')),
+                ('membership_end', models.DateField(verbose_name='membership ends on')),
+                ('entered', models.BooleanField(default=False, verbose_name='entered')),
+                ('activity', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='activity.activity', verbose_name='activity')),
+                ('alias', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='note.alias', verbose_name='alias')),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='note.noteuser', verbose_name='note')),
+            ],
+            options={
+                'verbose_name': 'attendee',
+                'verbose_name_plural': 'attendees',
+                'indexes': [models.Index(fields=['activity', 'normalized_name'], name='activity_attendee_alias_idx', opclasses=['int4_ops', 'varchar_pattern_ops']), models.Index(fields=['activity', 'normalized_last_name'], name='activity_attendee_last_idx', opclasses=['int4_ops', 'varchar_pattern_ops']), models.Index(fields=['activity', 'normalized_first_name'], name='activity_attendee_first_idx', opclasses=['int4_ops', 'varchar_pattern_ops'])],
+                'unique_together': {('activity', 'alias')},
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:30
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0004_attendee'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='last update'),
+            preserve_default=False,
+        ),
+    ]
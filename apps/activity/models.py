@@ -1,9 +1,7 @@
 # Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-import os
 from datetime import timedelta
-from threading import Thread
 
 from django.conf import settings
 from django.contrib.auth.models import User
@@ -11,7 +9,8 @@ from django.db import models, transaction
 from django.db.models import Q
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from note.models import NoteUser, Transaction
+from jobs.queue import enqueue
+from note.models import Alias, NoteUser, Transaction
 from rest_framework.exceptions import ValidationError
 
 
@@ -123,6 +122,11 @@ class Activity(models.Model):
         verbose_name=_('open'),
     )
 
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name=_('last update'),
+    )
+
     @transaction.atomic
     def save(self, *args, **kwargs):
         """
@@ -131,17 +135,21 @@ class Activity(models.Model):
         if self.date_end < self.date_start:
             raise ValidationError(_("The end date must be after the start date."))
 
+        was_open = self.pk is not None and Activity.objects.filter(pk=self.pk).values_list("open", flat=True).first()
         ret = super().save(*args, **kwargs)
+
+        # The index of the attendees only exists while the activity is open
+        if self.open != bool(was_open):
+            from .attendees import build_index, drop_index
+            if self.open:
+                build_index(self)
+            else:
+                drop_index(self)
+
         if not settings.DEBUG and self.pk and "scripts" in settings.INSTALLED_APPS:
-            def refresh_activities():
-                from scripts.management.commands.refresh_activities import Command as RefreshActivitiesCommand
-                # Consider that we can update the wiki iff the WIKI_PASSWORD env var is not empty
-                RefreshActivitiesCommand.refresh_human_readable_wiki_page("Modification de l'activité " + self.name,
-                                                                          False, os.getenv("WIKI_PASSWORD"))
-                RefreshActivitiesCommand.refresh_raw_wiki_page("Modification de l'activité " + self.name,
-                                                               False, os.getenv("WIKI_PASSWORD"))
-            Thread(daemon=True, target=refresh_activities).start()\
-                if settings.DATABASES["default"]["ENGINE"] == 'django.db.backends.postgresql' else refresh_activities()
+            # The wiki is refreshed by a background job, once the activity is committed
+            from .tasks import refresh_wiki
+            enqueue(refresh_wiki, args=[self.name])
         return ret
 
     def __str__(self):
@@ -308,3 +316,93 @@ class GuestTransaction(Transaction):
     @property
     def type(self):
         return _('Invitation')
+
+
+class Attendee(models.Model):
+    """
+    Index of the members that can attend an open activity, with one line per alias of their note.
+    It is built when the activity is opened and kept up to date by signals, see activity.attendees.
+    """
+    activity = models.ForeignKey(
+        Activity,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name=_("activity"),
+    )
+
+    note = models.ForeignKey(
+        NoteUser,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name=_("note"),
+    )
+
+    alias = models.ForeignKey(
+        Alias,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name=_("alias"),
+    )
+
+    note_name = models.CharField(
+        max_length=255,
+        verbose_name=_("alias"),
+    )
+
+    normalized_name = models.CharField(
+        max_length=255,
+    )
+
+    username = models.CharField(
+        max_length=150,
+        verbose_name=_("username"),
+    )
+
+    last_name = models.CharField(
+        max_length=150,
+        verbose_name=_("last name"),
+    )
+
+    first_name = models.CharField(
+        max_length=150,
+        verbose_name=_("first name"),
+    )
+
+    # Normalized names, that are searched by prefix
+    normalized_last_name = models.CharField(
+        max_length=150,
+    )
+
+    normalized_first_name = models.CharField(
+        max_length=150,
+    )
+
+    membership_start = models.DateField(
+        verbose_name=_("membership starts on"),
+    )
+
+    membership_end = models.DateField(
+        verbose_name=_("membership ends on"),
+    )
+
+    entered = models.BooleanField(
+        default=False,
+        verbose_name=_("entered"),
+    )
+
+    class Meta:
+        verbose_name = _("attendee")
+        verbose_name_plural = _("attendees")
+        unique_together = ('activity', 'alias', )
+        indexes = [
+            # The patterns are only used as prefixes
+            models.Index(fields=['activity', 'normalized_name'], name='activity_attendee_alias_idx',
+                         opclasses=['int4_ops', 'varchar_pattern_ops']),
+            models.Index(fields=['activity', 'normalized_last_name'], name='activity_attendee_last_idx',
+                         opclasses=['int4_ops', 'varchar_pattern_ops']),
+            models.Index(fields=['activity', 'normalized_first_name'], name='activity_attendee_first_idx',
+                         opclasses=['int4_ops', 'varchar_pattern_ops']),
+        ]
+
+    def __str__(self):
+        return f"{self.note_name} ({self.activity})"
@@ -0,0 +1,85 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Keep the index of the attendees of the open activities up to date, see activity.attendees,
+and the cached events of the calendar, see activity.views.CalendarView.
+"""
+
+
+def _open_activities(**filters):
+    from .models import Activity
+    return list(Activity.objects.filter(open=True, **filters))
+
+
+def update_membership_attendees(instance, raw=False, **_kwargs):
+    """
+    A membership is created, changed or deleted: update the line of its user in the activities of its club.
+    """
+    from .attendees import refresh_users
+
+    if raw:
+        return
+    activities = _open_activities(attendees_club_id=instance.club_id)
+    if activities:
+        refresh_users([instance.user_id], activities)
+
+
+def update_alias_attendees(instance, raw=False, **_kwargs):
+    """
+    An alias is created or changed. The deleted aliases are removed from the index by cascade.
+    """
+    from note.models import NoteUser
+    from .attendees import refresh_users
+
+    if raw:
+        return
+    activities = _open_activities()
+    if activities:
+        user_ids = list(NoteUser.objects.filter(pk=instance.note_id).values_list("user_id", flat=True))
+        if user_ids:
+            refresh_users(user_ids, activities)
+
+
+def update_user_attendees(instance, raw=False, update_fields=None, **_kwargs):
+    """
+    The names of a user changed.
+    """
+    from .attendees import refresh_users
+
+    if raw or (update_fields is not None and not {"username", "last_name", "first_name"} & set(update_fields)):
+        # Eg. the last login is updated
+        return
+    activities = _open_activities()
+    if activities:
+        refresh_users([instance.pk], activities)
+
+
+def save_entry_attendee(instance, created=False, raw=False, **_kwargs):
+    from .attendees import set_entered
+
+    if not raw and created and instance.guest_id is None:
+        set_entered(instance.activity_id, instance.note_id, True)
+
+
+def delete_entry_attendee(instance, **_kwargs):
+    from .attendees import set_entered
+
+    if instance.guest_id is None:
+        set_entered(instance.activity_id, instance.note_id, False)
+
+
+def update_club_activities(instance, raw=False, update_fields=None, **_kwargs):
+    """
+    The name of the organizer is in the cached events of the calendar, that are only invalidated
+    by the date of the last update of the activities. Their date is only updated when the club is renamed.
+    """
+    from django.utils import timezone
+    from member.models import Club
+    from .models import Activity
+
+    if raw or instance.pk is None or (update_fields is not None and "name" not in update_fields):
+        return
+    previous_name = Club.objects.filter(pk=instance.pk).values_list("name", flat=True).first()
+    if previous_name is not None and previous_name != instance.name:
+        Activity.objects.filter(organizer_id=instance.pk).update(updated_at=timezone.now())
@@ -9,7 +9,7 @@ import django_tables2 as tables
 from django_tables2 import A
 from note.templatetags.pretty_money import pretty_money
 
-from .models import Activity, Entry, Guest
+from .models import Activity, Guest
 
 
 class ActivityTable(tables.Table):
@@ -66,14 +66,12 @@ def get_row_class(record):
         else:
             c += " table-warning"
     else:
-        qs = Entry.objects.filter(note=record.note, activity=record.activity, guest=None)
-        if qs.exists():
+        # The line of the index of the attendees already knows everything, see activity.attendees
+        if record.entered:
             c += " table-success"
-        elif not record.note.user.memberships.filter(club=record.activity.attendees_club,
-                                                     date_start__lte=timezone.now(),
-                                                     date_end__gte=timezone.now()).exists():
+        elif not record.membership_start <= timezone.localdate() <= record.membership_end:
             c += " table-info"
-        elif record.note.balance < 0:
+        elif record.balance < 0:
             c += " table-danger"
     return c
 
@@ -108,8 +106,8 @@ class EntryTable(tables.Table):
             'class': lambda record: get_row_class(record),
             'id': lambda record: "row-" + ("guest-" if isinstance(record, Guest) else "membership-") + str(record.pk),
             'data-type': lambda record: "guest" if isinstance(record, Guest) else "membership",
-            'data-id': lambda record: record.pk if isinstance(record, Guest) else record.note.pk,
-            'data-inviter': lambda record: record.inviter.pk if isinstance(record, Guest) else "",
+            'data-id': lambda record: record.pk if isinstance(record, Guest) else record.note_id,
+            'data-inviter': lambda record: record.inviter_id if isinstance(record, Guest) else "",
             'data-last-name': lambda record: record.last_name,
             'data-first-name': lambda record: record.first_name,
         }
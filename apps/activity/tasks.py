@@ -0,0 +1,19 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+
+from jobs.queue import task
+
+
+@task
+def refresh_wiki(activity_name):
+    """
+    Update the wiki pages of the activities, once an activity is changed.
+    """
+    from scripts.management.commands.refresh_activities import Command as RefreshActivitiesCommand
+    # Consider that we can update the wiki iff the WIKI_PASSWORD env var is not empty
+    RefreshActivitiesCommand.refresh_human_readable_wiki_page("Modification de l'activité " + activity_name,
+                                                              False, os.getenv("WIKI_PASSWORD"))
+    RefreshActivitiesCommand.refresh_raw_wiki_page("Modification de l'activité " + activity_name,
+                                                   False, os.getenv("WIKI_PASSWORD"))
@@ -0,0 +1,141 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from member.models import Club, Membership
+from note.models import Alias, NoteUser
+
+from ..attendees import search
+from ..models import Activity, ActivityType, Attendee, Entry
+
+
+# The refresh of the activities with the scripts is disabled
+@override_settings(DEBUG=True)
+class TestAttendees(TestCase):
+    """
+    The members that can attend an open activity are searched in an index.
+    """
+    fixtures = ('initial',)
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            username="admintoto",
+            password="tototototo",
+            email="toto@example.com",
+        )
+        self.client.force_login(self.user)
+
+        sess = self.client.session
+        sess["permission_mask"] = 42
+        sess.save()
+
+        # The memberships don't depend on the dates of the fixtures
+        Club.objects.filter(name="BDE").update(membership_start=None, membership_end=None)
+        self.club = Club.objects.get(name="BDE")
+        self.member = User.objects.create(username="tata", last_name="Durand", first_name="Élodie",
+                                          email="tata@example.com")
+        NoteUser.objects.create(user=self.member)
+        Membership.objects.create(user=self.member, club=self.club)
+
+        self.activity = Activity.objects.create(
+            name="Activity",
+            description="Test activity",
+            location="Earth",
+            activity_type=ActivityType.objects.get(name="Soirée"),
+            creater=self.user,
+            organizer=self.club,
+            attendees_club=self.club,
+            date_start=timezone.now(),
+            date_end=timezone.now() + timedelta(days=2),
+            valid=True,
+        )
+
+    def open(self):
+        self.activity.open = True
+        self.activity.save()
+
+    def test_open_close(self):
+        """
+        The index is built when the activity is opened, and dropped when it is closed.
+        """
+        self.assertFalse(Attendee.objects.filter(activity=self.activity).exists())
+        self.open()
+        self.assertTrue(Attendee.objects.filter(activity=self.activity, note=self.member.note).exists())
+        self.activity.open = False
+        self.activity.save()
+        self.assertFalse(Attendee.objects.filter(activity=self.activity).exists())
+
+    def test_search(self):
+        """
+        The members are searched by a prefix of an alias or of their names, without accents.
+        """
+        self.open()
+        Alias.objects.create(note=self.member.note, name="Tatouille")
+        self.assertEqual([a.note_id for a in search(self.activity, "tat")], [self.member.note.pk])
+        self.assertEqual([a.note_id for a in search(self.activity, "dur")], [self.member.note.pk])
+        self.assertEqual([a.note_id for a in search(self.activity, "elo")], [self.member.note.pk])
+        self.assertEqual(search(self.activity, "ouille"), [])
+        self.assertEqual(search(self.activity, ""), [])
+
+        # Constant number of queries
+        Alias.objects.create(note=self.member.note, name="Tatounet")
+        with self.assertNumQueries(1):
+            attendees = search(self.activity, "tat")
+        self.assertEqual(len(attendees), 1)
+        self.member.note.refresh_from_db()
+        self.assertEqual(attendees[0].balance, self.member.note.balance)
+
+        # The hidden aliases are filtered before the results are limited
+        other = User.objects.create(username="tatane", last_name="Zola", first_name="Émile")
+        NoteUser.objects.create(user=other)
+        Membership.objects.create(user=other, club=self.club)
+        self.assertEqual([a.note_id for a in search(self.activity, "tat", limit=1)], [self.member.note.pk])
+        with self.assertNumQueries(1):
+            attendees = search(self.activity, "tat", limit=1, alias_filter=~Q(note=self.member.note))
+        self.assertEqual([a.note_id for a in attendees], [other.note.pk])
+
+    def test_signals(self):
+        """
+        The index follows the memberships, the aliases, the names of the users and the entries.
+        """
+        self.open()
+        other = User.objects.create(username="titi", email="titi@example.com")
+        NoteUser.objects.create(user=other)
+        self.assertEqual(search(self.activity, "titi"), [])
+        membership = Membership.objects.create(user=other, club=self.club)
+        self.assertEqual(len(search(self.activity, "titi")), 1)
+
+        other.last_name = "Martin"
+        other.save()
+        self.assertEqual(len(search(self.activity, "mart")), 1)
+
+        alias = Alias.objects.create(note=other.note, name="Toutou")
+        self.assertEqual(len(search(self.activity, "toutou")), 1)
+        alias.delete()
+        self.assertEqual(search(self.activity, "toutou"), [])
+
+        entry = Entry.objects.create(activity=self.activity, note=other.note)
+        self.assertTrue(search(self.activity, "titi")[0].entered)
+        entry.delete()
+        self.assertFalse(search(self.activity, "titi")[0].entered)
+
+        # The membership ends
+        membership.date_end = timezone.localdate() - timedelta(days=1)
+        membership.save()
+        self.assertEqual(search(self.activity, "titi"), [])
+
+    def test_entry_view(self):
+        """
+        The entry page displays the members found in the index.
+        """
+        self.open()
+        response = self.client.get(reverse("activity:activity_entry", args=(self.activity.pk,)) + "?search=dura")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Durand")
+        self.assertContains(response, f'data-id="{self.member.note.pk}"')
@@ -0,0 +1,101 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from member.models import Club
+
+from ..models import Activity, ActivityType
+
+
+# The refresh of the activities with the scripts is disabled
+@override_settings(DEBUG=True, CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class TestCalendar(TestCase):
+    """
+    The calendar is assembled from the cached events, and revalidated with its ETag.
+    """
+    fixtures = ('initial',)
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create(username="toto")
+        self.activity = Activity.objects.create(
+            name="Activity",
+            description="This is a test activity\non two lines",
+            location="Earth",
+            activity_type=ActivityType.objects.get(name="Soirée"),
+            creater=user,
+            organizer=Club.objects.get(name="BDE"),
+            attendees_club=Club.objects.get(name="BDE"),
+            date_start=timezone.now(),
+            date_end=timezone.now() + timedelta(days=2),
+            valid=True,
+        )
+
+    def get(self, **kwargs):
+        response = self.client.get(reverse("activity:calendar_ics"), **kwargs)
+        content = b"".join(response.streaming_content).decode("UTF-8") if response.status_code == 200 else ""
+        return response, content
+
+    def test_calendar(self):
+        response, content = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(content.startswith("BEGIN:VCALENDAR\r\n"))
+        self.assertTrue(content.endswith("END:VEVENT\r\nEND:VCALENDAR"))
+        self.assertIn("SUMMARY;CHARSET=UTF-8:Activity\r\n", content)
+        self.assertIn(" -- BDE\r\n", content)
+
+    def test_cached_events(self):
+        """
+        A warm calendar doesn't fetch the activities, and an update is visible immediately.
+        """
+        with CaptureQueriesContext(connection) as cold:
+            self.get()
+        with CaptureQueriesContext(connection) as warm:
+            self.get()
+        # Only the cold calendar fetches the activities with their organizers
+        self.assertTrue(any("member_club" in query["sql"] for query in cold.captured_queries))
+        self.assertFalse(any("member_club" in query["sql"] for query in warm.captured_queries))
+
+        self.activity.name = "Renamed activity"
+        self.activity.save()
+        _response, content = self.get()
+        self.assertIn("Renamed activity", content)
+
+        # The name of the organizer is in the cached event
+        club = self.activity.organizer
+        updated_at = Activity.objects.get(pk=self.activity.pk).updated_at
+        club.save()
+        self.assertEqual(Activity.objects.get(pk=self.activity.pk).updated_at, updated_at)
+        club.name = "Renamed club"
+        club.save()
+        _response, content = self.get()
+        self.assertIn(" -- Renamed club\r\n", content)
+
+    def test_conditional_get(self):
+        response, _content = self.get()
+        self.assertTrue(response.has_header("Last-Modified"))
+        etag = response["ETag"]
+        response, _content = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Activity.objects.filter(pk=self.activity.pk).update(updated_at=timezone.now() + timedelta(seconds=1))
+        response, _content = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_window(self):
+        _response, content = self.get(data={"since": (timezone.localdate() + timedelta(days=3)).isoformat()})
+        self.assertNotIn("BEGIN:VEVENT", content)
+        _response, content = self.get(data={"since": timezone.localdate().isoformat(),
+                                            "until": timezone.localdate().isoformat()})
+        self.assertIn("BEGIN:VEVENT", content)
+        response, _content = self.get(data={"until": "yesterday"})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,134 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from member.models import Club
+from note.models import Note, NoteUser
+
+from ..bulk import register_entries
+from ..models import Activity, ActivityType, Entry, Guest, GuestTransaction
+
+
+# The refresh of the activities with the scripts is disabled
+@override_settings(DEBUG=True)
+class TestEntryBatch(TestCase):
+    """
+    The entries of the queue at the door are registered at once.
+    """
+    fixtures = ('initial',)
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            username="admintoto",
+            password="tototototo",
+            email="toto@example.com",
+        )
+        self.client.force_login(self.user)
+
+        sess = self.client.session
+        sess["permission_mask"] = 42
+        sess.save()
+
+        self.club = Club.objects.get(name="BDE")
+        self.activity = Activity.objects.create(
+            name="Activity",
+            description="Test activity",
+            location="Earth",
+            activity_type=ActivityType.objects.get(name="Soirée"),
+            creater=self.user,
+            organizer=self.club,
+            attendees_club=self.club,
+            date_start=timezone.now() + timedelta(days=1),
+            date_end=timezone.now() + timedelta(days=2),
+            valid=True,
+            open=True,
+        )
+        self.notes = []
+        for i in range(6):
+            user = User.objects.create(username=f"member{i}", email=f"member{i}@example.com")
+            self.notes.append(NoteUser.objects.create(user=user))
+        Note.objects.filter(pk=self.notes[0].pk).update(balance=800)
+
+    def test_register_entries(self):
+        """
+        Each person gets a result, and the guests are charged to their inviters.
+        """
+        first_guest = Guest.objects.create(activity=self.activity, inviter=self.notes[0],
+                                           last_name="GUEST", first_name="First")
+        second_guest = Guest.objects.create(activity=self.activity, inviter=self.notes[0],
+                                            last_name="GUEST", first_name="Second")
+        Note.objects.filter(pk=self.notes[1].pk).update(balance=-100)
+        Entry.objects.create(activity=self.activity, note=self.notes[2])
+        organizer_balance = self.club.note.balance
+
+        results = register_entries(None, self.activity, [
+            {"note": self.notes[0].pk},
+            {"note": self.notes[1].pk},
+            {"note": self.notes[2].pk},
+            {"note": self.notes[3].pk},
+            {"note": self.notes[3].pk},
+            {"guest": first_guest.pk},
+            {"guest": second_guest.pk},
+            {"note": self.club.note.pk},
+        ])
+
+        self.assertEqual([result["entry"] is not None for result in results],
+                         [True, False, False, True, False, True, True, False])
+        self.assertEqual(results[1]["error"], "The balance is negative.")
+        self.assertTrue(results[2]["error"].startswith("Already entered on "))
+        self.assertTrue(results[4]["error"].startswith("Already entered on "))
+        self.assertEqual(results[5]["note"], self.notes[0].pk)
+        self.assertEqual(Entry.objects.filter(activity=self.activity).count(), 5)
+
+        # Two fees of 5 €, with one balance update for the inviter
+        self.assertEqual(GuestTransaction.objects.filter(entry__activity=self.activity).count(), 2)
+        self.notes[0].refresh_from_db()
+        self.assertEqual(self.notes[0].balance, -200)
+        self.club.note.refresh_from_db()
+        self.assertEqual(self.club.note.balance, organizer_balance + 1000)
+
+        # The inviter is now negative
+        third_guest = Guest.objects.create(activity=self.activity, inviter=self.notes[0],
+                                           last_name="GUEST", first_name="Third")
+        results = register_entries(None, self.activity, [{"guest": third_guest.pk}])
+        self.assertEqual(results[0]["error"], "The balance is negative.")
+
+    def test_constant_queries(self):
+        """
+        The number of queries doesn't depend on the number of members.
+        """
+        with CaptureQueriesContext(connection) as ctx:
+            register_entries(None, self.activity, [{"note": note.pk} for note in self.notes[:2]])
+        with self.assertNumQueries(len(ctx.captured_queries)):
+            register_entries(None, self.activity, [{"note": note.pk} for note in self.notes[2:]])
+        self.assertEqual(Entry.objects.filter(activity=self.activity).count(), 6)
+
+    def test_api(self):
+        """
+        The batch is posted to the API of the activity.
+        """
+        guest = Guest.objects.create(activity=self.activity, inviter=self.notes[0],
+                                     last_name="GUEST", first_name="Guest")
+        response = self.client.post(f"/api/activity/activity/{self.activity.pk}/entries/", {"people": [
+            {"note": self.notes[1].pk},
+            {"guest": guest.pk},
+        ]}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 2)
+        self.assertEqual(response.data["results"][1]["note"], self.notes[0].pk)
+        self.assertTrue(GuestTransaction.objects.filter(entry_id=response.data["results"][1]["entry"]).exists())
+
+        response = self.client.post(f"/api/activity/activity/{self.activity.pk}/entries/",
+                                    {"people": [{"note": 1, "guest": 1}]}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+        Activity.objects.filter(pk=self.activity.pk).update(open=False)
+        response = self.client.post(f"/api/activity/activity/{self.activity.pk}/entries/",
+                                    {"people": [{"note": self.notes[2].pk}]}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
@@ -1,27 +1,29 @@
 # Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+from datetime import datetime, time, timedelta
 from hashlib import md5
 
-from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import PermissionDenied
+from django.core.cache import cache
 from django.db import transaction
-from django.db.models import F, Q
-from django.http import HttpResponse
+from django.db.models import Count, F, Max, Q
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
 from django.urls import reverse_lazy
 from django.utils import timezone
-from django.utils.decorators import method_decorator
+from django.utils.dateparse import parse_date
 from django.utils.translation import gettext_lazy as _
 from django.views import View
-from django.views.decorators.cache import cache_page
+from django.views.decorators.http import condition
 from django.views.generic import DetailView, TemplateView, UpdateView
 from django_tables2.views import SingleTableView
 from note.models import Alias, NoteSpecial, NoteUser
 from permission.backends import PermissionBackend
 from permission.views import ProtectQuerysetMixin, ProtectedCreateView
 
+from .attendees import ensure_index, search as search_attendees
 from .forms import ActivityForm, GuestForm
 from .models import Activity, Entry, Guest
 from .tables import ActivityTable, EntryTable, GuestTable
@@ -66,9 +68,6 @@ class ActivityListView(ProtectQuerysetMixin, LoginRequiredMixin, SingleTableView
     ordering = ('-date_start',)
     extra_context = {"title": _("Activities")}
 
-    def get_queryset(self, **kwargs):
-        return super().get_queryset(**kwargs).distinct()
-
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
@@ -78,7 +77,7 @@ class ActivityListView(ProtectQuerysetMixin, LoginRequiredMixin, SingleTableView
             prefix='upcoming-',
         )
 
-        started_activities = self.get_queryset().filter(open=True, valid=True).distinct().all()
+        started_activities = self.get_queryset().filter(open=True, valid=True).all()
         context["started_activities"] = started_activities
 
         return context
@@ -190,6 +189,7 @@ class ActivityEntryView(LoginRequiredMixin, TemplateView):
         """
 
         guest_qs = Guest.objects\
+            .select_related("entry")\
             .annotate(balance=F("inviter__balance"), note_name=F("inviter__user__username"))\
             .filter(activity=activity)\
             .filter(PermissionBackend.filter_queryset(self.request, Guest, "view"))\
@@ -213,43 +213,15 @@ class ActivityEntryView(LoginRequiredMixin, TemplateView):
         """
         Retrieves all Note that can attend the activity,
         they need to have an up-to-date membership in the attendees_club.
+        The members are searched in the index of the attendees, see activity.attendees.
         """
-        note_qs = Alias.objects.annotate(last_name=F("note__noteuser__user__last_name"),
-                                         first_name=F("note__noteuser__user__first_name"),
-                                         username=F("note__noteuser__user__username"),
-                                         note_name=F("name"),
-                                         balance=F("note__balance"))
-
-        # Keep only users that have a note
-        note_qs = note_qs.filter(note__noteuser__isnull=False)
-
-        # Keep only members
-        note_qs = note_qs.filter(
-            note__noteuser__user__memberships__club=activity.attendees_club,
-            note__noteuser__user__memberships__date_start__lte=timezone.now(),
-            note__noteuser__user__memberships__date_end__gte=timezone.now(),
-        )
+        if "search" not in self.request.GET or not self.request.GET["search"]:
+            return []
 
-        # Filter with permission backend
-        note_qs = note_qs.filter(PermissionBackend.filter_queryset(self.request, Alias, "view"))
-
-        if "search" in self.request.GET and self.request.GET["search"]:
-            pattern = self.request.GET["search"]
-            note_qs = note_qs.filter(
-                Q(note__noteuser__user__first_name__iregex=pattern)
-                | Q(note__noteuser__user__last_name__iregex=pattern)
-                | Q(name__iregex=pattern)
-                | Q(normalized_name__iregex=Alias.normalize(pattern))
-            )
-        else:
-            note_qs = note_qs.none()
-
-        # SQLite doesn't support distinct fields. For compatibility reason (in dev mode), the note list will only
-        # have distinct aliases rather than distinct notes with a SQLite DB, but it can fill the result page.
-        # In production mode, please use PostgreSQL.
-        note_qs = note_qs.distinct('note__pk')[:20]\
-            if settings.DATABASES[note_qs.db]["ENGINE"] == 'django.db.backends.postgresql' else note_qs.distinct()[:20]
-        return note_qs
+        ensure_index(activity)
+        # Filter with permission backend in the same query, before the results are limited
+        return search_attendees(activity, self.request.GET["search"],
+                                alias_filter=PermissionBackend.filter_queryset(self.request, Alias, "view"))
 
     def get_context_data(self, **kwargs):
         """
@@ -258,7 +230,7 @@ class ActivityEntryView(LoginRequiredMixin, TemplateView):
         context = super().get_context_data(**kwargs)
 
         activity = Activity.objects.filter(PermissionBackend.filter_queryset(self.request, Activity, "view"))\
-            .distinct().get(pk=self.kwargs["pk"])
+            .get(pk=self.kwargs["pk"])
         context["activity"] = activity
 
         matched = []
@@ -269,20 +241,19 @@ class ActivityEntryView(LoginRequiredMixin, TemplateView):
 
         for note in self.get_invited_note(activity):
             note.type = "Adhérent"
-            note.activity = activity
             matched.append(note)
 
         table = EntryTable(data=matched)
         context["table"] = table
 
-        context["entries"] = Entry.objects.filter(activity=activity)
+        context["entries_count"] = Entry.objects.filter(activity=activity).count()
 
         context["title"] = _('Entry for activity "{}"').format(activity.name)
         context["noteuser_ctype"] = ContentType.objects.get_for_model(NoteUser).pk
         context["notespecial_ctype"] = ContentType.objects.get_for_model(NoteSpecial).pk
 
         activities_open = Activity.objects.filter(open=True).filter(
-            PermissionBackend.filter_queryset(self.request, Activity, "view")).distinct().all()
+            PermissionBackend.filter_queryset(self.request, Activity, "view")).all()
         context["activities_open"] = [a for a in activities_open
                                       if PermissionBackend.check_perm(self.request,
                                                                       "activity.add_entry",
@@ -291,24 +262,14 @@ class ActivityEntryView(LoginRequiredMixin, TemplateView):
         return context
 
 
-# Cache for 1 hour
-@method_decorator(cache_page(60 * 60), name='dispatch')
 class CalendarView(View):
     """
     Render an ICS calendar with all valid activities.
+    The event of each activity is cached until the activity is updated, and the calendar is streamed.
+    Clients revalidate the calendar with its ETag or its last modification date.
+    The optional parameters "since" and "until" (YYYY-MM-DD) only keep the activities of this window.
     """
-
-    def multilines(self, string, maxlength, offset=0):
-        newstring = string[:maxlength - offset]
-        string = string[maxlength - offset:]
-        while string:
-            newstring += "\r\n "
-            newstring += string[:maxlength - 1]
-            string = string[maxlength - 1:]
-        return newstring
-
-    def get(self, request, *args, **kwargs):
-        ics = """BEGIN:VCALENDAR
+    HEADER = """BEGIN:VCALENDAR
 VERSION: 2.0
 PRODID:Note Kfet 2020
 X-WR-CALNAME:Kfet Calendar
@@ -333,18 +294,99 @@ RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU
 END:STANDARD
 END:VTIMEZONE
 """
-        for activity in Activity.objects.filter(valid=True).order_by("-date_start").all():
-            ics += f"""BEGIN:VEVENT
+
+    FOOTER = "END:VCALENDAR"
+
+    # Number of events that are read from the cache at once
+    CHUNK_SIZE = 500
+
+    # The events of old activities are forgotten after a week, the key of an event changes when it is updated
+    EVENT_TIMEOUT = 60 * 60 * 24 * 7
+
+    def get_queryset(self):
+        """
+        Select the valid activities of the window of the request.
+        :raise ValueError: if a date is invalid
+        """
+        activities = Activity.objects.filter(valid=True)
+        for param in ("since", "until"):
+            if self.request.GET.get(param):
+                day = parse_date(self.request.GET[param])
+                if day is None:
+                    raise ValueError(param)
+                bound = timezone.make_aware(datetime.combine(day, time.min))
+                if param == "since":
+                    activities = activities.filter(date_end__gte=bound)
+                else:
+                    activities = activities.filter(date_start__lt=bound + timedelta(days=1))
+        return activities
+
+    def multilines(self, string, maxlength, offset=0):
+        newstring = string[:maxlength - offset]
+        string = string[maxlength - offset:]
+        while string:
+            newstring += "\r\n "
+            newstring += string[:maxlength - 1]
+            string = string[maxlength - 1:]
+        return newstring
+
+    @staticmethod
+    def get_event_key(pk, updated_at):
+        # A renamed organizer also updates its activities, see activity.signals.update_club_activities
+        return f"activity_ics_{pk}_{updated_at.timestamp()}"
+
+    def render_event(self, activity):
+        ics = f"""BEGIN:VEVENT
 DTSTAMP:{"{:%Y%m%dT%H%M%S}".format(activity.date_start)}Z
 UID:{md5((activity.name + "$" + str(activity.id) + str(activity.date_start)).encode("UTF-8")).hexdigest()}
 SUMMARY;CHARSET=UTF-8:{self.multilines(activity.name, 75, 22)}
 DTSTART;TZID=Europe/Berlin:{"{:%Y%m%dT%H%M%S}".format(activity.date_start)}
 DTEND;TZID=Europe/Berlin:{"{:%Y%m%dT%H%M%S}".format(activity.date_end)}
 LOCATION:{self.multilines(activity.location, 75, 9) if activity.location else "BDA"}
-DESCRIPTION;CHARSET=UTF-8:""" + self.multilines(activity.description.replace("\n", "\\n"), 75, 26) + """
+DESCRIPTION;CHARSET=UTF-8:""" + self.multilines(activity.description.replace("\n", "\\n"), 75, 26) + f"""
  -- {activity.organizer.name}
 END:VEVENT
 """
-        ics += "END:VCALENDAR"
-        ics = ics.replace("\r", "").replace("\n", "\r\n")
-        return HttpResponse(ics, content_type="text/calendar; charset=UTF-8")
+        return ics.replace("\r", "").replace("\n", "\r\n")
+
+    def get_events(self):
+        """
+        Yield the events of the activities, from the cache when they didn't change.
+        Only the activities whose event is missing are fetched.
+        """
+        keys = [(pk, self.get_event_key(pk, updated_at)) for pk, updated_at
+                in self.activities.order_by("-date_start").values_list("pk", "updated_at")]
+        for i in range(0, len(keys), self.CHUNK_SIZE):
+            chunk = keys[i:i + self.CHUNK_SIZE]
+            events = cache.get_many([key for _pk, key in chunk])
+            missing = [pk for pk, key in chunk if key not in events]
+            if missing:
+                rendered = {}
+                for activity in Activity.objects.filter(pk__in=missing).select_related("organizer"):
+                    rendered[self.get_event_key(activity.pk, activity.updated_at)] = self.render_event(activity)
+                cache.set_many(rendered, self.EVENT_TIMEOUT)
+                events.update(rendered)
+            for _pk, key in chunk:
+                if key in events:
+                    yield events[key]
+
+    def get_calendar(self):
+        yield self.HEADER.replace("\n", "\r\n")
+        yield from self.get_events()
+        yield self.FOOTER
+
+    def get(self, request, *args, **kwargs):
+        try:
+            self.activities = self.get_queryset()
+        except ValueError:
+            return HttpResponseBadRequest(_("The dates must have the format YYYY-MM-DD."))
+
+        # The conditional headers are computed with one query
+        state = self.activities.aggregate(last_update=Max("updated_at"), count=Count("pk"))
+        etag = md5(f"{state['last_update']}${state['count']}${request.GET.urlencode()}".encode("UTF-8")).hexdigest()
+
+        @condition(etag_func=lambda _request: etag, last_modified_func=lambda _request: state["last_update"])
+        def calendar(_request):
+            return StreamingHttpResponse(self.get_calendar(), content_type="text/calendar; charset=UTF-8")
+
+        return calendar(request)
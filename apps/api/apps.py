@@ -2,9 +2,29 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
 from django.utils.translation import gettext_lazy as _
 
 
 class APIConfig(AppConfig):
     name = 'api'
     verbose_name = _('API')
+
+    def ready(self):
+        """
+        Keep the API token cache up to date
+        """
+        from . import signals
+        post_save.connect(
+            signals.invalidate_token_cache,
+            sender="authtoken.Token",
+        )
+        post_delete.connect(
+            signals.invalidate_token_cache,
+            sender="authtoken.Token",
+        )
+        post_save.connect(
+            signals.invalidate_user_tokens_cache,
+            sender=settings.AUTH_USER_MODEL,
+        )
@@ -0,0 +1,51 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+TOKEN_CACHE_PREFIX = "api_token_"
+
+
+def get_token_user(key):
+    """
+    Return the user that owns the given API token, or None if the token does not exist.
+    The result is stored in the shared cache, in order to avoid to query the database for each API call.
+    """
+    cache_key = TOKEN_CACHE_PREFIX + key
+    user = cache.get(cache_key)
+    if user is None:
+        token = Token.objects.select_related("user").filter(key=key).first()
+        if token is None:
+            return None
+        user = token.user
+        cache.set(cache_key, user, getattr(settings, "API_TOKEN_CACHE_TIMEOUT", 300))
+    return user
+
+
+def invalidate_token(key):
+    """
+    Drop the given token from the cache. Must be called when a token is deleted or regenerated.
+    """
+    cache.delete(TOKEN_CACHE_PREFIX + key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Same as the default token authentication of Django REST Framework,
+    but the owner of the token is read from the cache.
+    """
+
+    def authenticate_credentials(self, key):
+        user = get_token_user(key)
+        if user is None:
+            raise AuthenticationFailed(_("Invalid token."))
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User inactive or deleted."))
+
+        return user, Token(key=key, user=user)
@@ -0,0 +1,21 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from .authentication import invalidate_token
+
+
+def invalidate_token_cache(instance, **_kwargs):
+    """
+    When a token is created, regenerated or deleted, drop its cached owner
+    """
+    invalidate_token(instance.key)
+
+
+def invalidate_user_tokens_cache(instance, raw, **_kwargs):
+    """
+    When an user is updated, the cached copies of this user are outdated
+    """
+    if not raw:
+        from rest_framework.authtoken.models import Token
+        for key in Token.objects.filter(user_id=instance.pk).values_list("key", flat=True):
+            invalidate_token(key)
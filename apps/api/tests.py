@@ -9,15 +9,20 @@ from warnings import warn
 
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
 from django.db.models.fields.files import ImageFieldFile
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.urls import reverse
 from django_filters.rest_framework import DjangoFilterBackend
 from member.models import Membership, Club
 from note.models import NoteClub, NoteUser, Alias, Note
 from permission.models import PermissionMask, Permission, Role
 from phonenumbers import PhoneNumber
+from rest_framework.authtoken.models import Token
 from rest_framework.filters import SearchFilter, OrderingFilter
 
+from .authentication import TOKEN_CACHE_PREFIX, get_token_user
 from .viewsets import ContentTypeViewSet, UserViewSet
 
 
@@ -238,3 +243,59 @@ class TestBasicAPI(TestAPI):
         """
         self.check_viewset(ContentTypeViewSet, "/api/models/")
         self.check_viewset(UserViewSet, "/api/user/")
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class TestTokenAuthentication(TestCase):
+    """
+    Check that the API can be used with an authentication token, without any session.
+    """
+    fixtures = ('initial', )
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create_superuser(
+            username="tokenapi",
+            password="tokenapi",
+            email="tokenapi@example.com",
+        )
+        self.token = Token.objects.create(user=self.user)
+
+    def test_token_authentication(self):
+        """
+        A token grants access to the API with full rights, but doesn't create any session.
+        """
+        resp = self.client.get(f"/api/user/{self.user.pk}/", HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(cache.get(TOKEN_CACHE_PREFIX + self.token.key), self.user)
+        self.assertFalse(Session.objects.exists())
+
+        # The owner of the token is now cached
+        with self.assertNumQueries(0):
+            self.assertEqual(get_token_user(self.token.key), self.user)
+
+        resp = self.client.get(f"/api/user/{self.user.pk}/", HTTP_AUTHORIZATION="Token invalid")
+        self.assertEqual(resp.status_code, 403)
+
+    def test_token_regeneration(self):
+        """
+        Regenerating a token invalidates the cached owner of the old token.
+        """
+        resp = self.client.get(f"/api/user/{self.user.pk}/", HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.assertEqual(resp.status_code, 200)
+
+        self.client.force_login(self.user)
+        sess = self.client.session
+        sess["permission_mask"] = 42
+        sess.save()
+        resp = self.client.get(reverse("member:auth_token") + "?regenerate")
+        self.assertRedirects(resp, reverse("member:auth_token") + "?show", 302, 200)
+        self.client.logout()
+
+        self.assertIsNone(cache.get(TOKEN_CACHE_PREFIX + self.token.key))
+        resp = self.client.get(f"/api/user/{self.user.pk}/", HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.assertEqual(resp.status_code, 403)
+
+        new_token = Token.objects.get(user=self.user)
+        resp = self.client.get(f"/api/user/{self.user.pk}/", HTTP_AUTHORIZATION=f"Token {new_token.key}")
+        self.assertEqual(resp.status_code, 200)
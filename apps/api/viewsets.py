@@ -24,7 +24,7 @@ class ReadProtectedModelViewSet(ModelViewSet):
         self.model = ContentType.objects.get_for_model(self.serializer_class.Meta.model).model_class()
 
     def get_queryset(self):
-        return self.queryset.filter(PermissionBackend.filter_queryset(self.request, self.model, "view")).distinct()
+        return self.queryset.filter(PermissionBackend.filter_queryset(self.request, self.model, "view"))
 
 
 class ReadOnlyProtectedModelViewSet(ReadOnlyModelViewSet):
@@ -37,7 +37,7 @@ class ReadOnlyProtectedModelViewSet(ReadOnlyModelViewSet):
         self.model = ContentType.objects.get_for_model(self.serializer_class.Meta.model).model_class()
 
     def get_queryset(self):
-        return self.queryset.filter(PermissionBackend.filter_queryset(self.request, self.model, "view")).distinct()
+        return self.queryset.filter(PermissionBackend.filter_queryset(self.request, self.model, "view"))
 
 
 class UserViewSet(ReadProtectedModelViewSet):
@@ -0,0 +1,25 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from django.contrib import admin
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from note_kfet.admin import admin_site
+
+from .models import Job
+
+
+@admin.register(Job, site=admin_site)
+class JobAdmin(admin.ModelAdmin):
+    """
+    Admin customisation for Job
+    """
+    list_display = ('name', 'status', 'priority', 'run_at', 'attempts', 'max_attempts', 'finished_at', )
+    list_filter = ('status', 'name', )
+    ordering = ('-created_at', )
+    readonly_fields = ('worker', 'created_at', 'started_at', 'finished_at', 'last_error', )
+    actions = ('retry', )
+
+    @admin.action(description=_("Retry the selected jobs now"))
+    def retry(self, request, queryset):
+        queryset.exclude(status=Job.RUNNING).update(status=Job.PENDING, run_at=timezone.now(), attempts=0)
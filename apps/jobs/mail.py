@@ -0,0 +1,131 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Dispatch the mails that are queued by django-mailer.
+
+The command send_mail of django-mailer opens a new SMTP connection at each run, and sends the whole queue
+one message at a time. The command dispatch_mail keeps its SMTP connections open between the batches,
+and sends the messages as soon as they are queued. The bookkeeping of a batch (deleting the sent messages,
+deferring the failed ones, logging the attempts) is done with a few queries.
+"""
+
+import logging
+import smtplib
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+from mailer.engine import ensure_message_id
+from mailer.models import PRIORITY_DEFERRED, RESULT_FAILURE, RESULT_SUCCESS, Message, MessageLog, get_message_id
+
+logger = logging.getLogger(__name__)
+
+
+def get_mail_connection():
+    """
+    Return a connection to the backend that really sends the mails, see MAILER_EMAIL_BACKEND.
+    """
+    return get_connection(backend=getattr(settings, "MAILER_EMAIL_BACKEND",
+                                          "django.core.mail.backends.smtp.EmailBackend"))
+
+
+def get_queue_stats():
+    """
+    Measure the queue of the mails, in one query.
+    :return: A dictionary with the number of messages that are waiting to be sent ("queued"),
+             the number of deferred messages ("deferred") and the age in seconds of the oldest queued message.
+    """
+    stats = Message.objects.aggregate(
+        queued=Count("pk", filter=~Q(priority=PRIORITY_DEFERRED)),
+        deferred=Count("pk", filter=Q(priority=PRIORITY_DEFERRED)),
+        oldest=Min("when_added", filter=~Q(priority=PRIORITY_DEFERRED)),
+    )
+    oldest = stats.pop("oldest")
+    stats["oldest_age"] = round((timezone.now() - oldest).total_seconds()) if oldest else 0
+    return stats
+
+
+def get_next_messages(limit):
+    """
+    Return the next messages to send, in the order of django-mailer.
+    """
+    return list(Message.objects.non_deferred().order_by("priority", "when_added", "pk")[:limit])
+
+
+class RateLimiter:
+    """
+    Limit the number of mails that are sent per second, shared by the threads of the dispatcher.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.next_time = max(self.next_time, now)
+            delay = self.next_time - now
+            self.next_time += self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def send_messages(connection, messages, limiter=None):
+    """
+    Send a batch of messages on an open connection, that is reopened if the server drops it.
+    The sent messages are deleted, and the messages that could not be delivered are deferred,
+    then retried by the command retry_deferred, as with django-mailer.
+    :return: The number of sent messages and the number of deferred messages
+    """
+    sent, deferred, logs = [], [], []
+    log_message_data = getattr(settings, "MAILER_EMAIL_LOG_MESSAGE_DATA", True)
+
+    try:
+        for message in messages:
+            email = message.email
+            if email is None:
+                logger.warning("The message %s is discarded, it can't be loaded from the database.", message.pk)
+                sent.append(message.pk)
+                continue
+
+            if limiter is not None:
+                limiter.wait()
+            try:
+                ensure_message_id(email)
+                connection.open()
+                connection.send_messages([email])
+            except (smtplib.SMTPException, OSError) as exc:
+                logger.info("The message %s is deferred: %s", message.pk, exc)
+                deferred.append(message.pk)
+                result, log_message = RESULT_FAILURE, str(exc)
+                # The next message is sent with a new connection
+                connection.close()
+            else:
+                sent.append(message.pk)
+                result, log_message = RESULT_SUCCESS, ""
+
+            logs.append(MessageLog(
+                message_data=message.message_data if log_message_data else None,
+                message_id=get_message_id(email),
+                when_added=message.when_added,
+                priority=message.priority,
+                result=result,
+                log_message=log_message,
+            ))
+    finally:
+        # The messages that are already sent are never sent twice, even if an unexpected error is raised
+        with transaction.atomic():
+            MessageLog.objects.bulk_create(logs)
+            Message.objects.filter(pk__in=sent).delete()
+            Message.objects.filter(pk__in=deferred).update(priority=PRIORITY_DEFERRED)
+
+    return len(logs) - len(deferred), len(deferred)
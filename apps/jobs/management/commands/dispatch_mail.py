@@ -0,0 +1,131 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+import logging
+import signal
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connections
+from mailer.engine import acquire_lock, release_lock
+
+from ...mail import RateLimiter, get_mail_connection, get_next_messages, get_queue_stats, send_messages
+
+logger = logging.getLogger("jobs.mail")
+
+
+class Command(BaseCommand):
+    help = "Send the queued mails continuously, keeping the SMTP connections open between the batches. " \
+           "It replaces the cron job send_mail. Example: ./manage.py dispatch_mail --connections 2 --rate 10"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', '-c', type=int, default=1,
+                            help="Number of SMTP connections that send mails at the same time.")
+        parser.add_argument('--batch-size', '-b', type=int, default=100,
+                            help="Number of mails that are sent on a connection before the queue is read again.")
+        parser.add_argument('--rate', '-r', type=float, default=0,
+                            help="Maximal number of mails sent per second, by all the connections. "
+                                 "0 means no limit.")
+        parser.add_argument('--interval', '-i', type=float, default=1,
+                            help="Number of seconds to wait when the queue is empty.")
+        parser.add_argument('--idle-timeout', type=float, default=60,
+                            help="Close the SMTP connections after this number of seconds without mail.")
+        parser.add_argument('--stats-interval', type=float, default=60,
+                            help="Log the size of the queue every this number of seconds.")
+        parser.add_argument('--burst', action='store_true',
+                            help="Stop once the queue is empty, instead of waiting for new mails.")
+        parser.add_argument('--stats', action='store_true',
+                            help="Only print the size of the queue, in JSON, eg. for a monitoring probe.")
+
+    def handle(self, *args, **options):
+        if options["stats"]:
+            self.stdout.write(json.dumps(get_queue_stats()))
+            return
+
+        # The cron job send_mail of django-mailer and the dispatcher don't send the same queue at the same time
+        use_file_lock = getattr(settings, "MAILER_USE_FILE_LOCK", True)
+        if use_file_lock:
+            acquired, lock = acquire_lock()
+            if not acquired:
+                raise CommandError("The mails are already sent by another process.")
+
+        self.stop = threading.Event()
+        self.results = Counter()
+
+        previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                previous_handlers[signum] = signal.signal(signum, self.shutdown)
+
+        try:
+            self.dispatch(options)
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+            if use_file_lock:
+                release_lock(lock)
+
+        if options["verbosity"] >= 1:
+            self.stdout.write(f"{self.results['sent']} mails sent, {self.results['deferred']} mails deferred.")
+
+    def shutdown(self, _signum, _frame):
+        self.stderr.write("Stopping once the current batches are sent…")
+        self.stop.set()
+
+    def dispatch(self, options):
+        count = max(options["connections"], 1)
+        batch_size = max(options["batch_size"], 1)
+        limiter = RateLimiter(options["rate"])
+        mail_connections = [get_mail_connection() for _ in range(count)]
+        executor = ThreadPoolExecutor(max_workers=count, thread_name_prefix="mail-sender") if count > 1 else None
+        last_mail = last_stats = time.monotonic()
+
+        try:
+            while not self.stop.is_set():
+                now = time.monotonic()
+                if now - last_stats >= options["stats_interval"]:
+                    logger.info("Mail queue: %(queued)s queued, %(deferred)s deferred, "
+                                "the oldest mail is waiting for %(oldest_age)s seconds.", get_queue_stats())
+                    last_stats = now
+
+                messages = get_next_messages(count * batch_size)
+                if not messages:
+                    if options["burst"]:
+                        return
+                    if now - last_mail >= options["idle_timeout"]:
+                        # Don't let the server close the idle connections
+                        for connection in mail_connections:
+                            connection.close()
+                    self.stop.wait(options["interval"])
+                    continue
+
+                # The mails are shared between the connections, each one sends its batch in its own thread
+                size = -(-len(messages) // count)
+                batches = [messages[i:i + size] for i in range(0, len(messages), size)]
+                if executor is None:
+                    results = [send_messages(mail_connections[0], batches[0], limiter)]
+                else:
+                    results = executor.map(self.send_in_thread, mail_connections, batches,
+                                           [limiter] * len(batches))
+                for sent, deferred in results:
+                    self.results["sent"] += sent
+                    self.results["deferred"] += deferred
+                last_mail = time.monotonic()
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            for connection in mail_connections:
+                connection.close()
+
+    @staticmethod
+    def send_in_thread(connection, messages, limiter):
+        try:
+            return send_messages(connection, messages, limiter)
+        finally:
+            # Each thread has its own database connections
+            connections.close_all()
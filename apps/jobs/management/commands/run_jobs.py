@@ -0,0 +1,82 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import signal
+import socket
+import threading
+from collections import Counter
+
+from django.core.management import BaseCommand
+from django.db import connections
+
+from ...queue import claim_job, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = "Run the background jobs. The workers stop gracefully on SIGINT or SIGTERM, " \
+           "once their current job is done. Example: ./manage.py run_jobs --concurrency 4"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', '-c', type=int, default=1,
+                            help="Number of jobs that are run at the same time, each in its own thread.")
+        parser.add_argument('--interval', '-i', type=float, default=1,
+                            help="Number of seconds to wait when no job is ready.")
+        parser.add_argument('--burst', '-b', action='store_true',
+                            help="Stop once no job is ready, instead of waiting for new jobs.")
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        self.results = Counter()
+        self.lock = threading.Lock()
+        name = f"{socket.gethostname()}:{os.getpid()}"
+
+        previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                previous_handlers[signum] = signal.signal(signum, self.shutdown)
+
+        try:
+            count = requeue_stale_jobs()
+            if count and options["verbosity"] >= 1:
+                self.stdout.write(f"{count} stale jobs are put back in the queue.")
+
+            if options["concurrency"] <= 1:
+                self.work(name, options["interval"], options["burst"])
+            else:
+                threads = [threading.Thread(target=self.work_in_thread, name=f"job-worker-{i}",
+                                            args=(f"{name}:{i}", options["interval"], options["burst"]))
+                           for i in range(options["concurrency"])]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+        if options["verbosity"] >= 1:
+            self.stdout.write(f"{self.results[True]} jobs done, {self.results[False]} jobs failed.")
+
+    def shutdown(self, _signum, _frame):
+        self.stderr.write("Stopping once the current jobs are done…")
+        self.stop.set()
+
+    def work(self, name, interval, burst):
+        while not self.stop.is_set():
+            job = claim_job(name)
+            if job is None:
+                if burst:
+                    return
+                self.stop.wait(interval)
+                continue
+            success = run_job(job)
+            with self.lock:
+                self.results[success] += 1
+
+    def work_in_thread(self, name, interval, burst):
+        try:
+            self.work(name, interval, burst)
+        finally:
+            # Each thread has its own database connections
+            connections.close_all()
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Dotted path of the function of the task.', max_length=255, verbose_name='task')),
+                ('args', models.JSONField(blank=True, default=list, verbose_name='arguments')),
+                ('kwargs', models.JSONField(blank=True, default=dict, verbose_name='keyword arguments')),
+                ('priority', models.SmallIntegerField(default=0, help_text='The jobs with the highest priority are run first.', verbose_name='priority')),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='run at')),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='pending', max_length=16, verbose_name='status')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='attempts')),
+                ('max_attempts', models.PositiveSmallIntegerField(default=5, verbose_name='maximum attempts')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='last error')),
+                ('worker', models.CharField(blank=True, default='', max_length=255, verbose_name='worker')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='created at')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='started at')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='finished at')),
+            ],
+            options={
+                'verbose_name': 'job',
+                'verbose_name_plural': 'jobs',
+                'indexes': [models.Index(fields=['status', '-priority', 'run_at'], name='jobs_job_next_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,108 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+
+class Job(models.Model):
+    """
+    A task that is run in the background by the command run_jobs, see jobs.queue.
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    name = models.CharField(
+        max_length=255,
+        verbose_name=_("task"),
+        help_text=_("Dotted path of the function of the task."),
+    )
+
+    args = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name=_("arguments"),
+    )
+
+    kwargs = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name=_("keyword arguments"),
+    )
+
+    priority = models.SmallIntegerField(
+        default=0,
+        verbose_name=_("priority"),
+        help_text=_("The jobs with the highest priority are run first."),
+    )
+
+    run_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name=_("run at"),
+    )
+
+    status = models.CharField(
+        max_length=16,
+        choices=[
+            (PENDING, _("pending")),
+            (RUNNING, _("running")),
+            (DONE, _("done")),
+            (FAILED, _("failed")),
+        ],
+        default=PENDING,
+        verbose_name=_("status"),
+    )
+
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name=_("attempts"),
+    )
+
+    max_attempts = models.PositiveSmallIntegerField(
+        default=5,
+        verbose_name=_("maximum attempts"),
+    )
+
+    last_error = models.TextField(
+        blank=True,
+        default="",
+        verbose_name=_("last error"),
+    )
+
+    worker = models.CharField(
+        max_length=255,
+        blank=True,
+        default="",
+        verbose_name=_("worker"),
+    )
+
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name=_("created at"),
+    )
+
+    started_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_("started at"),
+    )
+
+    finished_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_("finished at"),
+    )
+
+    class Meta:
+        verbose_name = _("job")
+        verbose_name_plural = _("jobs")
+        indexes = [
+            # The workers look for the next pending job
+            models.Index(fields=['status', '-priority', 'run_at'], name='jobs_job_next_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.get_status_display()})"
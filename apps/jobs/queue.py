@@ -0,0 +1,159 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Queue of background jobs, stored in the database.
+
+Slow side effects (refreshing the wiki, rendering documents, sending many mails…) don't belong to the request.
+A function is declared as a task with the decorator `task`, then `enqueue` stores a job once the current
+transaction is committed. The command run_jobs claims the jobs, the highest priority first,
+with SELECT … FOR UPDATE SKIP LOCKED, or with a conditional UPDATE when the database doesn't support it (SQLite).
+A job that fails is retried later, with an exponential backoff, until it reaches its maximum number of attempts.
+
+The settings are JOBS_RETRY_DELAY (the delay before the first retry, in seconds), JOBS_RETRY_MAX_DELAY
+and JOBS_STALE_TIMEOUT (the duration after which a running job is considered lost, eg. if its worker was killed).
+"""
+
+import json
+import logging
+import traceback
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# The registered tasks, by dotted path
+_tasks = {}
+
+
+def task(func):
+    """
+    Declare a function as a task, that can be run in the background.
+    Only the registered functions can be run by the workers.
+    """
+    _tasks[f"{func.__module__}.{func.__qualname__}"] = func
+    return func
+
+
+def get_task(name):
+    """
+    Find the function of a task, importing its module if needed.
+    :raise LookupError: if the function is not a registered task
+    """
+    if name not in _tasks:
+        try:
+            import_module(name.rsplit(".", 1)[0])
+        except ImportError:
+            pass
+    if name not in _tasks:
+        raise LookupError(f"{name} is not a registered task.")
+    return _tasks[name]
+
+
+def enqueue(func, args=(), kwargs=None, priority=0, run_at=None, max_attempts=5):
+    """
+    Run a task in the background, once the current transaction is committed.
+    If the transaction is rolled back, the job is forgotten.
+    :param func: The task, declared with the decorator `task`
+    :param args: The positional arguments of the task, that must be serializable in JSON
+    :param kwargs: The keyword arguments of the task, that must be serializable in JSON
+    :param priority: The jobs with the highest priority are run first
+    :param run_at: Don't run the job before this date
+    :param max_attempts: Number of times the job is tried before it fails
+    """
+    name = f"{func.__module__}.{func.__qualname__}"
+    if _tasks.get(name) is not func:
+        raise LookupError(f"{name} is not a registered task.")
+    args, kwargs = list(args), dict(kwargs or {})
+    # Fail now rather than in the worker
+    json.dumps([args, kwargs])
+
+    transaction.on_commit(lambda: Job.objects.create(
+        name=name,
+        args=args,
+        kwargs=kwargs,
+        priority=priority,
+        run_at=run_at or timezone.now(),
+        max_attempts=max_attempts,
+    ))
+
+
+def claim_job(worker=""):
+    """
+    Take the next job that is ready, and mark it as running.
+    Several workers never take the same job.
+    :param worker: The name of the worker, that is stored in the job
+    :return: The job, or None if no job is ready
+    """
+    now = timezone.now()
+    queryset = Job.objects.filter(status=Job.PENDING, run_at__lte=now).order_by("-priority", "run_at", "pk")
+    claim = dict(status=Job.RUNNING, worker=worker, started_at=now, finished_at=None, attempts=F("attempts") + 1)
+
+    if connections[queryset.db].features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            # The jobs that are locked by other workers are skipped
+            job = queryset.select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            Job.objects.filter(pk=job.pk).update(**claim)
+    else:
+        # Only one worker can switch the status of a job, the other ones try the next job
+        for job in queryset[:10]:
+            if Job.objects.filter(pk=job.pk, status=Job.PENDING).update(**claim):
+                break
+        else:
+            return None
+
+    job.refresh_from_db()
+    return job
+
+
+def get_retry_delay(attempts):
+    """
+    Return the delay before the next try of a job that failed the given number of times.
+    """
+    return timedelta(seconds=min(settings.JOBS_RETRY_DELAY * 2 ** (attempts - 1), settings.JOBS_RETRY_MAX_DELAY))
+
+
+def run_job(job):
+    """
+    Run a claimed job. A job that fails is retried later, until its maximum number of attempts.
+    :return: True if the job succeeded
+    """
+    try:
+        get_task(job.name)(*job.args, **job.kwargs)
+    except Exception:
+        logger.exception("The job %s (%s) failed.", job.pk, job.name)
+        now = timezone.now()
+        update = dict(last_error=traceback.format_exc())
+        if job.attempts < job.max_attempts:
+            update.update(status=Job.PENDING, run_at=now + get_retry_delay(job.attempts))
+        else:
+            update.update(status=Job.FAILED, finished_at=now)
+        Job.objects.filter(pk=job.pk).update(**update)
+        return False
+
+    Job.objects.filter(pk=job.pk).update(status=Job.DONE, finished_at=timezone.now(), last_error="")
+    return True
+
+
+def requeue_stale_jobs(timeout=None):
+    """
+    Put back in the queue the jobs that are running for too long, eg. because their worker was killed.
+    The jobs that have no attempt left fail.
+    :return: The number of jobs that are put back
+    """
+    if timeout is None:
+        timeout = timedelta(seconds=settings.JOBS_STALE_TIMEOUT)
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, started_at__lt=now - timeout)
+    stale.filter(attempts__gte=F("max_attempts"))\
+        .update(status=Job.FAILED, finished_at=now, last_error="The worker of the job was lost.")
+    return stale.update(status=Job.PENDING, worker="")
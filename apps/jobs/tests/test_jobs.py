@@ -0,0 +1,109 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from ..models import Job
+from ..queue import claim_job, enqueue, requeue_stale_jobs, run_job, task
+
+done = []
+
+
+@task
+def record(value):
+    done.append(value)
+
+
+@task
+def fail():
+    raise ValueError("Expected failure")
+
+
+def not_a_task():
+    pass
+
+
+class TestJobs(TestCase):
+    """
+    The jobs are stored once the transaction is committed, then run by the workers.
+    """
+
+    def setUp(self):
+        done.clear()
+
+    def enqueue(self, *args, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue(*args, **kwargs)
+
+    def test_enqueue_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            enqueue(record, args=[1])
+        self.assertFalse(Job.objects.exists())
+        callbacks[0]()
+        job = Job.objects.get()
+        self.assertEqual(job.name, "jobs.tests.test_jobs.record")
+        self.assertEqual(job.args, [1])
+
+        with self.assertRaises(LookupError):
+            enqueue(not_a_task)
+        with self.assertRaises(TypeError):
+            enqueue(record, args=[object()])
+
+    def test_priority(self):
+        self.enqueue(record, args=["low"], priority=-1)
+        self.enqueue(record, args=["high"], priority=10)
+        self.enqueue(record, args=["later"], priority=20, run_at=timezone.now() + timedelta(hours=1))
+        self.enqueue(record, args=["normal"])
+
+        while True:
+            job = claim_job("test")
+            if job is None:
+                break
+            self.assertEqual(job.status, Job.RUNNING)
+            self.assertEqual(job.attempts, 1)
+            self.assertTrue(run_job(job))
+        self.assertEqual(done, ["high", "normal", "low"])
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 3)
+
+    def test_retry(self):
+        self.enqueue(fail, max_attempts=2)
+        job = claim_job()
+        with self.assertLogs("jobs.queue", "ERROR"):
+            self.assertFalse(run_job(job))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertIn("Expected failure", job.last_error)
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=20))
+        self.assertIsNone(claim_job())
+
+        Job.objects.update(run_at=timezone.now())
+        with self.assertLogs("jobs.queue", "ERROR"):
+            self.assertFalse(run_job(claim_job()))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_stale_jobs(self):
+        self.enqueue(record, args=[1])
+        self.enqueue(record, args=[2], max_attempts=1)
+        claim_job()
+        claim_job()
+        self.assertEqual(requeue_stale_jobs(), 0)
+        Job.objects.update(started_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(requeue_stale_jobs(), 1)
+        self.assertEqual(Job.objects.get(args=[2]).status, Job.FAILED)
+
+    def test_command(self):
+        self.enqueue(record, args=[1])
+        self.enqueue(record, args=[2])
+        self.enqueue(fail, max_attempts=1)
+        out = StringIO()
+        with self.assertLogs("jobs.queue", "ERROR"):
+            call_command("run_jobs", burst=True, stdout=out)
+        self.assertEqual(sorted(done), [1, 2])
+        self.assertIn("2 jobs done, 1 jobs failed.", out.getvalue())
@@ -0,0 +1,90 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+import smtplib
+from io import StringIO
+
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from mailer import send_mail
+from mailer.models import PRIORITY_DEFERRED, RESULT_FAILURE, Message, MessageLog
+
+from ..mail import get_mail_connection, get_queue_stats, send_messages
+
+
+class CountingBackend(EmailBackend):
+    """
+    Stand-in of the SMTP server, that counts the opened connections and refuses some recipients.
+    """
+    opened = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.is_open = False
+
+    def open(self):
+        if self.is_open:
+            return False
+        CountingBackend.opened += 1
+        self.is_open = True
+        return True
+
+    def close(self):
+        self.is_open = False
+
+    def send_messages(self, messages):
+        for message in messages:
+            if "refused@example.com" in message.to:
+                raise smtplib.SMTPRecipientsRefused({"refused@example.com": (550, b"Unknown user")})
+        return super().send_messages(messages)
+
+
+@override_settings(MAILER_EMAIL_BACKEND="jobs.tests.test_mail.CountingBackend", MAILER_USE_FILE_LOCK=False)
+class TestDispatchMail(TestCase):
+    """
+    The queued mails are sent in batches, reusing the connections.
+    """
+
+    def setUp(self):
+        CountingBackend.opened = 0
+        for i in range(5):
+            send_mail(f"Mail {i}", "Hello", "note@example.com", [f"user{i}@example.com"])
+
+    def test_send_messages(self):
+        send_mail("Refused", "Hello", "note@example.com", ["refused@example.com"])
+        connection = get_mail_connection()
+        # The bookkeeping of the batch is done in one transaction, whatever the number of mails
+        with self.assertNumQueries(7):
+            sent, deferred = send_messages(connection, list(Message.objects.order_by("-pk")))
+        self.assertEqual((sent, deferred), (5, 1))
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertTrue(all(email.extra_headers.get("Message-ID") for email in mail.outbox))
+        # The connection is reopened after the failure
+        self.assertEqual(CountingBackend.opened, 2)
+
+        self.assertEqual(Message.objects.get().priority, PRIORITY_DEFERRED)
+        self.assertEqual(MessageLog.objects.count(), 6)
+        self.assertIn("Unknown user", MessageLog.objects.get(result=RESULT_FAILURE).log_message)
+
+    def test_queue_stats(self):
+        Message.objects.filter(pk=Message.objects.first().pk).update(priority=PRIORITY_DEFERRED)
+        stats = get_queue_stats()
+        self.assertEqual(stats["queued"], 4)
+        self.assertEqual(stats["deferred"], 1)
+        self.assertGreaterEqual(stats["oldest_age"], 0)
+
+        out = StringIO()
+        call_command("dispatch_mail", stats=True, stdout=out)
+        self.assertEqual(json.loads(out.getvalue()), stats)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("dispatch_mail", burst=True, batch_size=2, stdout=out)
+        self.assertEqual([email.subject for email in mail.outbox], [f"Mail {i}" for i in range(5)])
+        self.assertFalse(Message.objects.exists())
+        # All the batches are sent on the same connection
+        self.assertEqual(CountingBackend.opened, 1)
+        self.assertIn("5 mails sent, 0 mails deferred.", out.getvalue())
@@ -14,6 +14,7 @@ import getpass
 
 # Ces modèles ne nécessitent pas de logs
 EXCLUDED = [
+    'activity.attendee',
     'admin.logentry',
     'authtoken.token',
     'cas_server.proxygrantingticket',
@@ -22,6 +23,7 @@ EXCLUDED = [
     'cas_server.user',
     'cas_server.userattributes',
     'contenttypes.contenttype',
+    'jobs.job',
     'logs.changelog',  # Never remove this line
     'mailer.dontsendentry',
     'mailer.message',
@@ -29,36 +31,19 @@ EXCLUDED = [
     'migrations.migration',
     'note.note'  # We only store the subclasses
     'note.transaction',
+    'note.salesstatistic',
+    'permission.notevisibility',
     'sessions.session',
+    'treasury.periodtotal',
 ]
 
 
-def pre_save_object(sender, instance, **kwargs):
+def get_actor(request):
     """
-    Before a model get saved, we get the previous instance that is currently in the database
+    Get the user and the IP address that are responsible of a modification.
+    :param request: The current request, or None if the modification is done in a shell
+    :return: The couple (user, ip)
     """
-    qs = sender.objects.filter(pk=instance.pk).all()
-    if qs.exists():
-        instance._previous = qs.get()
-    else:
-        instance._previous = None
-
-
-def save_object(sender, instance, **kwargs):
-    """
-    Each time a model is saved, an entry in the table `Changelog` is added in the database
-    in order to store each modification made
-    """
-    # noinspection PyProtectedMember
-    if instance._meta.label_lower in EXCLUDED or hasattr(instance, "_no_signal"):
-        return
-
-    # noinspection PyProtectedMember
-    previous = instance._previous
-
-    # Si un utilisateur est connecté, on récupère l'utilisateur courant ainsi que son adresse IP
-    request = get_current_request()
-
     if request is None:
         # Si la modification n'a pas été faite via le client Web, on suppose que c'est du à `manage.py`
         # On récupère alors l'utilisateur·trice connecté·e à la VM, et on récupère la note associée
@@ -85,13 +70,19 @@ def save_object(sender, instance, **kwargs):
         if not user.is_authenticated:
             # For registration and OAuth2 purposes
             user = None
+    return user, ip
 
-    # noinspection PyProtectedMember
-    if request is not None and instance._meta.label_lower == "auth.user" and previous:
-        # On n'enregistre pas les connexions
-        if instance.last_login != previous.last_login:
-            return
 
+def get_changelog(instance, previous, user, ip):
+    """
+    Build the entry of the table `Changelog` that describes the creation or the modification of an instance.
+    The entry is not saved.
+    :param instance: The new version of the instance
+    :param previous: The version of the instance that is currently in the database, or None if it is created
+    :param user: The user that performs the modification
+    :param ip: The IP address of the user
+    :return: The changelog, or None if nothing changed
+    """
     changed_fields = '__all__'
     if previous:
         # On ne garde que les champs modifiés
@@ -100,12 +91,13 @@ def save_object(sender, instance, **kwargs):
             if field.name.endswith("_ptr"):
                 # A field ending with _ptr is a OneToOneRel with a subclass, e.g. NoteClub.note_ptr -> Note
                 continue
-            if getattr(instance, field.name) != getattr(previous, field.name):
+            # Compare the raw values, related objects don't need to be fetched
+            if getattr(instance, field.attname) != getattr(previous, field.attname):
                 changed_fields.append(field.name)
 
     if len(changed_fields) == 0:
         # Pas de log s'il n'y a pas de modification
-        return
+        return None
 
     # On crée notre propre sérialiseur JSON pour pouvoir sauvegarder les modèles avec uniquement les champs modifiés
     class CustomSerializer(ModelSerializer):
@@ -116,53 +108,63 @@ def save_object(sender, instance, **kwargs):
     previous_json = JSONRenderer().render(CustomSerializer(previous).data).decode("UTF-8") if previous else ""
     instance_json = JSONRenderer().render(CustomSerializer(instance).data).decode("UTF-8")
 
-    Changelog.objects.create(user=user,
-                             ip=ip,
-                             model=ContentType.objects.get_for_model(instance),
-                             instance_pk=instance.pk,
-                             previous=previous_json,
-                             data=instance_json,
-                             action=("edit" if previous else "create")
-                             ).save()
+    return Changelog(user=user,
+                     ip=ip,
+                     model=ContentType.objects.get_for_model(instance),
+                     instance_pk=instance.pk,
+                     previous=previous_json,
+                     data=instance_json,
+                     action=("edit" if previous else "create"))
 
 
-def delete_object(sender, instance, **kwargs):
+def pre_save_object(sender, instance, **kwargs):
     """
-    Each time a model is deleted, an entry in the table `Changelog` is added in the database
+    Before a model get saved, we get the previous instance that is currently in the database
+    """
+    qs = sender.objects.filter(pk=instance.pk).all()
+    if qs.exists():
+        instance._previous = qs.get()
+    else:
+        instance._previous = None
+
+
+def save_object(sender, instance, **kwargs):
+    """
+    Each time a model is saved, an entry in the table `Changelog` is added in the database
+    in order to store each modification made
     """
     # noinspection PyProtectedMember
     if instance._meta.label_lower in EXCLUDED or hasattr(instance, "_no_signal"):
         return
 
+    # noinspection PyProtectedMember
+    previous = instance._previous
+
     # Si un utilisateur est connecté, on récupère l'utilisateur courant ainsi que son adresse IP
     request = get_current_request()
+    user, ip = get_actor(request)
 
-    if request is None:
-        # Si la modification n'a pas été faite via le client Web, on suppose que c'est du à `manage.py`
-        # On récupère alors l'utilisateur·trice connecté·e à la VM, et on récupère la note associée
-        # IMPORTANT : l'utilisateur dans la VM doit être un des alias note du respo info
-        ip = "127.0.0.1"
-        username = Alias.normalize(getpass.getuser())
-        note = NoteUser.objects.filter(alias__normalized_name=username)
-        # if not note.exists():
-        #     print("WARNING: A model attempted to be saved in the DB, but the actor is unknown: " + username)
-        # else:
-        if note.exists():
-            user = note.get().user
-        else:
-            user = None
-    else:
-        user = request.user
-        if 'HTTP_X_REAL_IP' in request.META:
-            ip = request.META.get('HTTP_X_REAL_IP')
-        elif 'HTTP_X_FORWARDED_FOR' in request.META:
-            ip = request.META.get('HTTP_X_FORWARDED_FOR').split(', ')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
+    # noinspection PyProtectedMember
+    if request is not None and instance._meta.label_lower == "auth.user" and previous:
+        # On n'enregistre pas les connexions
+        if instance.last_login != previous.last_login:
+            return
 
-        if not user.is_authenticated:
-            # For registration and OAuth2 purposes
-            user = None
+    changelog = get_changelog(instance, previous, user, ip)
+    if changelog is not None:
+        changelog.save()
+
+
+def delete_object(sender, instance, **kwargs):
+    """
+    Each time a model is deleted, an entry in the table `Changelog` is added in the database
+    """
+    # noinspection PyProtectedMember
+    if instance._meta.label_lower in EXCLUDED or hasattr(instance, "_no_signal"):
+        return
+
+    # Si un utilisateur est connecté, on récupère l'utilisateur courant ainsi que son adresse IP
+    user, ip = get_actor(get_current_request())
 
     # On crée notre propre sérialiseur JSON pour pouvoir sauvegarder les modèles
     class CustomSerializer(ModelSerializer):
@@ -8,7 +8,7 @@ from django.conf import settings
 from django.contrib.auth.hashers import PBKDF2PasswordHasher, mask_hash
 from django.utils.crypto import constant_time_compare
 from django.utils.translation import gettext_lazy as _
-from note_kfet.middlewares import get_current_request
+from note_kfet.middlewares import get_current_request, get_permission_mask
 
 
 class CustomNK15Hasher(PBKDF2PasswordHasher):
@@ -41,7 +41,7 @@ class CustomNK15Hasher(PBKDF2PasswordHasher):
             request = get_current_request()
             current_user = request.user
             if current_user is not None and current_user.is_superuser\
-                    and request.session.get("permission_mask", -1) >= 42:
+                    and get_permission_mask(request) >= 42:
                 return True
 
         if '|' in encoded:
@@ -76,6 +76,6 @@ class DebugSuperuserBackdoor(PBKDF2PasswordHasher):
             request = get_current_request()
             current_user = request.user
             if current_user is not None and current_user.is_superuser\
-                    and request.session.get("permission_mask", -1) >= 42:
+                    and get_permission_mask(request) >= 42:
                 return True
         return super().verify(password, encoded)
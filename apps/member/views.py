@@ -20,7 +20,8 @@ from django.views.generic.edit import FormMixin
 from django_tables2.views import SingleTableView
 from rest_framework.authtoken.models import Token
 from note.models import Alias, NoteClub, NoteUser, Trust
-from note.models.transactions import Transaction, SpecialTransaction
+from note.archive import get_note_history
+from note.models.transactions import SpecialTransaction
 from note.tables import HistoryTable, AliasTable, TrustTable
 from note_kfet.middlewares import _set_current_request
 from permission.backends import PermissionBackend
@@ -152,10 +153,7 @@ class UserDetailView(ProtectQuerysetMixin, LoginRequiredMixin, DetailView):
         context = super().get_context_data(**kwargs)
         user = context['user_object']
         context["note"] = user.note
-        history_list = \
-            Transaction.objects.all().filter(Q(source=user.note) | Q(destination=user.note))\
-            .order_by("-created_at")\
-            .filter(PermissionBackend.filter_queryset(self.request, Transaction, "view"))
+        history_list = get_note_history(self.request, user.note)
         history_table = HistoryTable(history_list, prefix='transaction-')
         history_table.paginate(per_page=20, page=self.request.GET.get("transaction-page", 1))
         context['history_list'] = history_table
@@ -257,7 +255,7 @@ class ProfileTrustView(ProtectQuerysetMixin, LoginRequiredMixin, DetailView):
         context = super().get_context_data(**kwargs)
         note = context['object'].note
         context["trusting"] = TrustTable(
-            note.trusting.filter(PermissionBackend.filter_queryset(self.request, Trust, "view")).distinct().all())
+            note.trusting.filter(PermissionBackend.filter_queryset(self.request, Trust, "view")).all())
         context["can_create"] = PermissionBackend.check_perm(self.request, "note.add_trust", Trust(
             trusting=context["object"].note,
             trusted=context["object"].note
@@ -290,7 +288,7 @@ class ProfileAliasView(ProtectQuerysetMixin, LoginRequiredMixin, DetailView):
         context = super().get_context_data(**kwargs)
         note = context['object'].note
         context["aliases"] = AliasTable(
-            note.alias.filter(PermissionBackend.filter_queryset(self.request, Alias, "view")).distinct()
+            note.alias.filter(PermissionBackend.filter_queryset(self.request, Alias, "view"))
             .order_by('normalized_name').all())
         context["can_create"] = PermissionBackend.check_perm(self.request, "note.add_alias", Alias(
             note=context["object"].note,
@@ -354,9 +352,12 @@ class ManageAuthTokens(LoginRequiredMixin, TemplateView):
     extra_context = {"title": _("Manage auth token")}
 
     def get(self, request, *args, **kwargs):
-        if 'regenerate' in request.GET and Token.objects.filter(user=request.user).exists():
-            Token.objects.get(user=self.request.user).delete()
-            return redirect(reverse_lazy('member:auth_token') + "?show")
+        if 'regenerate' in request.GET:
+            token = Token.objects.filter(user=request.user).first()
+            if token is not None:
+                # Deleting the token also drops it from the API token cache
+                token.delete()
+                return redirect(reverse_lazy('member:auth_token') + "?show")
 
         return super().get(request, *args, **kwargs)
 
@@ -450,9 +451,7 @@ class ClubDetailView(ProtectQuerysetMixin, LoginRequiredMixin, DetailView):
             .order_by('user__last_name').all()
         context["managers"] = ClubManagerTable(data=managers, prefix="managers-")
         # transaction history
-        club_transactions = Transaction.objects.all().filter(Q(source=club.note) | Q(destination=club.note))\
-            .filter(PermissionBackend.filter_queryset(self.request, Transaction, "view"))\
-            .order_by('-created_at')
+        club_transactions = get_note_history(self.request, club.note)
         history_table = HistoryTable(club_transactions, prefix="history-")
         history_table.paginate(per_page=20, page=self.request.GET.get('history-page', 1))
         context['history_list'] = history_table
@@ -520,7 +519,7 @@ class ClubAliasView(ProtectQuerysetMixin, LoginRequiredMixin, DetailView):
         context = super().get_context_data(**kwargs)
         note = context['object'].note
         context["aliases"] = AliasTable(note.alias.filter(
-            PermissionBackend.filter_queryset(self.request, Alias, "view")).distinct().all())
+            PermissionBackend.filter_queryset(self.request, Alias, "view")).all())
         context["can_create"] = PermissionBackend.check_perm(self.request, "note.add_alias", Alias(
             note=context["object"].note,
             name="",
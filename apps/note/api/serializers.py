@@ -13,6 +13,7 @@ from permission.backends import PermissionBackend
 from rest_framework.utils import model_meta
 
 from ..models.notes import Note, NoteClub, NoteSpecial, NoteUser, Alias, Trust
+from ..models.stats import SalesStatistic
 from ..models.transactions import TransactionTemplate, Transaction, MembershipTransaction, TemplateCategory, \
     RecurrentTransaction, SpecialTransaction
 
@@ -278,3 +279,29 @@ class TransactionPolymorphicSerializer(PolymorphicSerializer):
 
     class Meta:
         model = Transaction
+
+
+class TransactionValiditySerializer(serializers.Serializer):
+    """
+    Invalidate or revalidate several transactions at once, given by the list of their ids or by filters.
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+    valid = serializers.BooleanField()
+    invalidity_reason = serializers.CharField(max_length=255, required=False, allow_blank=True, default="")
+
+    def validate(self, attrs):
+        # In a form, a missing boolean is read as False
+        if "valid" not in self.initial_data:
+            raise ValidationError({"valid": _("This field is required.")})
+        return attrs
+
+
+class SalesStatisticSerializer(serializers.ModelSerializer):
+    """
+    REST API Serializer for sales statistics.
+    The djangorestframework plugin will analyse the model `SalesStatistic` and parse all fields in the API.
+    """
+
+    class Meta:
+        model = SalesStatistic
+        fields = '__all__'
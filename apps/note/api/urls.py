@@ -3,7 +3,7 @@
 
 from .views import NotePolymorphicViewSet, AliasViewSet, ConsumerViewSet, \
     TemplateCategoryViewSet, TransactionViewSet, TransactionTemplateViewSet, \
-    TrustViewSet
+    TrustViewSet, SalesStatisticViewSet
 
 
 def register_note_urls(router, path):
@@ -18,3 +18,5 @@ def register_note_urls(router, path):
     router.register(path + '/transaction/category', TemplateCategoryViewSet)
     router.register(path + '/transaction/transaction', TransactionViewSet)
     router.register(path + '/transaction/template', TransactionTemplateViewSet)
+
+    router.register(path + '/stats', SalesStatisticViewSet)
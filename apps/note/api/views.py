@@ -1,22 +1,29 @@
 # Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
 # SPDX-License-Identifier: GPL-3.0-or-later
 import re
+from datetime import datetime, time
 
 from django.conf import settings
-from django.db.models import Q
+from django.db.models import Exists, F, OuterRef, Q, Sum
+from django.db.models.functions import Trunc
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import OrderingFilter, SearchFilter
 from rest_framework import viewsets
+from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import status
 from api.viewsets import ReadProtectedModelViewSet, ReadOnlyProtectedModelViewSet
 from permission.backends import PermissionBackend
 
+from ..bulk import set_transactions_validity
 from .serializers import NotePolymorphicSerializer, AliasSerializer, ConsumerSerializer,\
     TemplateCategorySerializer, TransactionTemplateSerializer, TransactionPolymorphicSerializer, \
-    TrustSerializer
+    TrustSerializer, SalesStatisticSerializer, TransactionValiditySerializer
 from ..models.notes import Note, Alias, NoteUser, NoteClub, NoteSpecial, Trust
+from ..models.stats import SalesStatistic
 from ..models.transactions import TransactionTemplate, Transaction, TemplateCategory
 
 
@@ -44,15 +51,15 @@ class NotePolymorphicViewSet(ReadProtectedModelViewSet):
         queryset = self.queryset.filter(PermissionBackend.filter_queryset(self.request, Note, "view")
                                         | PermissionBackend.filter_queryset(self.request, NoteUser, "view")
                                         | PermissionBackend.filter_queryset(self.request, NoteClub, "view")
-                                        | PermissionBackend.filter_queryset(self.request, NoteSpecial, "view"))\
-            .distinct()
+                                        | PermissionBackend.filter_queryset(self.request, NoteSpecial, "view"))
 
         alias = self.request.query_params.get("alias", ".*")
-        queryset = queryset.filter(
-            Q(alias__name__iregex="^" + alias)
-            | Q(alias__normalized_name__iregex="^" + Alias.normalize(alias))
-            | Q(alias__normalized_name__iregex="^" + alias.lower())
-        )
+        # Use a subquery rather than a join on aliases, that would duplicate notes
+        queryset = queryset.filter(Exists(Alias.objects.filter(note=OuterRef("pk")).filter(
+            Q(name__iregex="^" + alias)
+            | Q(normalized_name__iregex="^" + Alias.normalize(alias))
+            | Q(normalized_name__iregex="^" + alias.lower())
+        )))
 
         return queryset.order_by("id")
 
@@ -122,7 +129,7 @@ class AliasViewSet(ReadProtectedModelViewSet):
         :return: The filtered set of requested aliases
         """
 
-        queryset = super().get_queryset().distinct()
+        queryset = super().get_queryset()
 
         alias = self.request.query_params.get("alias", None)
         if alias:
@@ -159,7 +166,7 @@ class ConsumerViewSet(ReadOnlyProtectedModelViewSet):
         :return: The filtered set of requested aliases
         """
 
-        queryset = super().get_queryset().distinct()
+        queryset = super().get_queryset()
         
         # Sqlite doesn't support ORDER BY in subqueries
         queryset = queryset.order_by("name") \
@@ -241,12 +248,115 @@ class TransactionViewSet(ReadProtectedModelViewSet):
     filterset_fields = ['source', 'source_alias', 'source__alias__name', 'source__alias__normalized_name',
                         'destination', 'destination_alias', 'destination__alias__name',
                         'destination__alias__normalized_name', 'quantity', 'polymorphic_ctype', 'amount',
-                        'created_at', 'valid', 'invalidity_reason', ]
+                        'total', 'created_at', 'valid', 'invalidity_reason', ]
     search_fields = ['$reason', '$source_alias', '$source__alias__name', '$source__alias__normalized_name',
                      '$destination_alias', '$destination__alias__name', '$destination__alias__normalized_name',
                      '$invalidity_reason', ]
-    ordering_fields = ['created_at', 'amount', ]
+    ordering_fields = ['created_at', 'amount', 'total', ]
 
     def get_queryset(self):
         return self.model.objects.filter(PermissionBackend.filter_queryset(self.request, self.model, "view"))\
             .order_by("created_at", "id")
+
+    @action(detail=False, methods=["post"])
+    def validity(self, request):
+        """
+        Invalidate or revalidate several transactions at once.
+        The transactions are given by the list "ids" of the body, or by the filters of the query string.
+        The body contains the new value of "valid", and the "invalidity_reason" if the transactions are invalidated.
+        """
+        serializer = TransactionValiditySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        queryset = self.get_queryset()
+        if "ids" in data:
+            queryset = queryset.filter(pk__in=data["ids"])
+        elif request.query_params:
+            queryset = self.filter_queryset(queryset)
+        else:
+            return Response({"detail": "Give a list of ids or some filters."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            changed = set_transactions_validity(request, queryset, data["valid"], data["invalidity_reason"])
+        except ValidationError as e:
+            return Response({"detail": " ".join(e.messages)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"count": len(changed), "ids": [tr.pk for tr in changed]})
+
+
+class SalesStatisticViewSet(ReadOnlyProtectedModelViewSet):
+    """
+    REST API View set.
+    Sales of the buttons, summed by time bucket, then render it on /api/note/stats/
+    Query parameters:
+    - bucket: hour, day (default), week, month or year
+    - group_by: comma-separated list of template (default), category and destination
+    - since, until: dates or datetimes that bound the buckets
+    - template, category, destination: ids that filter the sales
+    """
+    queryset = SalesStatistic.objects.order_by('period_start', 'id')
+    serializer_class = SalesStatisticSerializer
+
+    BUCKETS = ["hour", "day", "week", "month", "year"]
+    GROUPS = {
+        "template": "template_id",
+        "category": "template__category_id",
+        "destination": "destination_id",
+    }
+
+    @staticmethod
+    def parse_date(value):
+        """
+        Parse a date or a datetime of the query string, in the current timezone.
+        """
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            if day is None:
+                raise ValueError(value)
+            parsed = datetime.combine(day, time.min)
+        return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+    def list(self, request, *args, **kwargs):
+        params = request.query_params
+        bucket = params.get("bucket", "day")
+        group_by = [group for group in params.get("group_by", "template").split(",") if group]
+        if bucket not in self.BUCKETS:
+            return Response({"detail": "The bucket must be one of " + ", ".join(self.BUCKETS) + "."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if any(group not in self.GROUPS for group in group_by):
+            return Response({"detail": "The statistics can be grouped by " + ", ".join(self.GROUPS) + "."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Hours are read from the hourly rows, larger buckets from the daily rows
+        queryset = self.get_queryset().filter(granularity="hour" if bucket == "hour" else "day")
+        try:
+            if "since" in params:
+                queryset = queryset.filter(period_start__gte=self.parse_date(params["since"]))
+            if "until" in params:
+                queryset = queryset.filter(period_start__lt=self.parse_date(params["until"]))
+            for group, field in self.GROUPS.items():
+                if group in params:
+                    queryset = queryset.filter(**{field: int(params[group])})
+        except ValueError:
+            return Response({"detail": "Invalid filter."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if bucket in ["hour", "day"]:
+            bucket_expression = F("period_start")
+        else:
+            bucket_expression = Trunc("period_start", bucket, tzinfo=timezone.get_current_timezone())
+        fields = [self.GROUPS[group] for group in group_by]
+        rows = queryset.annotate(bucket=bucket_expression).order_by().values("bucket", *fields)\
+            .annotate(sum_quantity=Sum("quantity"), sum_revenue=Sum("revenue"),
+                      sum_transactions=Sum("transactions"))\
+            .order_by("bucket", *fields)
+
+        page = self.paginate_queryset(rows)
+        results = [dict(
+            bucket=row["bucket"],
+            **{group: row[self.GROUPS[group]] for group in group_by},
+            quantity=row["sum_quantity"],
+            revenue=row["sum_revenue"],
+            transactions=row["sum_transactions"],
+        ) for row in (page if page is not None else rows)]
+        return self.get_paginated_response(results) if page is not None else Response(results)
@@ -0,0 +1,271 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Archive of old transactions.
+
+Transactions that are older than a horizon (by default, the academic years that are closed for
+TRANSACTION_ARCHIVE_YEARS years) are moved into the table ArchivedTransaction, and the sums
+of the archived transactions of each note and each month are stored in the table TransactionSummary.
+Only the types of TRANSACTION_ARCHIVE_MODELS are archived: other transactions are referenced by
+memberships, entries or remittances.
+
+The balance computations and the history of a note span both tables.
+Archiving is reversible, see `./manage.py archive_transactions`.
+"""
+
+from collections import defaultdict
+from datetime import date, datetime, time
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import FieldError
+from django.db import transaction
+from django.db.models import Model, Q, Sum
+from django.utils import timezone
+
+from .models import ArchivedTransaction, Transaction, TransactionSummary
+
+
+def get_archive_horizon(today=None):
+    """
+    Return the date before which transactions are archived by default:
+    the start of the academic year, TRANSACTION_ARCHIVE_YEARS years ago.
+    """
+    today = today or date.today()
+    year = today.year if today.month >= 9 else today.year - 1
+    return date(year - getattr(settings, "TRANSACTION_ARCHIVE_YEARS", 2), 9, 1)
+
+
+def get_archived_types():
+    """
+    Return the content types of the transactions that can be archived.
+    """
+    labels = getattr(settings, "TRANSACTION_ARCHIVE_MODELS", ["note.transaction", "note.recurrenttransaction"])
+    return [ContentType.objects.get_for_model(apps.get_model(label), for_concrete_model=False) for label in labels]
+
+
+def _period_start(dt):
+    return timezone.localtime(dt).date().replace(day=1)
+
+
+def _next_period_start(day):
+    return date(day.year + 1, 1, 1) if day.month == 12 else date(day.year, day.month + 1, 1)
+
+
+def _update_summaries(transactions, sign):
+    """
+    Add (sign = 1) or remove (sign = -1) the given transactions to the monthly summaries of their notes.
+    """
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for tr in transactions:
+        period = _period_start(tr.created_at)
+        deltas[(tr.source_id, period)][0] += sign
+        deltas[(tr.destination_id, period)][0] += sign
+        if tr.valid:
+            deltas[(tr.source_id, period)][2] += sign * tr.total
+            deltas[(tr.destination_id, period)][1] += sign * tr.total
+
+    summaries = {(summary.note_id, summary.period_start): summary for summary in TransactionSummary.objects.filter(
+        note_id__in={note_id for note_id, _period in deltas},
+        period_start__in={period for _note_id, period in deltas},
+    )}
+    created = []
+    for key, (count, incoming, outgoing) in deltas.items():
+        if key not in summaries:
+            summaries[key] = TransactionSummary(note_id=key[0], period_start=key[1])
+            created.append(summaries[key])
+        summary = summaries[key]
+        summary.transactions += count
+        summary.incoming += incoming
+        summary.outgoing += outgoing
+
+    TransactionSummary.objects.bulk_create(created)
+    TransactionSummary.objects.bulk_update([summary for summary in summaries.values() if summary not in created],
+                                           ["transactions", "incoming", "outgoing"])
+    TransactionSummary.objects.filter(transactions=0)._raw_delete(TransactionSummary.objects.db)
+
+
+def archive_transactions(before=None, chunk_size=1000):
+    """
+    Move the transactions that were created before the given date into the archive.
+    Each chunk is moved in its own database transaction, then the archive can be stopped at any time.
+    The balances of the notes don't change, and no changelog is written since the data doesn't change.
+    :param before: The horizon date, defaults to get_archive_horizon()
+    :param chunk_size: The maximum number of transactions that are moved at once
+    :return: The number of archived transactions
+    """
+    before = before or get_archive_horizon()
+    before = timezone.make_aware(datetime.combine(before, time.min))
+    types = get_archived_types()
+    db = Transaction.objects.db
+
+    count = 0
+    while True:
+        with transaction.atomic():
+            pks = list(Transaction.objects.filter(created_at__lt=before, polymorphic_ctype__in=types)
+                       .order_by("pk").values_list("pk", flat=True)[:chunk_size])
+            if not pks:
+                break
+
+            # The transactions are fetched with their real types
+            transactions = list(Transaction.objects.filter(pk__in=pks).select_for_update())
+            ArchivedTransaction.objects.bulk_create([ArchivedTransaction.from_transaction(tr)
+                                                     for tr in transactions])
+            _update_summaries(transactions, 1)
+
+            # The rows are deleted without any signal: the transactions are not invalidated
+            for model in {type(tr) for tr in transactions} - {Transaction}:
+                model._base_manager.filter(pk__in=pks)._raw_delete(db)
+            Transaction._base_manager.filter(pk__in=pks)._raw_delete(db)
+        count += len(pks)
+    return count
+
+
+def restore_transactions(after=None, chunk_size=1000):
+    """
+    Move the archived transactions that were created after the given date back into the transaction table.
+    :param after: The date from which transactions are restored, or None to restore everything
+    :param chunk_size: The maximum number of transactions that are moved at once
+    :return: The number of restored transactions
+    """
+    queryset = ArchivedTransaction.objects.select_related("polymorphic_ctype").order_by("pk")
+    if after is not None:
+        queryset = queryset.filter(created_at__gte=timezone.make_aware(datetime.combine(after, time.min)))
+
+    count = 0
+    while True:
+        with transaction.atomic():
+            archived = list(queryset.select_for_update(of=("self",))[:chunk_size])
+            if not archived:
+                break
+
+            for row in archived:
+                tr = row.to_transaction()
+                # Don't move money, don't check permissions nor write logs
+                tr._force_save = True
+                tr._no_signal = True
+                Model.save_base(tr, force_insert=True)
+            _update_summaries(archived, -1)
+            ArchivedTransaction.objects.filter(pk__in=[row.pk for row in archived])\
+                ._raw_delete(ArchivedTransaction.objects.db)
+        count += len(archived)
+    return count
+
+
+def _note_sums(queryset, note):
+    """
+    Return the valid incoming and outgoing totals of a note in a queryset of transactions or archived transactions.
+    """
+    sums = queryset.filter(Q(source=note) | Q(destination=note), valid=True).aggregate(
+        incoming=Sum("total", filter=Q(destination=note)),
+        outgoing=Sum("total", filter=Q(source=note)),
+    )
+    return (sums["incoming"] or 0) - (sums["outgoing"] or 0)
+
+
+def compute_balance(note):
+    """
+    Compute the balance of a note from all its valid transactions, in the transaction table and in the archive.
+    The archived transactions are read from the monthly summaries.
+    Unless there is an inconsistency, the result is equal to note.balance.
+    """
+    summaries = TransactionSummary.objects.filter(note=note)\
+        .aggregate(incoming=Sum("incoming"), outgoing=Sum("outgoing"))
+    return _note_sums(Transaction.objects.all(), note) + (summaries["incoming"] or 0) - (summaries["outgoing"] or 0)
+
+
+def balance_at(note, when):
+    """
+    Compute the balance of a note just before the given date, from its current balance and the transactions
+    that were created since, in the transaction table and in the archive.
+    The whole months of the archive are read from the monthly summaries.
+    """
+    if not isinstance(when, datetime):
+        when = timezone.make_aware(datetime.combine(when, time.min))
+
+    since = _note_sums(Transaction.objects.filter(created_at__gte=when), note)
+
+    # The archived transactions of the current month, then the summaries of the next months
+    next_period = _next_period_start(_period_start(when))
+    since += _note_sums(ArchivedTransaction.objects.filter(
+        created_at__gte=when,
+        created_at__lt=timezone.make_aware(datetime.combine(next_period, time.min)),
+    ), note)
+    summaries = TransactionSummary.objects.filter(note=note, period_start__gte=next_period)\
+        .aggregate(incoming=Sum("incoming"), outgoing=Sum("outgoing"))
+    since += (summaries["incoming"] or 0) - (summaries["outgoing"] or 0)
+
+    return note.balance - since
+
+
+def filter_archive(query):
+    """
+    Apply a filter on transactions, eg. a permission filter, to the archive.
+    Archived transactions have the same fields as transactions, but the subclass fields:
+    if the filter can't be applied, nothing is returned.
+    """
+    try:
+        return ArchivedTransaction.objects.filter(query)
+    except FieldError:
+        return ArchivedTransaction.objects.none()
+
+
+def get_note_history(request, note, filters=None):
+    """
+    Return the transactions of a note that the request can see, the most recent first,
+    followed by the archived ones.
+    :param filters: Additional filters, that are applied on both tables
+    """
+    from permission.backends import PermissionBackend
+
+    filters = filters or Q()
+    query = PermissionBackend.filter_queryset(request, Transaction, "view")
+    transactions = Transaction.objects.filter(query)\
+        .filter(Q(source=note) | Q(destination=note)).filter(filters).order_by('-created_at')
+    archived = filter_archive(query).filter(Q(source=note) | Q(destination=note)).filter(filters)\
+        .select_related("source", "destination", "polymorphic_ctype").order_by('-created_at')
+    return TransactionHistory(transactions, archived)
+
+
+class TransactionHistory:
+    """
+    Sequence of recent transactions followed by archived transactions, that are older.
+    It can be given to a table, and it is sliced without loading the whole history.
+    """
+
+    def __init__(self, transactions, archived):
+        self.transactions = transactions
+        self.archived = archived
+        self._count = None
+        self._total = None
+
+    def _transactions_count(self):
+        if self._count is None:
+            self._count = self.transactions.count()
+        return self._count
+
+    def __len__(self):
+        # The length is read for each slice, eg. for each page of a table
+        if self._total is None:
+            self._total = self._transactions_count() + self.archived.count()
+        return self._total
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            items = self[key:key + 1]
+            if not items:
+                raise IndexError(key)
+            return items[0]
+
+        start, stop, _step = key.indices(len(self))
+        count = self._transactions_count()
+        items = list(self.transactions[start:min(stop, count)]) if start < count else []
+        if stop > count:
+            items += list(self.archived[max(start - count, 0):stop - count])
+        return items
+
+    def __iter__(self):
+        yield from self.transactions
+        yield from self.archived
@@ -0,0 +1,229 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Create, invalidate or revalidate many transactions at once.
+
+Saving a transaction locks, refreshes and saves both notes, then cancelling hundreds of transactions
+costs thousands of queries. Here the balance delta of each note is computed by the database,
+each note is updated once, and the transactions are flipped with a single UPDATE.
+The permissions and the changelogs are handled as the signals would do.
+Created transactions are inserted one by one, but the balance of each note is also updated once.
+"""
+
+from collections import defaultdict
+from copy import copy
+
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import transaction
+from django.db.models import F, QuerySet, Sum
+from django.dispatch import Signal
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from polymorphic.models import PolymorphicModel
+
+from .models import Note, RecurrentTransaction, Transaction
+from .stats import record_sales_on_commit
+
+BIGINT_MIN = -9223372036854775808
+BIGINT_MAX = 9223372036854775807
+
+# Sent before the validity of transactions changes in bulk, with the queryset of the concerned transactions.
+# A receiver can refuse the change by raising a ValidationError.
+pre_set_validity = Signal()
+
+
+def _check_permissions(request, transactions):
+    """
+    Check that the given request can change the validity of the given transactions.
+    """
+    from permission.backends import PermissionBackend
+
+    by_model = defaultdict(list)
+    for tr in transactions:
+        by_model[type(tr)].append(tr)
+
+    for model_transactions in by_model.values():
+        changeable_fields = PermissionBackend.get_changeable_fields_batch(request, model_transactions,
+                                                                          ["valid", "invalidity_reason"])
+        for tr in model_transactions:
+            if "valid" not in changeable_fields[tr.pk] or "invalidity_reason" not in changeable_fields[tr.pk]:
+                raise PermissionDenied(
+                    _("You don't have the permission to change the field {field} on this instance of model"
+                      " {app_label}.{model_name}.")
+                    .format(field="valid", app_label=tr._meta.app_label, model_name=tr._meta.model_name, )
+                )
+
+
+def _get_deltas(queryset, valid):
+    """
+    Compute in the database the balance delta of each note when the validity of the given transactions changes.
+    """
+    # A transaction that becomes valid debits its source, a transaction that becomes invalid refunds it
+    sign = 1 if valid else -1
+    deltas = defaultdict(int)
+    for row in queryset.order_by().values("source_id").annotate(sum=Sum("total")):
+        deltas[row["source_id"]] -= sign * row["sum"]
+    for row in queryset.order_by().values("destination_id").annotate(sum=Sum("total")):
+        deltas[row["destination_id"]] += sign * row["sum"]
+    return {note_id: delta for note_id, delta in deltas.items() if delta}
+
+
+def _update_balances(notes, deltas):
+    """
+    Apply the balance deltas with one UPDATE per note.
+    The users and the clubs that become negative are warned once the balances are committed.
+    :param notes: The locked notes, by primary key
+    :param deltas: The balance delta of each note, by primary key
+    :return: The updated copies of the notes
+    """
+    for note_id, delta in deltas.items():
+        if not BIGINT_MIN <= notes[note_id].balance + delta <= BIGINT_MAX:
+            raise ValidationError(_("The note balances must be between - 92 233 720 368 547 758.08 € "
+                                    "and 92 233 720 368 547 758.07 €."))
+
+    now = timezone.now()
+    updated_notes = []
+    for note_id, delta in deltas.items():
+        note = copy(notes[note_id])
+        note.balance += delta
+        update = dict(balance=F("balance") + delta)
+        # Only users and clubs are warned, as the signal pre_save_note does
+        if hasattr(note, "send_mail_negative_balance") and notes[note_id].balance >= 0 > note.balance:
+            # Passage en négatif
+            note.last_negative = update["last_negative"] = now
+            transaction.on_commit(note.send_mail_negative_balance)
+        Note.objects.filter(pk=note_id).update(**update)
+        updated_notes.append(note)
+    return updated_notes
+
+
+@transaction.atomic
+def set_transactions_validity(request, transactions, valid, invalidity_reason="", force=False):
+    """
+    Invalidate or revalidate several transactions at once.
+    The result is the same as saving each transaction: the balances of the notes are updated,
+    the permissions of the request are checked and the changelogs are written.
+    :param request: The current request, or None if the modification is done in a shell
+    :param transactions: A queryset or a list of primary keys of transactions
+    :param valid: True to revalidate the transactions, False to invalidate them
+    :param invalidity_reason: The reason of the invalidation
+    :param force: Accept transactions that touch an inactive note
+    :return: The list of the transactions that changed
+    """
+    from logs.signals import EXCLUDED as LOGS_EXCLUDED, get_actor, get_changelog
+    from logs.models import Changelog
+
+    if not isinstance(transactions, QuerySet):
+        transactions = Transaction.objects.filter(pk__in=list(transactions))
+    # Transactions between a note and itself are never saved
+    queryset = Transaction.objects.filter(pk__in=transactions.values("pk"), valid=not valid)\
+        .exclude(source_id=F("destination_id"))
+
+    # Lock the notes in a consistent order to avoid deadlocks, then the concerned transactions
+    note_ids = set()
+    for source_id, destination_id in queryset.values_list("source_id", "destination_id"):
+        note_ids |= {source_id, destination_id}
+    notes = {note.pk: note for note in Note.objects.select_for_update().filter(pk__in=note_ids).order_by("pk")}
+    pks = list(queryset.select_for_update().values_list("pk", flat=True))
+    if not pks:
+        return []
+    queryset = Transaction.objects.filter(pk__in=pks)
+    previous = list(queryset.order_by("pk"))
+
+    if not force and any(not note.is_active for note in notes.values()):
+        raise ValidationError(_("The transaction can't be saved since the source note "
+                                "or the destination note is not active."))
+
+    if request is not None:
+        _check_permissions(request, previous)
+
+    pre_set_validity.send(sender=Transaction, queryset=queryset)
+
+    deltas = _get_deltas(queryset, valid)
+    updated_notes = _update_balances(notes, deltas)
+
+    # One UPDATE for all the transactions. A valid transaction has no invalidity reason.
+    invalidity_reason = "" if valid else invalidity_reason
+    queryset.update(valid=valid, invalidity_reason=invalidity_reason)
+
+    # Write the changelogs of the transactions and of the notes, as the signals would do
+    user, ip = get_actor(request)
+    changelogs = []
+    changed = []
+    for old in previous:
+        new = copy(old)
+        new.valid = valid
+        new.invalidity_reason = invalidity_reason
+        changed.append(new)
+        if old._meta.label_lower not in LOGS_EXCLUDED:
+            changelogs.append(get_changelog(new, old, user, ip))
+    for note in updated_notes:
+        if note._meta.label_lower not in LOGS_EXCLUDED:
+            changelogs.append(get_changelog(note, notes[note.pk], user, ip))
+    Changelog.objects.bulk_create([changelog for changelog in changelogs if changelog is not None])
+
+    record_sales_on_commit([tr for tr in changed if isinstance(tr, RecurrentTransaction)], 1 if valid else -1)
+
+    return changed
+
+
+@transaction.atomic
+def create_transactions(request, transactions, force=False):
+    """
+    Create several transactions at once.
+    The transactions are inserted with their signals, that check the permissions and write the changelogs,
+    but the notes are locked once and the balance of each note is updated with a single UPDATE.
+    :param request: The current request, or None if the modification is done in a shell
+    :param transactions: The transactions to create, that are not saved yet
+    :param force: Accept transactions that touch an inactive note
+    :return: The list of the created transactions
+    """
+    from logs.signals import EXCLUDED as LOGS_EXCLUDED, get_actor, get_changelog
+    from logs.models import Changelog
+
+    # Transactions between a note and itself are never saved
+    transactions = [tr for tr in transactions if tr.source_id != tr.destination_id]
+    if not transactions:
+        return []
+
+    # Lock the notes in a consistent order to avoid deadlocks
+    note_ids = set()
+    for tr in transactions:
+        note_ids |= {tr.source_id, tr.destination_id}
+    notes = {note.pk: note for note in Note.objects.select_for_update().filter(pk__in=note_ids).order_by("pk")}
+
+    if not force and any(not note.is_active for note in notes.values()):
+        raise ValidationError(_("The transaction can't be saved since the source note "
+                                "or the destination note is not active."))
+
+    deltas = defaultdict(int)
+    for tr in transactions:
+        tr.source, tr.destination = notes[tr.source_id], notes[tr.destination_id]
+        tr.clean()
+        if tr.valid:
+            deltas[tr.source_id] -= tr.amount * tr.quantity
+            deltas[tr.destination_id] += tr.amount * tr.quantity
+            tr.invalidity_reason = ""
+    deltas = {note_id: delta for note_id, delta in deltas.items() if delta}
+
+    for tr in transactions:
+        # If the aliases are not entered, we assume that the used alias is the name of the note
+        if not tr.source_alias:
+            tr.source_alias = str(tr.source)
+        if not tr.destination_alias:
+            tr.destination_alias = str(tr.destination)
+        # Insert the transaction without touching the notes, the balances are updated below
+        PolymorphicModel.save(tr)
+
+    updated_notes = _update_balances(notes, deltas)
+
+    # Write the changelogs of the notes, as the signals would do
+    user, ip = get_actor(request)
+    changelogs = [get_changelog(note, notes[note.pk], user, ip) for note in updated_notes
+                  if note._meta.label_lower not in LOGS_EXCLUDED]
+    Changelog.objects.bulk_create([changelog for changelog in changelogs if changelog is not None])
+
+    record_sales_on_commit([tr for tr in transactions if isinstance(tr, RecurrentTransaction) and tr.valid], 1)
+
+    return transactions
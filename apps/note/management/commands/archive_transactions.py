@@ -0,0 +1,75 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from datetime import date, datetime, time
+
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+
+from ...archive import archive_transactions, compute_balance, get_archive_horizon, get_archived_types, \
+    restore_transactions
+from ...models import ArchivedTransaction, Note, Transaction
+
+
+class Command(BaseCommand):
+    help = "Move old transactions into the archive, or restore them. The work is done by chunks, " \
+           "then the command can be stopped and run again at any time. " \
+           "Example: ./manage.py archive_transactions --before 2019-09-01"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', '-b', type=date.fromisoformat, default=None,
+                            help="Archive the transactions that were created before this date (YYYY-MM-DD). "
+                                 "Default: the start of the academic year, TRANSACTION_ARCHIVE_YEARS years ago.")
+        parser.add_argument('--restore', '-r', action='store_true',
+                            help="Move the archived transactions back into the transaction table.")
+        parser.add_argument('--after', '-a', type=date.fromisoformat, default=None,
+                            help="With --restore, only restore the transactions that were created after this date.")
+        parser.add_argument('--chunk-size', '-c', type=int, default=1000,
+                            help="The maximum number of transactions that are moved in one database transaction.")
+        parser.add_argument('--dry-run', '-n', action='store_true', help="Only count the transactions.")
+        parser.add_argument('--check', action='store_true',
+                            help="Check that the balance of each note is the sum of its transactions, "
+                                 "archived or not.")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] <= 0:
+            raise CommandError("The chunk size must be positive.")
+
+        if options["check"]:
+            return self.check_balances()
+
+        if options["restore"]:
+            queryset = ArchivedTransaction.objects.all()
+            if options["after"]:
+                queryset = queryset.filter(
+                    created_at__gte=timezone.make_aware(datetime.combine(options["after"], time.min)))
+            if options["dry_run"]:
+                self.stdout.write(f"{queryset.count()} transactions would be restored.")
+                return
+            count = restore_transactions(options["after"], options["chunk_size"])
+            if options["verbosity"] >= 1:
+                self.stdout.write(f"{count} transactions restored.")
+            return
+
+        before = options["before"] or get_archive_horizon()
+        if options["dry_run"]:
+            count = Transaction.objects.filter(
+                created_at__lt=timezone.make_aware(datetime.combine(before, time.min)),
+                polymorphic_ctype__in=get_archived_types(),
+            ).count()
+            self.stdout.write(f"{count} transactions created before {before} would be archived.")
+            return
+        count = archive_transactions(before, options["chunk_size"])
+        if options["verbosity"] >= 1:
+            self.stdout.write(f"{count} transactions created before {before} archived.")
+
+    def check_balances(self):
+        errors = 0
+        for note in Note.objects.order_by("pk").iterator():
+            balance = compute_balance(note)
+            if balance != note.balance:
+                errors += 1
+                self.stderr.write(f"{note}: the balance is {note.balance} but the transactions sum up to {balance}.")
+        if errors:
+            raise CommandError(f"{errors} notes have an inconsistent balance.")
+        self.stdout.write("All the balances are consistent.")
@@ -0,0 +1,38 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from datetime import date, datetime, time
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from ...negative_balances import get_negative_notes, send_negative_balance_mails
+from ...templatetags.pretty_money import pretty_money
+
+
+class Command(BaseCommand):
+    help = "Remind the users and the clubs whose balance is negative to refill their note. " \
+           "Example: ./manage.py notify_negative_balances --negative-amount -10"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--negative-amount', '-n', type=float, default=0,
+                            help="Only remind the notes whose balance is lower than this amount, in euros.")
+        parser.add_argument('--since', '-s', type=date.fromisoformat, default=None,
+                            help="Only remind the notes that became negative since this date (YYYY-MM-DD).")
+        parser.add_argument('--dry-run', '-d', action='store_true',
+                            help="Only print the notes that would be reminded.")
+
+    def handle(self, *args, **options):
+        since = options["since"]
+        if since is not None:
+            since = timezone.make_aware(datetime.combine(since, time.min))
+        notes = get_negative_notes(round(options["negative_amount"] * 100), since)
+
+        if options["dry_run"]:
+            for note in notes:
+                self.stdout.write(f"{note}: {pretty_money(note.balance)}")
+            return
+
+        count = send_negative_balance_mails(notes)
+        if options["verbosity"] >= 1:
+            self.stdout.write(f"{count} mails queued.")
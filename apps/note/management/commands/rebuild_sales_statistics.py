@@ -0,0 +1,31 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from datetime import date, datetime, time
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from ...stats import rebuild_sales_statistics, refresh_highlighted_buttons
+
+
+class Command(BaseCommand):
+    help = "Recompute the sales statistics of the buttons from the transactions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', '-s', type=date.fromisoformat, default=None,
+                            help="Only recompute the statistics from this date (YYYY-MM-DD).")
+        parser.add_argument('--highlight', action='store_true',
+                            help="Then highlight the 10 most sold buttons of the last 30 days.")
+
+    def handle(self, *args, **options):
+        since = options["since"]
+        if since is not None:
+            since = timezone.make_aware(datetime.combine(since, time.min))
+
+        count = rebuild_sales_statistics(since)
+        if options["verbosity"] >= 1:
+            self.stdout.write(f"{count} rows created.")
+
+        if options["highlight"]:
+            refresh_highlighted_buttons()
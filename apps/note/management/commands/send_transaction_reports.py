@@ -0,0 +1,38 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from ...reports import get_due_profiles, get_reports, send_reports
+
+
+class Command(BaseCommand):
+    help = "Send to the users the reports of their transactions, at the frequency they chose in their profile. " \
+           "Example: ./manage.py send_transaction_reports --chunk-size 500"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', '-u', nargs='+', default=None,
+                            help="Only send the reports of these users (usernames), if they are due.")
+        parser.add_argument('--chunk-size', '-c', type=int, default=200,
+                            help="Number of users whose reports are computed and queued at once.")
+        parser.add_argument('--dry-run', '-d', action='store_true',
+                            help="Only print the reports. The dates of the last reports are not updated.")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        users = None
+        if options["user"] is not None:
+            users = User.objects.filter(username__in=options["user"])
+        profiles = get_due_profiles(now, users)
+
+        if options["dry_run"]:
+            for _profile, context in get_reports(profiles, now):
+                self.stdout.write(render_to_string("note/mails/weekly_report.txt", context))
+            return
+
+        count = send_reports(profiles, now, max(options["chunk_size"], 1))
+        if options["verbosity"] >= 1:
+            self.stdout.write(f"{count} reports queued for {len(profiles)} users.")
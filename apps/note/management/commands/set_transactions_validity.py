@@ -0,0 +1,52 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from django.core.exceptions import ValidationError
+from django.core.management import BaseCommand, CommandError
+
+from ...bulk import set_transactions_validity
+from ...models import Transaction
+
+
+class Command(BaseCommand):
+    help = "Invalidate or revalidate many transactions at once. " \
+           "Example: ./manage.py set_transactions_validity --invalidate --reason \"Activity cancelled\" " \
+           "--filter guesttransaction__entry__activity=42"
+
+    def add_arguments(self, parser):
+        action = parser.add_mutually_exclusive_group(required=True)
+        action.add_argument('--invalidate', action='store_true', help="Invalidate the transactions.")
+        action.add_argument('--revalidate', action='store_true', help="Revalidate the transactions.")
+        parser.add_argument('--id', '-i', nargs='+', type=int, default=[], help="The ids of the transactions.")
+        parser.add_argument('--filter', '-f', nargs='+', type=str, default=[],
+                            help="Filters on the transactions, on the form lookup=value, "
+                                 "eg. created_at__gte=2021-01-01 reason__icontains=soirée")
+        parser.add_argument('--reason', '-r', type=str, default="", help="The reason of the invalidation.")
+        parser.add_argument('--force', action='store_true', help="Accept transactions that touch inactive notes.")
+        parser.add_argument('--dry-run', '-n', action='store_true', help="Only count the transactions.")
+
+    def handle(self, *args, **options):
+        if not options["id"] and not options["filter"]:
+            raise CommandError("Give some ids or some filters.")
+
+        queryset = Transaction.objects.all()
+        if options["id"]:
+            queryset = queryset.filter(pk__in=options["id"])
+        for lookup in options["filter"]:
+            if "=" not in lookup:
+                raise CommandError(f"The filter {lookup} must be on the form lookup=value.")
+            key, value = lookup.split("=", 1)
+            queryset = queryset.filter(**{key: value})
+
+        valid = options["revalidate"]
+        if options["dry_run"]:
+            count = queryset.filter(valid=not valid).count()
+            self.stdout.write(f"{count} transactions would be {'revalidated' if valid else 'invalidated'}.")
+            return
+
+        try:
+            changed = set_transactions_validity(None, queryset, valid, options["reason"], force=options["force"])
+        except ValidationError as e:
+            raise CommandError(" ".join(e.messages))
+        if options["verbosity"] >= 1:
+            self.stdout.write(f"{len(changed)} transactions {'revalidated' if valid else 'invalidated'}.")
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:54
+
+from django.db import migrations, models
+from django.db.models import F
+import note.models.transactions
+
+
+def compute_totals(apps, schema_editor):
+    Transaction = apps.get_model("note", "transaction")
+    db_alias = schema_editor.connection.alias
+    Transaction.objects.using(db_alias).update(total=F("amount") * F("quantity"))
+
+
+# Text fields of transactions that are searched
+SEARCHED_FIELDS = ["reason", "source_alias", "destination_alias"]
+
+
+def create_search_indexes(apps, schema_editor):
+    """
+    On PostgreSQL, the search of transactions uses trigram indexes, that support the regular expressions and ILIKE.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for field in SEARCHED_FIELDS:
+        schema_editor.execute(f"CREATE INDEX IF NOT EXISTS note_transaction_{field}_trgm "
+                              f"ON note_transaction USING gin ({field} gin_trgm_ops)")
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for field in SEARCHED_FIELDS:
+        schema_editor.execute(f"DROP INDEX IF EXISTS note_transaction_{field}_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('note', '0003_alter_note_polymorphic_ctype_and_more'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='note_transa_source__4a1a1e_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='note_transa_destina_6e1bb4_idx',
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='total',
+            field=note.models.transactions.TotalField(default=0, editable=False, verbose_name='total'),
+        ),
+        migrations.RunPython(compute_totals, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['source', 'created_at'], name='note_transa_source__51e41e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['destination', 'created_at'], name='note_transa_destina_e131b6_idx'),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:05
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('note', '0004_transaction_total'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateField(verbose_name='period start')),
+                ('transactions', models.PositiveIntegerField(default=0, verbose_name='archived transactions')),
+                ('incoming', models.BigIntegerField(default=0, verbose_name='incoming total')),
+                ('outgoing', models.BigIntegerField(default=0, verbose_name='outgoing total')),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='note.note', verbose_name='note')),
+            ],
+            options={
+                'verbose_name': 'transaction summary',
+                'verbose_name_plural': 'transaction summaries',
+                'unique_together': {('note', 'period_start')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedTransaction',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_alias', models.CharField(max_length=255, verbose_name='used alias')),
+                ('destination_alias', models.CharField(max_length=255, verbose_name='used alias')),
+                ('created_at', models.DateTimeField(verbose_name='created at')),
+                ('quantity', models.PositiveIntegerField(verbose_name='quantity')),
+                ('amount', models.PositiveIntegerField(verbose_name='amount')),
+                ('total', models.BigIntegerField(verbose_name='total')),
+                ('reason', models.CharField(max_length=255, verbose_name='reason')),
+                ('valid', models.BooleanField(verbose_name='valid')),
+                ('invalidity_reason', models.CharField(blank=True, max_length=255, verbose_name='invalidity reason')),
+                ('extra', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='extra fields')),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='archived at')),
+                ('destination', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='note.note', verbose_name='destination')),
+                ('polymorphic_ctype', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='contenttypes.contenttype', verbose_name='type')),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='note.note', verbose_name='source')),
+            ],
+            options={
+                'verbose_name': 'archived transaction',
+                'verbose_name_plural': 'archived transactions',
+                'indexes': [models.Index(fields=['source', 'created_at'], name='note_archiv_source__2a3897_idx'), models.Index(fields=['destination', 'created_at'], name='note_archiv_destina_104c18_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:11
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def compute_statistics(apps, schema_editor):
+    """
+    Fill the sales statistics with the existing valid sales.
+    """
+    RecurrentTransaction = apps.get_model("note", "recurrenttransaction")
+    SalesStatistic = apps.get_model("note", "salesstatistic")
+    db_alias = schema_editor.connection.alias
+    for granularity, trunc in [("hour", TruncHour), ("day", TruncDay)]:
+        rows = RecurrentTransaction.objects.using(db_alias).filter(valid=True)\
+            .annotate(period=trunc("created_at", tzinfo=timezone.get_current_timezone()))\
+            .order_by().values("template_id", "destination_id", "period")\
+            .annotate(sum_quantity=Sum("quantity"), sum_total=Sum("total"), count=Count("pk"))
+        SalesStatistic.objects.using(db_alias).bulk_create([SalesStatistic(
+            granularity=granularity,
+            period_start=row["period"],
+            template_id=row["template_id"],
+            destination_id=row["destination_id"],
+            quantity=row["sum_quantity"],
+            revenue=row["sum_total"],
+            transactions=row["count"],
+        ) for row in rows.iterator()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('note', '0005_transaction_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesStatistic',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'hour'), ('day', 'day')], max_length=4, verbose_name='granularity')),
+                ('period_start', models.DateTimeField(verbose_name='period start')),
+                ('quantity', models.BigIntegerField(default=0, verbose_name='quantity')),
+                ('revenue', models.BigIntegerField(default=0, verbose_name='revenue')),
+                ('transactions', models.PositiveIntegerField(default=0, verbose_name='transactions')),
+                ('destination', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='note.note', verbose_name='destination')),
+                ('template', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='note.transactiontemplate', verbose_name='template')),
+            ],
+            options={
+                'verbose_name': 'sales statistic',
+                'verbose_name_plural': 'sales statistics',
+                'indexes': [models.Index(fields=['granularity', 'period_start'], name='note_saless_granula_643be7_idx')],
+                'unique_together': {('granularity', 'template', 'destination', 'period_start')},
+            },
+        ),
+        migrations.RunPython(compute_statistics, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('note', '0006_sales_statistics'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['balance', 'last_negative'], name='note_note_balance_b9c653_idx'),
+        ),
+    ]
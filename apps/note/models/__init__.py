@@ -1,7 +1,9 @@
 # Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+from .archive import ArchivedTransaction, TransactionSummary
 from .notes import Alias, Note, NoteClub, NoteSpecial, NoteUser, Trust
+from .stats import SalesStatistic
 from .transactions import MembershipTransaction, Transaction, \
     TemplateCategory, TransactionTemplate, RecurrentTransaction, SpecialTransaction
 
@@ -11,4 +13,8 @@ __all__ = [
     # Transactions
     'MembershipTransaction', 'Transaction', 'TemplateCategory', 'TransactionTemplate',
     'RecurrentTransaction', 'SpecialTransaction',
+    # Archive
+    'ArchivedTransaction', 'TransactionSummary',
+    # Statistics
+    'SalesStatistic',
 ]
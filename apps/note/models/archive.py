@@ -0,0 +1,182 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from .notes import Note
+from .transactions import Transaction
+
+
+class ArchivedTransaction(models.Model):
+    """
+    An old :model:`note.Transaction`, that was moved out of the transaction table.
+    The fields of the transaction are kept, and the fields of its subclass (eg. the template
+    of a :model:`note.RecurrentTransaction`) are stored in `extra`.
+    Archived transactions are read-only, see note.archive.
+    """
+
+    id = models.PositiveIntegerField(
+        primary_key=True,
+        verbose_name=_('ID'),
+    )
+
+    polymorphic_ctype = models.ForeignKey(
+        ContentType,
+        on_delete=models.PROTECT,
+        related_name='+',
+        verbose_name=_('type'),
+    )
+
+    source = models.ForeignKey(
+        Note,
+        on_delete=models.PROTECT,
+        related_name='+',
+        verbose_name=_('source'),
+    )
+
+    source_alias = models.CharField(
+        max_length=255,
+        verbose_name=_('used alias'),
+    )
+
+    destination = models.ForeignKey(
+        Note,
+        on_delete=models.PROTECT,
+        related_name='+',
+        verbose_name=_('destination'),
+    )
+
+    destination_alias = models.CharField(
+        max_length=255,
+        verbose_name=_('used alias'),
+    )
+
+    created_at = models.DateTimeField(
+        verbose_name=_('created at'),
+    )
+
+    quantity = models.PositiveIntegerField(
+        verbose_name=_('quantity'),
+    )
+
+    amount = models.PositiveIntegerField(
+        verbose_name=_('amount'),
+    )
+
+    total = models.BigIntegerField(
+        verbose_name=_('total'),
+    )
+
+    reason = models.CharField(
+        verbose_name=_('reason'),
+        max_length=255,
+    )
+
+    valid = models.BooleanField(
+        verbose_name=_('valid'),
+    )
+
+    invalidity_reason = models.CharField(
+        verbose_name=_('invalidity reason'),
+        max_length=255,
+        blank=True,
+    )
+
+    extra = models.JSONField(
+        encoder=DjangoJSONEncoder,
+        default=dict,
+        verbose_name=_('extra fields'),
+    )
+
+    archived_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name=_('archived at'),
+    )
+
+    class Meta:
+        verbose_name = _("archived transaction")
+        verbose_name_plural = _("archived transactions")
+        indexes = [
+            models.Index(fields=['source', 'created_at']),
+            models.Index(fields=['destination', 'created_at']),
+        ]
+
+    @staticmethod
+    def from_transaction(tr):
+        """
+        Build the archive of a transaction, given with its real type.
+        """
+        archived = ArchivedTransaction(
+            extra={field.attname: getattr(tr, field.attname) for field in tr._meta.local_concrete_fields
+                   if not field.primary_key} if type(tr) is not Transaction else {},
+        )
+        for field in Transaction._meta.concrete_fields:
+            setattr(archived, field.attname, getattr(tr, field.attname))
+        return archived
+
+    def to_transaction(self):
+        """
+        Rebuild the original transaction, with its real type. The transaction is not saved.
+        """
+        model = self.polymorphic_ctype.model_class()
+        tr = model()
+        for field in Transaction._meta.concrete_fields:
+            setattr(tr, field.attname, getattr(self, field.attname))
+        # For a subclass, the primary key is the link to the parent
+        tr.pk = self.id
+        for attname, value in self.extra.items():
+            field = next(field for field in model._meta.concrete_fields if field.attname == attname)
+            setattr(tr, attname, field.to_python(value))
+        return tr
+
+    @property
+    def type(self):
+        return self.to_transaction().type
+
+    def __str__(self):
+        return str(self.to_transaction())
+
+
+class TransactionSummary(models.Model):
+    """
+    Sums of the archived transactions of a note during one month.
+    Only valid transactions are counted in the totals.
+    """
+
+    note = models.ForeignKey(
+        Note,
+        on_delete=models.PROTECT,
+        related_name='+',
+        verbose_name=_('note'),
+    )
+
+    period_start = models.DateField(
+        verbose_name=_('period start'),
+    )
+
+    transactions = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_('archived transactions'),
+    )
+
+    incoming = models.BigIntegerField(
+        default=0,
+        verbose_name=_('incoming total'),
+    )
+
+    outgoing = models.BigIntegerField(
+        default=0,
+        verbose_name=_('outgoing total'),
+    )
+
+    class Meta:
+        verbose_name = _("transaction summary")
+        verbose_name_plural = _("transaction summaries")
+        unique_together = ('note', 'period_start', )
+
+    def __str__(self):
+        return f"{self.note} ({self.period_start:%Y-%m})"
@@ -5,7 +5,7 @@ import unicodedata
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives
 from django.core.validators import RegexValidator
 from django.db import models, transaction
 from django.template.loader import render_to_string
@@ -76,6 +76,10 @@ class Note(PolymorphicModel):
     class Meta:
         verbose_name = _("note")
         verbose_name_plural = _("notes")
+        indexes = [
+            # The negative notes are found without scanning all notes
+            models.Index(fields=['balance', 'last_negative']),
+        ]
 
     def pretty(self):
         """
@@ -92,6 +96,13 @@ class Note(PolymorphicModel):
         delta = timezone.now() - self.last_negative
         return "{:d} jours".format(delta.days)
 
+    def balance_at(self, when):
+        """
+        :return: The balance of the note just before the given date, including the archived transactions
+        """
+        from ..archive import balance_at
+        return balance_at(self, when)
+
     @transaction.atomic
     def save(self, *args, **kwargs):
         """
@@ -158,11 +169,19 @@ class NoteUser(Note):
     def pretty(self):
         return _("%(user)s's note") % {'user': str(self.user)}
 
-    def send_mail_negative_balance(self):
+    def negative_balance_message(self):
+        """
+        :return: The unsent mail that warns the user that the balance is negative
+        """
         plain_text = render_to_string("note/mails/negative_balance.txt", dict(note=self))
         html = render_to_string("note/mails/negative_balance.html", dict(note=self))
-        self.user.email_user("[Note Kfet] Passage en négatif (compte n°{:d})"
-                             .format(self.user.pk), plain_text, html_message=html)
+        message = EmailMultiAlternatives("[Note Kfet] Passage en négatif (compte n°{:d})".format(self.user.pk),
+                                         plain_text, settings.DEFAULT_FROM_EMAIL, [self.user.email])
+        message.attach_alternative(html, "text/html")
+        return message
+
+    def send_mail_negative_balance(self):
+        self.negative_balance_message().send()
 
 
 class NoteClub(Note):
@@ -186,11 +205,19 @@ class NoteClub(Note):
     def pretty(self):
         return _("Note of %(club)s club") % {'club': str(self.club)}
 
-    def send_mail_negative_balance(self):
+    def negative_balance_message(self):
+        """
+        :return: The unsent mail that warns the club that the balance is negative
+        """
         plain_text = render_to_string("note/mails/negative_balance.txt", dict(note=self))
         html = render_to_string("note/mails/negative_balance.html", dict(note=self))
-        send_mail("[Note Ker Lann] Passage en négatif (club {})".format(self.club.name), plain_text,
-                  settings.DEFAULT_FROM_EMAIL, [self.club.email], html_message=html)
+        message = EmailMultiAlternatives("[Note Ker Lann] Passage en négatif (club {})".format(self.club.name),
+                                         plain_text, settings.DEFAULT_FROM_EMAIL, [self.club.email])
+        message.attach_alternative(html, "text/html")
+        return message
+
+    def send_mail_negative_balance(self):
+        self.negative_balance_message().send()
 
 
 class NoteSpecial(Note):
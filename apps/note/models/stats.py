@@ -0,0 +1,68 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+from .notes import Note
+from .transactions import TransactionTemplate
+
+
+class SalesStatistic(models.Model):
+    """
+    Sales of a :model:`note.TransactionTemplate` to a club during one hour or one day.
+    Only valid transactions are counted. The rows are maintained incrementally, see note.stats.
+    """
+
+    granularity = models.CharField(
+        max_length=4,
+        choices=[
+            ('hour', _("hour")),
+            ('day', _("day")),
+        ],
+        verbose_name=_('granularity'),
+    )
+
+    period_start = models.DateTimeField(
+        verbose_name=_('period start'),
+    )
+
+    template = models.ForeignKey(
+        TransactionTemplate,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name=_('template'),
+    )
+
+    destination = models.ForeignKey(
+        Note,
+        on_delete=models.PROTECT,
+        related_name='+',
+        verbose_name=_('destination'),
+    )
+
+    quantity = models.BigIntegerField(
+        default=0,
+        verbose_name=_('quantity'),
+    )
+
+    revenue = models.BigIntegerField(
+        default=0,
+        verbose_name=_('revenue'),
+    )
+
+    transactions = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_('transactions'),
+    )
+
+    class Meta:
+        verbose_name = _("sales statistic")
+        verbose_name_plural = _("sales statistics")
+        unique_together = ('granularity', 'template', 'destination', 'period_start', )
+        indexes = [
+            models.Index(fields=['granularity', 'period_start']),
+        ]
+
+    def __str__(self):
+        return f"{self.template} ({self.granularity} {self.period_start:%Y-%m-%d %H:%M})"
@@ -94,6 +94,19 @@ class TransactionTemplate(models.Model):
         return self.name
 
 
+class TotalField(models.BigIntegerField):
+    """
+    Total amount of a transaction, ie. the amount multiplied by the quantity.
+    It is stored to be filtered, sorted and indexed by the database, and it is computed each time
+    the transaction is written, even if the method save is bypassed.
+    """
+
+    def pre_save(self, model_instance, add):
+        value = model_instance.amount * model_instance.quantity
+        setattr(model_instance, self.attname, value)
+        return value
+
+
 class Transaction(PolymorphicModel):
     """
     General transaction between two :model:`note.Note`
@@ -140,6 +153,12 @@ class Transaction(PolymorphicModel):
         verbose_name=_('amount'),
     )
 
+    total = TotalField(
+        verbose_name=_('total'),
+        default=0,
+        editable=False,
+    )
+
     reason = models.CharField(
         verbose_name=_('reason'),
         max_length=255,
@@ -162,8 +181,9 @@ class Transaction(PolymorphicModel):
         verbose_name_plural = _("transactions")
         indexes = [
             models.Index(fields=['created_at']),
-            models.Index(fields=['source']),
-            models.Index(fields=['destination']),
+            # The history of a note is sorted by date
+            models.Index(fields=['source', 'created_at']),
+            models.Index(fields=['destination', 'created_at']),
         ]
 
     def validate(self):
@@ -174,11 +194,14 @@ class Transaction(PolymorphicModel):
         dest_balance = previous_dest_balance
 
         created = self.pk is None
-        to_transfer = self.total
+        to_transfer = self.amount * self.quantity
+        # The stored transaction is kept for the sales statistics and the protection of the closed periods
+        self._old_transaction = None
         if not created:
             # Revert old transaction
             # We make a select for update to avoid concurrency issues
             old_transaction = Transaction.objects.select_for_update().get(pk=self.pk)
+            self._old_transaction = old_transaction
             # Check that nothing important changed
             if not hasattr(self, "_force_save"):
                 for field_name in ["source_id", "destination_id", "quantity", "amount"]:
@@ -238,20 +261,18 @@ class Transaction(PolymorphicModel):
         # We save first the transaction, in case of the user has no right to transfer money
         super().save(*args, **kwargs)
 
-        # Save notes
+        # Save notes. The previous balances are given to the signal that detects negative balances.
         self.source.refresh_from_db()
+        self.source._previous_balance = self.source.balance
         self.source.balance += diff_source
         self.source._force_save = True
         self.source.save()
         self.destination.refresh_from_db()
+        self.destination._previous_balance = self.destination.balance
         self.destination.balance += diff_dest
         self.destination._force_save = True
         self.destination.save()
 
-    @property
-    def total(self):
-        return self.amount * self.quantity
-
     @property
     def type(self):
         return _('Transfer')
@@ -279,8 +300,29 @@ class RecurrentTransaction(Transaction):
 
     @transaction.atomic
     def save(self, *args, **kwargs):
+        from ..stats import record_sales_on_commit
+
         self.clean()
-        return super().save(*args, **kwargs)
+        created = self.pk is None
+        # The stored transaction is locked and read by Transaction.validate
+        self._old_transaction = None
+        ret = super().save(*args, **kwargs)
+        old = self._old_transaction
+        if self.pk is None or (not created and old is None):
+            # Nothing was saved
+            return ret
+
+        # Update the sales statistics when the counted sale changes
+        old_sale = (self.template_id, old.destination_id, old.created_at, old.quantity, old.total) \
+            if old is not None and old.valid else None
+        new_sale = (self.template_id, self.destination_id, self.created_at, self.quantity, self.total) \
+            if self.valid else None
+        if old_sale != new_sale:
+            if old_sale is not None:
+                record_sales_on_commit([old_sale], -1)
+            if new_sale is not None:
+                record_sales_on_commit([new_sale], 1)
+        return ret
 
     @property
     def type(self):
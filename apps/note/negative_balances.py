@@ -0,0 +1,48 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Mails to the users and the clubs whose balance is negative.
+
+When a balance becomes negative, the signal pre_save_note warns the owner once the transaction is committed.
+The reminders are sent by batches with `./manage.py notify_negative_balances`: the negative notes are found
+with one query over the index on (balance, last_negative), and all the mails are queued at once.
+"""
+
+from django.core.mail import get_connection
+
+from .models import Note
+
+
+def get_negative_notes(max_balance=0, since=None):
+    """
+    Return the notes of users and clubs whose balance is lower than the given one, the lowest first.
+    :param max_balance: The balance in cents below which a note is returned
+    :param since: Only return the notes that became negative after this date
+    :return: The list of the notes, as NoteUser and NoteClub objects
+    """
+    queryset = Note.objects.non_polymorphic().filter(balance__lt=max_balance)
+    if since is not None:
+        queryset = queryset.filter(last_negative__gte=since)
+    # The users and the clubs are fetched in the same query
+    queryset = queryset.select_related("noteuser__user", "noteclub__club").order_by("balance", "pk")
+
+    notes = []
+    for note in queryset:
+        note = getattr(note, "noteuser", None) or getattr(note, "noteclub", None)
+        if note is not None:
+            # Special notes are never warned
+            notes.append(note)
+    return notes
+
+
+def send_negative_balance_mails(notes, connection=None):
+    """
+    Render and queue the mails that warn the given notes that their balance is negative.
+    :return: The number of queued mails
+    """
+    messages = [note.negative_balance_message() for note in notes]
+    if not messages:
+        return 0
+    connection = connection or get_connection()
+    return connection.send_messages(messages) or 0
@@ -0,0 +1,175 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Reports of the transactions, that the users receive at the frequency they chose in their profile.
+
+`./manage.py send_transaction_reports` selects the users whose report is due with one query, then handles them
+by chunks: the transactions of the chunk are streamed with one query sorted by date and dispatched to the notes,
+the totals and the balances are computed in Python, the mails are queued at once and the dates of the last reports
+are updated with one bulk_update. The number of queries depends on the number of chunks, not of users.
+"""
+
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import DateTimeField, DurationField, ExpressionWrapper, F, Func, Q, Value
+from django.template.loader import render_to_string
+from django.utils import timezone
+from member.models import Profile
+
+from .models import Note, Transaction
+from .tables import HistoryTable
+
+
+class Days(Func):
+    """
+    A number of days, given by an integer expression, as a duration.
+    """
+    template = "(%(expressions)s * INTERVAL '1 day')"
+    output_field = DurationField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # SQLite stores the durations in microseconds
+        return self.as_sql(compiler, connection, template="(%(expressions)s * 86400000000)", **extra_context)
+
+
+def get_due_profiles(now=None, users=None):
+    """
+    Return the profiles of the active users whose report is due, with their notes, with one query.
+    A report is due when at least `report_frequency` days have passed since the last one.
+    :param users: Only consider these users
+    """
+    now = now or timezone.now()
+    tomorrow = timezone.make_aware(datetime.combine(timezone.localdate(now) + timedelta(days=1), time.min))
+    # The last report must be before the day that is `report_frequency` days ago, included
+    queryset = Profile.objects.annotate(
+        due_before=ExpressionWrapper(Value(tomorrow) - Days("report_frequency"), output_field=DateTimeField()),
+    ).filter(
+        report_frequency__gt=0,
+        last_report__lt=F("due_before"),
+        user__is_active=True,
+        user__note__isnull=False,
+    ).select_related("user__note").order_by("pk")
+    if users is not None:
+        queryset = queryset.filter(user__in=users)
+    return list(queryset)
+
+
+def _get_notes(note_ids):
+    """
+    Fetch the notes with their real types and their names, in one query.
+    """
+    notes = {}
+    for note in Note.objects.non_polymorphic().filter(pk__in=note_ids)\
+            .select_related("noteuser__user", "noteclub__club", "notespecial"):
+        notes[note.pk] = getattr(note, "noteuser", None) or getattr(note, "noteclub", None) \
+            or getattr(note, "notespecial", None) or note
+    return notes
+
+
+def _with_real_type(tr):
+    """
+    Rebuild a transaction that was fetched without its subclass, to display its type.
+    """
+    model = tr.polymorphic_ctype.model_class()
+    if model is Transaction:
+        return tr
+    real = model()
+    for field in Transaction._meta.concrete_fields:
+        setattr(real, field.attname, getattr(tr, field.attname))
+    # For a subclass, the primary key is the link to the parent
+    real.pk = tr.pk
+    return real
+
+
+def get_reports(profiles, now):
+    """
+    Compute the reports of the given profiles, for the transactions since their last report until now.
+    The users that have no transaction in this period don't get a report.
+    :return: A list of (profile, context of the mail)
+    """
+    last_reports = {profile.user.note.pk: profile.last_report for profile in profiles}
+    if not last_reports:
+        return []
+
+    # One streamed query for the whole chunk, each transaction goes to its source and its destination
+    transactions = defaultdict(list)
+    queryset = Transaction.objects.non_polymorphic()\
+        .filter(Q(source_id__in=last_reports) | Q(destination_id__in=last_reports),
+                created_at__gt=min(last_reports.values()), created_at__lte=now)\
+        .select_related("polymorphic_ctype").order_by("created_at", "pk")
+    for tr in queryset.iterator(chunk_size=2000):
+        tr = _with_real_type(tr)
+        for note_id in (tr.source_id, tr.destination_id):
+            if note_id in last_reports and tr.created_at > last_reports[note_id]:
+                transactions[note_id].append(tr)
+
+    notes = _get_notes({note_id for trs in transactions.values() for tr in trs
+                        for note_id in (tr.source_id, tr.destination_id)})
+
+    reports = []
+    for profile in profiles:
+        note = profile.user.note
+        note_transactions = transactions.get(note.pk)
+        if not note_transactions:
+            continue
+        incoming = outcoming = 0
+        for tr in note_transactions:
+            tr.source, tr.destination = notes[tr.source_id], notes[tr.destination_id]
+            if tr.valid:
+                if tr.destination_id == note.pk:
+                    incoming += tr.total
+                else:
+                    outcoming += tr.total
+
+        reports.append((profile, dict(
+            user=profile.user,
+            last_report=profile.last_report,
+            now=now,
+            incoming=incoming,
+            outcoming=outcoming,
+            diff=incoming - outcoming,
+            opening_balance=note.balance - incoming + outcoming,
+            closing_balance=note.balance,
+            last_transactions=note_transactions,
+            table=HistoryTable(note_transactions),
+        )))
+    return reports
+
+
+def report_message(profile, context):
+    """
+    :return: The unsent mail of a report
+    """
+    plain_text = render_to_string("note/mails/weekly_report.txt", context)
+    html = render_to_string("note/mails/weekly_report.html", context)
+    message = EmailMultiAlternatives("[Note Ker Lann] Rapport de la Note Ker Lann", plain_text,
+                                     settings.DEFAULT_FROM_EMAIL, [profile.user.email])
+    message.attach_alternative(html, "text/html")
+    return message
+
+
+def send_reports(profiles, now=None, chunk_size=200, connection=None):
+    """
+    Queue the reports of the given profiles and update the dates of their last reports, chunk by chunk.
+    The date of the last report is also updated for the users that had no transaction.
+    :return: The number of queued mails
+    """
+    now = now or timezone.now()
+    connection = connection or get_connection()
+    count = 0
+    for i in range(0, len(profiles), chunk_size):
+        chunk = profiles[i:i + chunk_size]
+        messages = [report_message(profile, context) for profile, context in get_reports(chunk, now)]
+        # The mails of a chunk are queued if and only if the dates are updated
+        with transaction.atomic():
+            if messages:
+                count += connection.send_messages(messages) or 0
+            for profile in chunk:
+                profile.last_report = now
+            Profile.objects.bulk_update(chunk, ["last_report"])
+    return count
@@ -1,6 +1,7 @@
 # Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+from django.db import transaction
 from django.utils import timezone
 
 
@@ -28,13 +29,19 @@ def save_club_note(instance, raw, **_kwargs):
 
 
 def pre_save_note(instance, raw, **_kwargs):
+    """
+    When the balance of a user or a club becomes negative, store the date and warn them once the change is committed.
+    """
+    # The ledger gives the balance before its update, see Transaction.save
+    previous_balance = instance.__dict__.pop("_previous_balance", None)
     if not raw and instance.pk and not hasattr(instance, "_no_signal") and instance.balance < 0:
-        from note.models import Note
-        old_note = Note.objects.get(pk=instance.pk)
-        if old_note.balance >= 0:
+        if previous_balance is None:
+            from note.models import Note
+            previous_balance = Note.objects.filter(pk=instance.pk).values_list("balance", flat=True).get()
+        if previous_balance >= 0:
             # Passage en négatif
             instance.last_negative = timezone.now()
-            instance.send_mail_negative_balance()
+            transaction.on_commit(instance.send_mail_negative_balance)
 
 
 def delete_transaction(instance, **_kwargs):
@@ -0,0 +1,167 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Sales statistics of the buttons.
+
+The quantity, the revenue and the number of valid :model:`note.RecurrentTransaction` are stored per template,
+destination note and hour or day in the table SalesStatistic. The rows are updated when a sale is committed
+and when sales are invalidated or revalidated, then the statistics are read without scanning the transactions.
+`./manage.py rebuild_sales_statistics` recomputes them from the transactions, including the archived ones.
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField, Case, Count, F, IntegerField, Sum, Value, When
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Cast, TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import ArchivedTransaction, RecurrentTransaction, SalesStatistic, TransactionTemplate
+
+GRANULARITIES = {
+    "hour": TruncHour,
+    "day": TruncDay,
+}
+
+
+def get_period_start(dt, granularity):
+    """
+    Return the start of the hour or of the day of the given date, in the current timezone.
+    """
+    dt = timezone.localtime(dt).replace(minute=0, second=0, microsecond=0)
+    return dt.replace(hour=0) if granularity == "day" else dt
+
+
+def _increment(key, quantity, revenue, count):
+    """
+    Add the given values to a statistic row, that is created if needed.
+    """
+    queryset = SalesStatistic.objects.filter(**key)
+    update = dict(quantity=F("quantity") + quantity, revenue=F("revenue") + revenue,
+                  transactions=F("transactions") + count)
+    if queryset.update(**update):
+        return
+    try:
+        with transaction.atomic():
+            SalesStatistic.objects.create(**key, quantity=quantity, revenue=revenue, transactions=count)
+    except IntegrityError:
+        # The row was created concurrently
+        queryset.update(**update)
+
+
+def record_sales(sales, sign=1):
+    """
+    Add (sign = 1) or remove (sign = -1) some sales to the statistics.
+    :param sales: Recurrent transactions, or tuples (template_id, destination_id, created_at, quantity, total)
+    """
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for sale in sales:
+        if isinstance(sale, RecurrentTransaction):
+            sale = (sale.template_id, sale.destination_id, sale.created_at, sale.quantity, sale.total)
+        template_id, destination_id, created_at, quantity, total = sale
+        for granularity in GRANULARITIES:
+            delta = deltas[(granularity, template_id, destination_id, get_period_start(created_at, granularity))]
+            delta[0] += sign * quantity
+            delta[1] += sign * total
+            delta[2] += sign
+
+    for (granularity, template_id, destination_id, period_start), (quantity, revenue, count) in deltas.items():
+        _increment(dict(granularity=granularity, template_id=template_id, destination_id=destination_id,
+                        period_start=period_start), quantity, revenue, count)
+
+
+def record_sales_on_commit(sales, sign=1):
+    """
+    Update the statistics once the current database transaction is committed,
+    to not hold the locks of the statistic rows during the sale.
+    :param sales: Recurrent transactions, or tuples (template_id, destination_id, created_at, quantity, total)
+    """
+    sales = [(sale.template_id, sale.destination_id, sale.created_at, sale.quantity, sale.total)
+             if isinstance(sale, RecurrentTransaction) else sale for sale in sales]
+    if sales:
+        transaction.on_commit(lambda: record_sales(sales, sign))
+
+
+def _aggregate_sales(sales, trunc, template_id):
+    """
+    Sum the given sales per template, destination note and period, in the database.
+    """
+    return sales.annotate(period=trunc("created_at", tzinfo=timezone.get_current_timezone()), sold=template_id)\
+        .order_by().values("sold", "destination_id", "period")\
+        .annotate(sum_quantity=Sum("quantity"), sum_total=Sum("total"), count=Count("pk"))
+
+
+@transaction.atomic
+def rebuild_sales_statistics(since=None):
+    """
+    Recompute the statistics from the valid recurrent transactions, including the archived ones.
+    :param since: Only recompute the periods that start after this date, or everything if None
+    :return: The number of statistic rows
+    """
+    # The template of an archived sale is stored in the fields of its subclass
+    archived_sales = ArchivedTransaction.objects.filter(
+        valid=True,
+        polymorphic_ctype=ContentType.objects.get_for_model(RecurrentTransaction),
+    )
+    archived_template = Cast(KeyTextTransform("template_id", "extra"), IntegerField())
+
+    count = 0
+    for granularity, trunc in GRANULARITIES.items():
+        statistics = SalesStatistic.objects.filter(granularity=granularity)
+        sales = RecurrentTransaction.objects.filter(valid=True)
+        archived = archived_sales
+        if since is not None:
+            since_start = get_period_start(since, granularity)
+            statistics = statistics.filter(period_start__gte=since_start)
+            sales = sales.filter(created_at__gte=since_start)
+            archived = archived.filter(created_at__gte=since_start)
+        statistics._raw_delete(statistics.db)
+
+        # A period can have both archived and recent sales
+        totals = defaultdict(lambda: [0, 0, 0])
+        for rows in (_aggregate_sales(sales, trunc, F("template_id")),
+                     _aggregate_sales(archived, trunc, archived_template)):
+            for row in rows.iterator():
+                total = totals[(row["sold"], row["destination_id"], row["period"])]
+                total[0] += row["sum_quantity"]
+                total[1] += row["sum_total"]
+                total[2] += row["count"]
+
+        count += len(SalesStatistic.objects.bulk_create([SalesStatistic(
+            granularity=granularity,
+            period_start=period,
+            template_id=template_id,
+            destination_id=destination_id,
+            quantity=quantity,
+            revenue=revenue,
+            transactions=transactions,
+        ) for (template_id, destination_id, period), (quantity, revenue, transactions) in totals.items()],
+            batch_size=1000))
+    return count
+
+
+def get_most_sold_templates(days=30, count=10):
+    """
+    Return a queryset of the ids of the most sold displayed templates during the last days.
+    """
+    return SalesStatistic.objects.filter(
+        granularity="day",
+        period_start__gte=get_period_start(timezone.now() - timedelta(days=days), "day"),
+        template__display=True,
+    ).values("template_id").annotate(sold=Sum("quantity")).order_by("-sold", "template_id")\
+        .values_list("template_id", flat=True)[:count]
+
+
+def refresh_highlighted_buttons(days=30, count=10):
+    """
+    Highlight the most sold buttons of the last days, and only them, with a single query.
+    """
+    return TransactionTemplate.objects.update(highlighted=Case(
+        When(pk__in=get_most_sold_templates(days, count), then=Value(True)),
+        default=Value(False),
+        output_field=BooleanField(),
+    ))
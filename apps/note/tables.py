@@ -10,11 +10,21 @@ from django.utils.translation import gettext_lazy as _
 from note_kfet.middlewares import get_current_request
 from permission.backends import PermissionBackend
 
+from .models.archive import ArchivedTransaction
 from .models.notes import Alias, Trust
 from .models.transactions import Transaction, TransactionTemplate
 from .templatetags.pretty_money import pretty_money
 
 
+def can_change_validity(record):
+    """
+    Archived transactions are read-only, and transactions of inactive notes can't be invalidated.
+    """
+    return not isinstance(record, ArchivedTransaction) \
+        and record.source.is_active and record.destination.is_active \
+        and PermissionBackend.check_perm(get_current_request(), "note.change_transaction_invalidity_reason", record)
+
+
 class HistoryTable(tables.Table):
     class Meta:
         attrs = {
@@ -73,7 +83,7 @@ class HistoryTable(tables.Table):
 
     type = tables.Column()
 
-    total = tables.Column(  # will use Transaction.total() !!
+    total = tables.Column(  # stored in Transaction.total
         attrs={
             "td": {
                 "class": "text-nowrap",
@@ -87,19 +97,13 @@ class HistoryTable(tables.Table):
                 "id": lambda record: "validate_" + str(record.id),
                 "class": lambda record:
                 str(record.valid).lower()
-                + (' validate' if record.source.is_active and record.destination.is_active and PermissionBackend
-                   .check_perm(get_current_request(), "note.change_transaction_invalidity_reason", record)
-                   else ''),
+                + (' validate' if can_change_validity(record) else ''),
                 "data-toggle": "tooltip",
                 "title": lambda record: (_("Click to invalidate") if record.valid else _("Click to validate"))
-                if PermissionBackend.check_perm(get_current_request(),
-                                                "note.change_transaction_invalidity_reason", record)
-                and record.source.is_active and record.destination.is_active else None,
+                if can_change_validity(record) else None,
                 "onclick": lambda record: 'de_validate(' + str(record.id) + ', ' + str(record.valid).lower()
                                           + ', "' + str(record.__class__.__name__) + '")'
-                if PermissionBackend.check_perm(get_current_request(),
-                                                "note.change_transaction_invalidity_reason", record)
-                and record.source.is_active and record.destination.is_active else None,
+                if can_change_validity(record) else None,
                 "onmouseover": lambda record: '$("#invalidity_reason_'
                                               + str(record.id) + '").show();$("#invalidity_reason_'
                                               + str(record.id) + '").focus();',
@@ -125,6 +129,10 @@ class HistoryTable(tables.Table):
         """
         When the validation status is hovered, an input field is displayed to let the user specify an invalidity reason
         """
+        if isinstance(record, ArchivedTransaction):
+            # Archived transactions are read-only
+            return "✔" if value else "✖"
+
         has_perm = PermissionBackend \
             .check_perm(get_current_request(), "note.change_transaction_invalidity_reason", record)
 
@@ -0,0 +1,184 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from datetime import date, datetime
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from member.models import Club
+
+from ..archive import archive_transactions, compute_balance, get_archive_horizon, get_note_history, \
+    restore_transactions
+from ..models import ArchivedTransaction, NoteUser, RecurrentTransaction, TemplateCategory, Transaction, \
+    TransactionSummary, TransactionTemplate
+
+
+class TestTransactionArchive(TestCase):
+    """
+    Old transactions are moved into the archive, and can be restored.
+    """
+    fixtures = ('initial', )
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            username="toto",
+            password="totototo",
+            email="toto@example.com",
+        )
+        sess = self.client.session
+        sess["permission_mask"] = 42
+        sess.save()
+        self.client.force_login(self.user)
+
+        self.second_user = User.objects.create(username="toto2")
+        NoteUser.objects.create(user=self.second_user)
+
+        self.club = Club.objects.get(name="BDE")
+        self.template = TransactionTemplate.objects.create(
+            name="Test",
+            destination=self.club.note,
+            category=TemplateCategory.objects.create(name="Test"),
+            amount=100,
+            description="Test template",
+        )
+
+        def make_date(year, month, day):
+            return timezone.make_aware(datetime(year, month, day, 12))
+
+        self.old_transfer = Transaction.objects.create(
+            source=self.second_user.note, destination=self.user.note, amount=500, reason="Old transfer",
+            created_at=make_date(2018, 10, 1))
+        self.old_invalid = Transaction.objects.create(
+            source=self.second_user.note, destination=self.user.note, amount=700, reason="Old invalid",
+            created_at=make_date(2018, 10, 15), valid=False)
+        self.old_sale = RecurrentTransaction.objects.create(
+            source=self.user.note, destination=self.club.note, template=self.template, amount=100, quantity=2,
+            reason="Old sale", created_at=make_date(2018, 11, 3))
+        self.recent_transfer = Transaction.objects.create(
+            source=self.second_user.note, destination=self.user.note, amount=300, reason="Recent transfer",
+            created_at=make_date(2020, 1, 10))
+
+    def test_horizon(self):
+        """
+        The default horizon is the start of an academic year.
+        """
+        with self.settings(TRANSACTION_ARCHIVE_YEARS=2):
+            self.assertEqual(get_archive_horizon(date(2021, 10, 5)), date(2019, 9, 1))
+            self.assertEqual(get_archive_horizon(date(2021, 3, 5)), date(2018, 9, 1))
+
+    def test_archive_and_restore(self):
+        """
+        Archiving then restoring gives back the same transactions, and the balances don't change.
+        """
+        for note in [self.user.note, self.second_user.note, self.club.note]:
+            note.refresh_from_db()
+        balances = {note.pk: note.balance for note in [self.user.note, self.second_user.note, self.club.note]}
+
+        self.assertEqual(archive_transactions(date(2019, 9, 1), chunk_size=2), 3)
+        self.assertEqual(set(ArchivedTransaction.objects.values_list("pk", flat=True)),
+                         {self.old_transfer.pk, self.old_invalid.pk, self.old_sale.pk})
+        self.assertFalse(Transaction.objects.filter(created_at__year=2018).exists())
+        self.assertFalse(RecurrentTransaction.objects.exists())
+        self.assertTrue(Transaction.objects.filter(pk=self.recent_transfer.pk).exists())
+        for note in [self.user.note, self.second_user.note, self.club.note]:
+            note.refresh_from_db()
+            self.assertEqual(note.balance, balances[note.pk])
+            self.assertEqual(compute_balance(note), note.balance)
+
+        # Nothing is left to archive
+        self.assertEqual(archive_transactions(date(2019, 9, 1)), 0)
+
+        archived = ArchivedTransaction.objects.get(pk=self.old_sale.pk)
+        self.assertEqual(archived.total, 200)
+        self.assertEqual(archived.extra, {"template_id": self.template.pk})
+        self.assertEqual(archived.type, self.old_sale.type)
+
+        self.assertEqual(restore_transactions(date(2018, 10, 10), chunk_size=1), 2)
+        self.assertEqual(list(ArchivedTransaction.objects.values_list("pk", flat=True)), [self.old_transfer.pk])
+        self.assertEqual(restore_transactions(), 1)
+        self.assertFalse(ArchivedTransaction.objects.exists())
+        self.assertFalse(TransactionSummary.objects.exists())
+
+        sale = Transaction.objects.get(pk=self.old_sale.pk)
+        self.assertIsInstance(sale, RecurrentTransaction)
+        self.assertEqual(sale.template, self.template)
+        self.assertEqual(sale.created_at, self.old_sale.created_at)
+        self.assertFalse(Transaction.objects.get(pk=self.old_invalid.pk).valid)
+        for note in [self.user.note, self.second_user.note, self.club.note]:
+            note.refresh_from_db()
+            self.assertEqual(note.balance, balances[note.pk])
+
+    def test_summaries(self):
+        """
+        Each note has one summary per month, and only valid transactions are counted in the totals.
+        """
+        archive_transactions(date(2019, 9, 1))
+        summaries = {summary.period_start: summary for summary in TransactionSummary.objects.filter(
+            note=self.user.note)}
+        self.assertEqual(set(summaries), {date(2018, 10, 1), date(2018, 11, 1)})
+        self.assertEqual(summaries[date(2018, 10, 1)].transactions, 2)
+        self.assertEqual(summaries[date(2018, 10, 1)].incoming, 500)
+        self.assertEqual(summaries[date(2018, 10, 1)].outgoing, 0)
+        self.assertEqual(summaries[date(2018, 11, 1)].outgoing, 200)
+
+    def test_balance_at(self):
+        """
+        The balance at a given date spans the transactions and the archive.
+        """
+        expected = {
+            date(2018, 9, 1): 0,
+            date(2018, 10, 10): 500,
+            date(2018, 11, 1): 500,
+            date(2018, 12, 1): 300,
+            date(2020, 2, 1): 600,
+        }
+        self.user.note.refresh_from_db()
+        before = {when: self.user.note.balance_at(when) for when in expected}
+        self.assertEqual(before, expected)
+
+        archive_transactions(date(2019, 9, 1))
+        self.user.note.refresh_from_db()
+        self.assertEqual({when: self.user.note.balance_at(when) for when in expected}, expected)
+
+    def test_history(self):
+        """
+        The history of a note shows the recent transactions, then the archived ones.
+        """
+        archive_transactions(date(2019, 9, 1))
+
+        request = self.client.get(reverse("note:transactions", args=(self.user.note.pk,))).wsgi_request
+        history = get_note_history(request, self.user.note)
+        self.assertEqual(len(history), 4)
+        # The tables are only counted once, then a slice only fetches its rows
+        with self.assertNumQueries(2):
+            self.assertEqual([tr.pk for tr in history[:2]], [self.recent_transfer.pk, self.old_sale.pk])
+        self.assertEqual([tr.pk for tr in history[1:]],
+                         [self.old_sale.pk, self.old_invalid.pk, self.old_transfer.pk])
+        self.assertEqual(history[3].pk, self.old_transfer.pk)
+
+        response = self.client.get(reverse("note:transactions", args=(self.user.note.pk,)),
+                                   data={"reason": "Old"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["table"].rows), 3)
+        self.assertContains(response, "Old sale")
+
+    def test_command(self):
+        """
+        The command archives, checks and restores the transactions.
+        """
+        out = StringIO()
+        call_command("archive_transactions", before=date(2019, 9, 1), dry_run=True, stdout=out)
+        self.assertIn("3 transactions", out.getvalue())
+        self.assertFalse(ArchivedTransaction.objects.exists())
+
+        call_command("archive_transactions", before=date(2019, 9, 1), chunk_size=1, stdout=out)
+        self.assertEqual(ArchivedTransaction.objects.count(), 3)
+        call_command("archive_transactions", check=True, stdout=out)
+
+        call_command("archive_transactions", restore=True, stdout=out)
+        self.assertFalse(ArchivedTransaction.objects.exists())
+        self.assertEqual(Transaction.objects.count(), 4)
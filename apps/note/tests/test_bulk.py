@@ -0,0 +1,148 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from logs.models import Changelog
+
+from ..bulk import create_transactions, set_transactions_validity
+from ..models import NoteUser, Transaction
+
+
+class TestBulkValidity(TestCase):
+    """
+    Many transactions are invalidated or revalidated at once.
+    """
+    fixtures = ('initial', )
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            username="toto",
+            password="totototo",
+            email="toto@example.com",
+        )
+        sess = self.client.session
+        sess["permission_mask"] = 42
+        sess.save()
+        self.client.force_login(self.user)
+
+        self.second_user = User.objects.create(username="toto2")
+        NoteUser.objects.create(user=self.second_user)
+        self.third_user = User.objects.create(username="toto3")
+        NoteUser.objects.create(user=self.third_user)
+
+        for i in range(5):
+            Transaction.objects.create(source=self.second_user.note, destination=self.user.note, amount=100,
+                                       quantity=i + 1, reason="Bulk")
+            Transaction.objects.create(source=self.user.note, destination=self.third_user.note, amount=50,
+                                       reason="Bulk")
+
+    def balances(self):
+        return [note.balance for note in NoteUser.objects.filter(user__in=[self.user, self.second_user,
+                                                                           self.third_user]).order_by("user_id")]
+
+    def test_same_balances(self):
+        """
+        Invalidating then revalidating gives the same balances as saving the transactions one by one.
+        """
+        initial = self.balances()
+        self.assertEqual(initial, [1500 - 250, -1500, 250])
+        set_transactions_validity(None, Transaction.objects.filter(reason="Bulk"), False, "Mistake")
+        self.assertEqual(self.balances(), [0, 0, 0])
+        self.assertEqual(Transaction.objects.filter(valid=False, invalidity_reason="Mistake").count(), 10)
+
+        # Already invalid transactions are ignored
+        self.assertEqual(set_transactions_validity(None, Transaction.objects.filter(reason="Bulk"), False), [])
+
+        set_transactions_validity(None, Transaction.objects.filter(reason="Bulk"), True)
+        self.assertEqual(self.balances(), initial)
+        self.assertFalse(Transaction.objects.exclude(invalidity_reason="").exists())
+
+        for tr in Transaction.objects.filter(reason="Bulk"):
+            tr.valid = False
+            tr.save()
+        self.assertEqual(self.balances(), [0, 0, 0])
+
+    def test_create_transactions(self):
+        """
+        Creating transactions at once gives the same balances as saving them one by one.
+        """
+        initial = self.balances()
+        transactions = [Transaction(source=self.second_user.note, destination=self.third_user.note, amount=100,
+                                    reason="Created") for _ in range(3)]
+        transactions.append(Transaction(source=self.user.note, destination=self.user.note, amount=100,
+                                        reason="Created"))
+        transactions.append(Transaction(source=self.third_user.note, destination=self.user.note, amount=100,
+                                        reason="Created", valid=False))
+        created = create_transactions(None, transactions)
+        self.assertEqual(len(created), 4)
+        self.assertEqual(self.balances(), [initial[0], initial[1] - 300, initial[2] + 300])
+        self.assertEqual(Transaction.objects.get(pk=created[0].pk).source_alias, "toto2")
+        self.assertEqual(Transaction.objects.get(pk=created[0].pk).total, 100)
+
+        set_transactions_validity(None, [tr.pk for tr in created], False)
+        self.assertEqual(self.balances(), initial)
+
+    def test_changelogs(self):
+        logs = Changelog.objects.filter(model=ContentType.objects.get_for_model(Transaction))
+        count = logs.count()
+        set_transactions_validity(None, Transaction.objects.filter(reason="Bulk"), False)
+        self.assertEqual(logs.count(), count + 10)
+        self.assertIn("false", logs.last().data)
+
+    def test_constant_queries(self):
+        first = list(Transaction.objects.filter(reason="Bulk", quantity=1).values_list("pk", flat=True))
+        with CaptureQueriesContext(connection) as one:
+            set_transactions_validity(None, first, False)
+        with CaptureQueriesContext(connection) as many:
+            set_transactions_validity(None, Transaction.objects.filter(reason="Bulk", valid=True), False)
+        # The first call also fills the cache of the content types
+        self.assertLessEqual(len(many), len(one))
+
+    def test_api(self):
+        ids = list(Transaction.objects.filter(reason="Bulk").values_list("pk", flat=True))
+        response = self.client.post("/api/note/transaction/transaction/validity/", data=dict(
+            ids=ids,
+            valid=False,
+            invalidity_reason="API",
+        ), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 10)
+        self.assertEqual(Transaction.objects.filter(invalidity_reason="API").count(), 10)
+
+        response = self.client.post("/api/note/transaction/transaction/validity/?reason=Bulk", data=dict(
+            valid=True,
+        ), content_type="application/json")
+        self.assertEqual(response.json()["count"], 10)
+
+        response = self.client.post("/api/note/transaction/transaction/validity/", data=dict(valid=True),
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+        # The form data are parsed, a single id is not read as a string
+        response = self.client.post("/api/note/transaction/transaction/validity/", data=dict(
+            ids=ids[0],
+            valid="false",
+        ))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["ids"], [ids[0]])
+        self.assertFalse(Transaction.objects.get(pk=ids[0]).valid)
+
+        response = self.client.post("/api/note/transaction/transaction/validity/", data=dict(ids=ids))
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post("/api/note/transaction/transaction/validity/", data=dict(ids="a", valid=True),
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("set_transactions_validity", "--invalidate", "--filter", "reason=Bulk", "amount=50",
+                     reason="Command", stdout=out)
+        self.assertIn("5 transactions invalidated", out.getvalue())
+        self.assertEqual(Transaction.objects.filter(invalidity_reason="Command").count(), 5)
@@ -0,0 +1,100 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from django.db import router, transaction
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from note_kfet.db_routers import PIN_COOKIE_NAME, read_only, using_replica
+from note_kfet.middlewares import _set_current_request
+
+from ..models import TemplateCategory
+
+
+@override_settings(DATABASE_REPLICA="replica")
+class TestReplicaRouter(TransactionTestCase):
+    """
+    The primary database and the replica are two different database files.
+    Some data is only written in the replica, in order to know which database is read.
+    """
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        TemplateCategory.objects.create(name="primary")
+        TemplateCategory.objects.using("replica").create(name="replica")
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        _set_current_request(None)
+
+    def read(self, queryset=None):
+        if queryset is None:
+            queryset = TemplateCategory.objects.all()
+        return set(queryset.values_list("name", flat=True))
+
+    def test_no_request(self):
+        """
+        Shell and management commands use the primary database, unless they explicitly read-only.
+        """
+        self.assertEqual(self.read(), {"primary"})
+        with read_only():
+            self.assertEqual(self.read(), {"replica"})
+        self.assertEqual(self.read(using_replica(TemplateCategory.objects.all())), {"replica"})
+        self.assertEqual(self.read(), {"primary"})
+
+    def test_safe_request(self):
+        """
+        Safe requests read the replica, but never inside a database transaction.
+        """
+        _set_current_request(self.factory.get("/"))
+        self.assertEqual(self.read(), {"replica"})
+
+        with transaction.atomic():
+            self.assertEqual(self.read(), {"primary"})
+            self.assertEqual(self.read(TemplateCategory.objects.select_for_update()), {"primary"})
+            with read_only():
+                self.assertEqual(self.read(), {"primary"})
+
+        # Once something is written, the request reads its own writes
+        self.assertEqual(router.db_for_write(TemplateCategory), "default")
+        self.assertEqual(self.read(), {"primary"})
+
+    def test_unsafe_request(self):
+        """
+        Other requests read the primary database, unless they explicitly read-only.
+        """
+        _set_current_request(self.factory.post("/"))
+        self.assertEqual(self.read(), {"primary"})
+        with read_only():
+            self.assertEqual(self.read(), {"replica"})
+
+    def test_pinned_request(self):
+        """
+        A client that recently wrote something reads the primary database.
+        """
+        request = self.factory.get("/")
+        request.COOKIES[PIN_COOKIE_NAME] = "1"
+        _set_current_request(request)
+        self.assertEqual(self.read(), {"primary"})
+        with read_only():
+            self.assertEqual(self.read(), {"primary"})
+        self.assertEqual(self.read(using_replica(TemplateCategory.objects.all())), {"primary"})
+
+    def test_pin_cookie(self):
+        """
+        The client is pinned to the primary database after an unsafe request.
+        """
+        response = self.client.get("/accounts/login/")
+        self.assertNotIn(PIN_COOKIE_NAME, response.cookies)
+
+        response = self.client.post("/accounts/login/", data=dict(username="toto", password="toto"))
+        self.assertIn(PIN_COOKIE_NAME, response.cookies)
+        self.assertEqual(response.cookies[PIN_COOKIE_NAME]["max-age"], 15)
+
+    @override_settings(DATABASE_REPLICA=None)
+    def test_no_replica(self):
+        """
+        Without replica, everything is done on the primary database.
+        """
+        _set_current_request(self.factory.get("/"))
+        self.assertEqual(self.read(), {"primary"})
+        with read_only():
+            self.assertEqual(self.read(), {"primary"})
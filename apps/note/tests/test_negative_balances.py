@@ -0,0 +1,106 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from member.models import Club
+
+from ..bulk import set_transactions_validity
+from ..models import Note, NoteClub, NoteUser, Transaction
+from ..negative_balances import get_negative_notes
+
+
+class TestNegativeBalances(TestCase):
+    """
+    The users and the clubs are warned when their balance is negative.
+    """
+    fixtures = ('initial', )
+
+    def setUp(self):
+        self.user = User.objects.create(username="toto", email="toto@example.com")
+        NoteUser.objects.create(user=self.user)
+        self.second_user = User.objects.create(username="toto2", email="toto2@example.com")
+        NoteUser.objects.create(user=self.second_user)
+        self.club = Club.objects.get(name="BDE")
+
+    def transfer(self, amount):
+        with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks() as callbacks:
+            transaction = Transaction.objects.create(source=self.user.note, destination=self.second_user.note,
+                                                     amount=amount, reason="Transfer")
+        return transaction, len(ctx.captured_queries), callbacks
+
+    def test_negative_crossing(self):
+        """
+        The mail is queued after the commit, and the crossing doesn't cost any query.
+        """
+        Note.objects.filter(pk=self.user.note.pk).update(balance=1000)
+        _transaction, queries, callbacks = self.transfer(100)
+        self.assertEqual(callbacks, [])
+
+        _transaction, crossing_queries, callbacks = self.transfer(1500)
+        self.assertEqual(crossing_queries, queries)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(len(mail.outbox), 0)
+        callbacks[0]()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["toto@example.com"])
+        self.user.note.refresh_from_db()
+        self.assertIsNotNone(self.user.note.last_negative)
+
+        # Already negative: no new mail
+        _transaction, _queries, callbacks = self.transfer(100)
+        self.assertEqual(callbacks, [])
+
+    def test_bulk_crossing(self):
+        """
+        Revalidating transactions in bulk also warns after the commit.
+        """
+        tr = Transaction.objects.create(source=self.user.note, destination=self.second_user.note,
+                                        amount=500, reason="Transfer", valid=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            set_transactions_validity(None, [tr.pk], True)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_get_negative_notes(self):
+        """
+        The negative users and clubs are fetched with one query, the lowest balance first.
+        """
+        Note.objects.filter(pk=self.user.note.pk).update(balance=-500, last_negative=timezone.now())
+        Note.objects.filter(pk=self.club.note.pk).update(balance=-2000,
+                                                         last_negative=timezone.now() - timedelta(days=10))
+        Note.objects.filter(pk=self.second_user.note.pk).update(balance=-100, last_negative=timezone.now())
+
+        with self.assertNumQueries(1):
+            notes = get_negative_notes()
+            self.assertEqual([note.pk for note in notes],
+                             [self.club.note.pk, self.user.note.pk, self.second_user.note.pk])
+            self.assertIsInstance(notes[0], NoteClub)
+            self.assertEqual(notes[0].club, self.club)
+            self.assertEqual(notes[1].user, self.user)
+
+        self.assertEqual(len(get_negative_notes(-300)), 2)
+        self.assertEqual(len(get_negative_notes(since=timezone.now() - timedelta(days=1))), 2)
+
+    def test_command(self):
+        """
+        The reminders are queued by batch.
+        """
+        Note.objects.filter(pk=self.user.note.pk).update(balance=-500, last_negative=timezone.now())
+        Note.objects.filter(pk=self.second_user.note.pk).update(balance=-100, last_negative=timezone.now())
+
+        out = StringIO()
+        call_command("notify_negative_balances", negative_amount=-2, dry_run=True, stdout=out)
+        self.assertIn("toto", out.getvalue())
+        self.assertEqual(len(mail.outbox), 0)
+
+        call_command("notify_negative_balances", stdout=out)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].alternatives[0][1], "text/html")
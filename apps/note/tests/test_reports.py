@@ -0,0 +1,111 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from member.models import Club, Profile
+
+from ..models import NoteSpecial, NoteUser, SpecialTransaction, Transaction
+from ..reports import get_due_profiles, get_reports, send_reports
+
+
+class TestReports(TestCase):
+    """
+    The reports of the users are computed by chunks, with a constant number of queries.
+    """
+    fixtures = ('initial', )
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.club = Club.objects.get(name="BDE")
+        self.users = []
+        for i in range(3):
+            user = User.objects.create(username=f"toto{i}", email=f"toto{i}@example.com")
+            NoteUser.objects.create(user=user)
+            Profile.objects.filter(user=user).update(report_frequency=7, last_report=self.now - timedelta(days=8))
+            self.users.append(user)
+
+        # The second user doesn't want any report, the third one had a report yesterday
+        Profile.objects.filter(user=self.users[1]).update(report_frequency=0)
+        Profile.objects.filter(user=self.users[2]).update(last_report=self.now - timedelta(days=1))
+
+    def transfer(self, source, destination, amount, **kwargs):
+        return Transaction.objects.create(source=source, destination=destination, amount=amount,
+                                          reason="Transfer", **kwargs)
+
+    def test_due_profiles(self):
+        with self.assertNumQueries(1):
+            profiles = get_due_profiles(self.now)
+        self.assertEqual([profile.user for profile in profiles], [self.users[0]])
+
+        Profile.objects.filter(user=self.users[2]).update(report_frequency=1)
+        self.assertEqual(len(get_due_profiles(self.now)), 2)
+        self.assertEqual(len(get_due_profiles(self.now, User.objects.filter(pk=self.users[0].pk))), 1)
+
+        # The days are counted from the dates of the reports
+        Profile.objects.filter(user=self.users[0]).update(last_report=self.now - timedelta(days=6))
+        self.assertNotIn(self.users[0].profile, get_due_profiles(self.now))
+        tomorrow = timezone.localtime(self.now + timedelta(days=1)).replace(hour=0, minute=0, second=0)
+        self.assertIn(self.users[0].profile, get_due_profiles(tomorrow))
+        self.assertNotIn(self.users[0].profile, get_due_profiles(tomorrow - timedelta(seconds=1)))
+
+    def test_reports(self):
+        note = self.users[0].note
+        SpecialTransaction.objects.create(source=NoteSpecial.objects.first(), destination=note, amount=5000,
+                                          reason="Credit", last_name="Toto", first_name="Toto")
+        self.transfer(note, self.club.note, 1000)
+        self.transfer(note, self.users[1].note, 300, valid=False)
+        self.transfer(self.users[1].note, note, 200)
+        old = self.transfer(note, self.club.note, 50)
+        Transaction.objects.filter(pk=old.pk).update(created_at=self.now - timedelta(days=9))
+        Profile.objects.filter(user=self.users[2]).update(report_frequency=1)
+
+        now = timezone.now()
+        profiles = get_due_profiles(now)
+        with self.assertNumQueries(2):
+            reports = get_reports(profiles, now)
+        # The third user has no transaction since the last report
+        self.assertEqual(len(reports), 1)
+        profile, context = reports[0]
+        self.assertEqual(profile.user, self.users[0])
+        self.assertEqual(len(context["last_transactions"]), 4)
+        self.assertEqual(context["incoming"], 5200)
+        self.assertEqual(context["outcoming"], 1000)
+        note.refresh_from_db()
+        self.assertEqual(context["closing_balance"], note.balance)
+        self.assertEqual(context["opening_balance"], note.balance - 4200)
+        self.assertEqual([str(tr.type) for tr in context["last_transactions"]][0], "Credit")
+
+    def test_send_reports(self):
+        for user in self.users:
+            self.transfer(user.note, self.club.note, 100)
+        Profile.objects.filter(user=self.users[2]).update(report_frequency=1)
+
+        now = timezone.now()
+        profiles = get_due_profiles(now)
+        with self.assertNumQueries(10):
+            # 2 chunks, each one with the transactions, the notes and the bulk update in a savepoint
+            count = send_reports(profiles, now, chunk_size=1)
+        self.assertEqual(count, 2)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ["toto0@example.com", "toto2@example.com"])
+        self.assertIn("Nouveau solde : - 1 €", mail.outbox[0].body)
+        self.assertEqual(Profile.objects.filter(last_report=now).count(), 2)
+        self.assertEqual(get_due_profiles(now), [])
+
+    def test_command(self):
+        self.transfer(self.users[0].note, self.club.note, 100)
+        out = StringIO()
+        call_command("send_transaction_reports", dry_run=True, stdout=out)
+        self.assertIn("Dépenses totales : 1 €", out.getvalue())
+        self.assertEqual(len(mail.outbox), 0)
+
+        out = StringIO()
+        call_command("send_transaction_reports", stdout=out)
+        self.assertIn("1 reports queued for 1 users.", out.getvalue())
+        self.assertEqual(len(mail.outbox), 1)
@@ -0,0 +1,156 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from member.models import Club
+
+from ..archive import archive_transactions
+from ..bulk import set_transactions_validity
+from ..models import NoteUser, RecurrentTransaction, SalesStatistic, TemplateCategory, TransactionTemplate
+from ..stats import get_period_start, rebuild_sales_statistics, refresh_highlighted_buttons
+
+
+class TestSalesStatistics(TestCase):
+    """
+    The sales of the buttons are summed by hour and by day.
+    """
+    fixtures = ('initial', )
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            username="toto",
+            password="totototo",
+            email="toto@example.com",
+        )
+        sess = self.client.session
+        sess["permission_mask"] = 42
+        sess.save()
+        self.client.force_login(self.user)
+
+        self.second_user = User.objects.create(username="toto2")
+        NoteUser.objects.create(user=self.second_user)
+
+        self.club = Club.objects.get(name="BDE")
+        category = TemplateCategory.objects.create(name="Test")
+        self.coca = TransactionTemplate.objects.create(name="Coca", destination=self.club.note, category=category,
+                                                       amount=110, description="Coca")
+        self.water = TransactionTemplate.objects.create(name="Water", destination=self.club.note, category=category,
+                                                        amount=50, description="Water", highlighted=True)
+        self.now = timezone.now()
+
+    def sell(self, template, quantity=1, created_at=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return RecurrentTransaction.objects.create(
+                source=self.user.note, destination=self.club.note, template=template, amount=template.amount,
+                quantity=quantity, reason=template.name, created_at=created_at or self.now)
+
+    def statistic(self, template, granularity="day", when=None):
+        return SalesStatistic.objects.get(granularity=granularity, template=template,
+                                          period_start=get_period_start(when or self.now, granularity))
+
+    def test_incremental(self):
+        """
+        The statistics are updated when a sale is committed, invalidated or revalidated.
+        """
+        self.sell(self.coca, 2)
+        sale = self.sell(self.coca, 3)
+        for granularity in ["hour", "day"]:
+            statistic = self.statistic(self.coca, granularity)
+            self.assertEqual((statistic.quantity, statistic.revenue, statistic.transactions), (5, 550, 2))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            sale.valid = False
+            sale.save()
+        statistic = self.statistic(self.coca)
+        self.assertEqual((statistic.quantity, statistic.revenue, statistic.transactions), (2, 220, 1))
+
+        # A valid sale is edited
+        first = RecurrentTransaction.objects.get(quantity=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.quantity = 4
+            first._force_save = True
+            first.save()
+        statistic = self.statistic(self.coca)
+        self.assertEqual((statistic.quantity, statistic.revenue, statistic.transactions), (4, 440, 1))
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            first.save()
+        self.assertEqual(callbacks, [])
+        with self.captureOnCommitCallbacks(execute=True):
+            first.quantity = 2
+            first.save()
+
+        # The same goes for bulk invalidations
+        with self.captureOnCommitCallbacks(execute=True):
+            set_transactions_validity(None, RecurrentTransaction.objects.all(), False)
+        statistic = self.statistic(self.coca)
+        self.assertEqual((statistic.quantity, statistic.revenue, statistic.transactions), (0, 0, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            set_transactions_validity(None, RecurrentTransaction.objects.all(), True)
+        statistic = self.statistic(self.coca, "hour")
+        self.assertEqual((statistic.quantity, statistic.revenue, statistic.transactions), (5, 550, 2))
+
+    def test_rebuild(self):
+        """
+        Rebuilding the statistics from the transactions gives the same rows.
+        """
+        self.sell(self.coca, 2)
+        self.sell(self.water, 1, self.now - timedelta(days=3))
+        self.sell(self.water, 4, self.now - timedelta(days=3))
+        fields = ("granularity", "period_start", "template_id", "destination_id", "quantity", "revenue",
+                  "transactions")
+        incremental = set(SalesStatistic.objects.values_list(*fields))
+        self.assertEqual(len(incremental), 4)
+
+        self.assertEqual(rebuild_sales_statistics(), 4)
+        self.assertEqual(set(SalesStatistic.objects.values_list(*fields)), incremental)
+
+        rebuild_sales_statistics(self.now - timedelta(days=1))
+        self.assertEqual(set(SalesStatistic.objects.values_list(*fields)), incremental)
+
+        # The archived sales are still counted
+        self.assertEqual(archive_transactions(timezone.localdate(self.now - timedelta(days=1))), 2)
+        self.assertEqual(rebuild_sales_statistics(), 4)
+        self.assertEqual(set(SalesStatistic.objects.values_list(*fields)), incremental)
+
+    def test_highlighted_buttons(self):
+        """
+        The most sold buttons of the last days are highlighted with one query.
+        """
+        self.sell(self.coca, 3)
+        self.sell(self.water, 5, self.now - timedelta(days=40))
+
+        with self.assertNumQueries(1):
+            refresh_highlighted_buttons(days=30, count=1)
+        self.assertTrue(TransactionTemplate.objects.get(pk=self.coca.pk).highlighted)
+        self.assertFalse(TransactionTemplate.objects.get(pk=self.water.pk).highlighted)
+
+    def test_api(self):
+        """
+        The API sums the statistics by bucket.
+        """
+        self.sell(self.coca, 2)
+        self.sell(self.coca, 1, self.now - timedelta(hours=2))
+        self.sell(self.water, 4)
+
+        response = self.client.get("/api/note/stats/", data={"bucket": "year", "group_by": "template"})
+        self.assertEqual(response.status_code, 200)
+        results = {row["template"]: row for row in response.json()["results"]}
+        self.assertEqual(results[self.coca.pk]["quantity"], 3)
+        self.assertEqual(results[self.coca.pk]["revenue"], 330)
+        self.assertEqual(results[self.water.pk]["transactions"], 1)
+
+        response = self.client.get("/api/note/stats/", data={"group_by": "destination",
+                                                             "template": self.coca.pk})
+        self.assertEqual(sum(row["quantity"] for row in response.json()["results"]), 3)
+        self.assertEqual({row["destination"] for row in response.json()["results"]}, {self.club.note.pk})
+
+        self.assertEqual(self.client.get("/api/note/stats/", data={"bucket": "decade"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/note/stats/", data={"since": "yesterday"}).status_code, 400)
+
+        # Without the permission, nothing is visible
+        self.client.force_login(self.second_user)
+        self.assertEqual(self.client.get("/api/note/stats/").json()["results"], [])
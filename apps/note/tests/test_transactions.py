@@ -314,6 +314,24 @@ class TestTransactions(TestCase):
         ))
         self.assertEqual(response.status_code, 200)
 
+    def test_stored_total(self):
+        """
+        The total of a transaction is stored, even when the method save is bypassed.
+        """
+        self.assertEqual(self.transaction.total, 4200)
+        tr = Transaction(source=self.user.note, destination=self.second_user.note, amount=150, quantity=3,
+                         reason="Stored total")
+        tr._force_save = True
+        # Skip Transaction.save
+        super(Transaction, tr).save()
+        self.assertEqual(Transaction.objects.filter(total=450).get(), tr)
+
+        response = self.client.get(reverse("note:transactions", args=(self.user.note.pk,)), data=dict(
+            amount_gte=4,
+            amount_lte=5,
+        ))
+        self.assertEqual(list(response.context["table"].data), [tr])
+
     def test_delete_transaction(self):
         # Transactions can't be deleted with a normal usage, but it is possible through the admin interface.
         old_second_user_balance = self.second_user.note.balance
@@ -7,7 +7,7 @@ from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import PermissionDenied
-from django.db.models import Q, F
+from django.db.models import Q
 from django.utils.translation import gettext_lazy as _
 from django.views.generic import CreateView, UpdateView, DetailView
 from django_tables2 import SingleTableView
@@ -17,6 +17,7 @@ from note_kfet.inputs import AmountInput
 from permission.backends import PermissionBackend
 from permission.views import ProtectQuerysetMixin
 
+from .archive import get_note_history
 from .forms import TransactionTemplateForm, SearchTransactionForm
 from .models import TemplateCategory, Transaction, TransactionTemplate, RecurrentTransaction, NoteSpecial, Note
 from .models.transactions import SpecialTransaction
@@ -54,7 +55,7 @@ class TransactionCreateView(ProtectQuerysetMixin, LoginRequiredMixin, SingleTabl
         if "activity" in settings.INSTALLED_APPS:
             from activity.models import Activity
             activities_open = Activity.objects.filter(open=True, activity_type__manage_entries=True).filter(
-                PermissionBackend.filter_queryset(self.request, Activity, "view")).distinct().all()
+                PermissionBackend.filter_queryset(self.request, Activity, "view")).all()
             context["activities_open"] = [a for a in activities_open
                                           if PermissionBackend.check_perm(self.request,
                                                                           "activity.add_entry",
@@ -208,30 +209,30 @@ class TransactionSearchView(ProtectQuerysetMixin, LoginRequiredMixin, DetailView
         form.full_clean()
         data = form.cleaned_data if form.is_valid() else {}
 
-        transactions = Transaction.objects.annotate(total_amount=F("quantity") * F("amount")).filter(
-            PermissionBackend.filter_queryset(self.request, Transaction, "view"))\
-            .filter(Q(source=self.object) | Q(destination=self.object)).order_by('-created_at')
-
+        # The filters use the stored total, the indexes on (source, created_at) and (destination, created_at),
+        # and on PostgreSQL the trigram indexes on the reason and the aliases.
+        # Old transactions are searched in the archive, with the same filters.
+        filters = Q()
         if "source" in data and data["source"]:
-            transactions = transactions.filter(source_id=data["source"].note_id)
+            filters &= Q(source_id=data["source"].note_id)
         if "destination" in data and data["destination"]:
-            transactions = transactions.filter(destination_id=data["destination"].note_id)
+            filters &= Q(destination_id=data["destination"].note_id)
         if "type" in data and data["type"]:
-            transactions = transactions.filter(polymorphic_ctype__in=data["type"])
+            filters &= Q(polymorphic_ctype__in=data["type"])
         if "reason" in data and data["reason"]:
-            transactions = transactions.filter(reason__iregex=data["reason"])
+            filters &= Q(reason__iregex=data["reason"])
         if "valid" in data and data["valid"]:
-            transactions = transactions.filter(valid=data["valid"])
+            filters &= Q(valid=data["valid"])
         if "amount_gte" in data and data["amount_gte"]:
-            transactions = transactions.filter(total_amount__gte=data["amount_gte"])
+            filters &= Q(total__gte=data["amount_gte"])
         if "amount_lte" in data and data["amount_lte"]:
-            transactions = transactions.filter(total_amount__lte=data["amount_lte"])
+            filters &= Q(total__lte=data["amount_lte"])
         if "created_after" in data and data["created_after"]:
-            transactions = transactions.filter(created_at__gte=data["created_after"])
+            filters &= Q(created_at__gte=data["created_after"])
         if "created_before" in data and data["created_before"]:
-            transactions = transactions.filter(created_at__lte=data["created_before"])
+            filters &= Q(created_at__lte=data["created_before"])
 
-        table = HistoryTable(transactions)
+        table = HistoryTable(get_note_history(self.request, self.object, filters))
         table.paginate(per_page=100, page=self.request.GET.get("page", 1))
         context["table"] = table
 
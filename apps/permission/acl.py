@@ -0,0 +1,255 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Materialized visibility of notes and transactions.
+
+The most common permissions are "see this note" and "see the transactions that touch this note",
+where the note is given by a parameter (eg. the note of the user, or the note of the club).
+When the setting PERMISSION_ACL is enabled, these permissions are stored in the table NoteVisibility,
+and the permission filters use a single indexed subquery instead of one branch per permission.
+
+The table is maintained incrementally by signals, and can be rebuilt with `./manage.py rebuild_permission_acl`.
+"""
+
+import json
+from datetime import date
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Model, Q, QuerySet
+
+from .models import NoteVisibility
+
+# Lookups that can be materialized, for each kind of right
+NOTE_KEYS = {"pk", "pk__in", "id", "id__in"}
+TRANSACTION_KEYS = {"source", "source__in", "destination", "destination__in"}
+
+
+def is_enabled():
+    return getattr(settings, "PERMISSION_ACL", False)
+
+
+def _or_branches(query):
+    """
+    Split a JSON query into the list of its OR branches, that must be dictionaries with a single key.
+    Return None if the query has another shape.
+    """
+    if isinstance(query, dict):
+        branches = [query]
+    elif isinstance(query, list) and query and query[0] == "OR":
+        branches = query[1:]
+    else:
+        return None
+    if not all(isinstance(branch, dict) and len(branch) == 1 for branch in branches):
+        return None
+    return [next(iter(branch.items())) for branch in branches]
+
+
+def get_right(model, permission_type, field, query):
+    """
+    Tell if a permission can be materialized in the table NoteVisibility.
+    :param model: The ContentType of the permission
+    :param permission_type: The type of the permission
+    :param field: The field of the permission
+    :param query: The JSON query of the permission, already parsed
+    :return: The kind of right ("note" or "transaction"), or None if the permission can't be materialized
+    """
+    if permission_type != "view" or field or model.app_label != "note":
+        return None
+
+    branches = _or_branches(query)
+    if not branches:
+        return None
+
+    if model.model == "note":
+        if all(key in NOTE_KEYS for key, _value in branches):
+            return "note"
+    elif model.model == "transaction":
+        # Only the transactions that touch the notes: the sources and the destinations must be the same notes
+        sources = sorted(json.dumps(value) for key, value in branches if key.startswith("source"))
+        destinations = sorted(json.dumps(value) for key, value in branches if key.startswith("destination"))
+        if all(key in TRANSACTION_KEYS for key, _value in branches) and sources == destinations:
+            return "transaction"
+    return None
+
+
+def _note_ids(value):
+    """
+    Convert the value of a parameter into a set of note ids.
+    """
+    if value is None or value is False:
+        return set()
+    if isinstance(value, Model):
+        return {value.pk}
+    if isinstance(value, int):
+        return {value}
+    if isinstance(value, QuerySet):
+        return set(value.values_list("pk", flat=True))
+    ids = set()
+    for item in value:
+        ids |= _note_ids(item)
+    return ids
+
+
+def compute_user_visibilities(user):
+    """
+    Compute the rows of the table NoteVisibility for the given user, from all its memberships.
+    """
+    from member.models import Membership
+    from .backends import PermissionBackend
+
+    rows = {}
+    memberships = Membership.objects.filter(user=user).select_related("club", "user")\
+        .prefetch_related("roles__permissions__mask", "roles__permissions__model")
+    for membership in memberships:
+        parameters = None
+        for role in membership.roles.all():
+            for permission in role.permissions.all():
+                query = json.loads(permission.query)
+                right = get_right(permission.model, permission.type, permission.field, query)
+                if right is None:
+                    continue
+
+                if parameters is None:
+                    parameters = PermissionBackend.get_parameters(user, membership)
+                note_ids = set()
+                for _key, value in _or_branches(query):
+                    note_ids |= _note_ids(permission.compute_param(value, **parameters))
+
+                for note_id in note_ids:
+                    row = NoteVisibility(
+                        user=user,
+                        note_id=note_id,
+                        right=right,
+                        rank=permission.mask.rank,
+                        permanent=permission.permanent,
+                        date_start=None if permission.permanent else membership.date_start,
+                        date_end=None if permission.permanent else membership.date_end,
+                    )
+                    # Don't store the same row twice
+                    rows[(note_id, right, row.rank, row.permanent, row.date_start, row.date_end)] = row
+    return list(rows.values())
+
+
+def rebuild_user_acl(user):
+    """
+    Replace the materialized permissions of the given user.
+    """
+    with transaction.atomic():
+        # No signal is needed on these rows, they are only a cache
+        NoteVisibility.objects.filter(user=user)._raw_delete(NoteVisibility.objects.db)
+        NoteVisibility.objects.bulk_create(compute_user_visibilities(user))
+
+
+def rebuild_acl(users=None, batch_size=500):
+    """
+    Rebuild the materialized permissions of the given users, or of all users.
+    :return: The number of created rows
+    """
+    with transaction.atomic():
+        if users is None:
+            users = User.objects.filter(memberships__isnull=False).distinct()
+            NoteVisibility.objects.all()._raw_delete(NoteVisibility.objects.db)
+        else:
+            NoteVisibility.objects.filter(user__in=users)._raw_delete(NoteVisibility.objects.db)
+
+        rows = []
+        for user in users:
+            rows += compute_user_visibilities(user)
+        NoteVisibility.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def get_query(user, model, rank):
+    """
+    Build the filter that corresponds to the materialized permissions of a user.
+    :param user: The user that owns the permissions
+    :param model: The ContentType of the filtered model
+    :param rank: The rank of the current permission mask
+    :return: A Q object
+    """
+    today = date.today()
+    notes = NoteVisibility.objects.filter(user=user, right=model.model, rank__lte=rank)\
+        .filter(Q(permanent=True) | Q(date_start__lte=today, date_end__gte=today))\
+        .values("note_id")
+    if model.model == "transaction":
+        return Q(source_id__in=notes) | Q(destination_id__in=notes)
+    return Q(pk__in=notes)
+
+
+def get_acl_model(model, field=None):
+    """
+    Return the ContentType of the model if its view permissions are materialized, None otherwise.
+    """
+    if not is_enabled() or field:
+        return None
+    if not isinstance(model, ContentType):
+        model = ContentType.objects.get_for_model(model)
+    if model.app_label == "note" and model.model in ("note", "transaction"):
+        return model
+    return None
+
+
+# Signals that maintain the table
+
+def _rebuild_later(users):
+    """
+    Rebuild the permissions of the given users once the current database transaction is committed.
+    """
+    users = [user for user in users if user is not None]
+    if users:
+        transaction.on_commit(lambda: rebuild_acl(users))
+
+
+def update_acl_membership(instance, **_kwargs):
+    if is_enabled():
+        _rebuild_later([instance.user])
+
+
+def update_acl_membership_roles(instance, action, pk_set, **_kwargs):
+    from member.models import Membership
+
+    if not is_enabled() or not action.startswith("post_"):
+        return
+    if isinstance(instance, Membership):
+        _rebuild_later([instance.user])
+    else:
+        # The memberships were added to a role
+        _rebuild_later(list(User.objects.filter(memberships__pk__in=pk_set or ()).distinct()))
+
+
+def update_acl_note(instance, created=False, **_kwargs):
+    """
+    A new note can appear in the parameters of the permissions.
+    """
+    from member.models import Membership
+
+    if not is_enabled() or not created:
+        return
+    if hasattr(instance, "user"):
+        _rebuild_later([instance.user])
+    elif hasattr(instance, "club"):
+        _rebuild_later(list(User.objects.filter(memberships__in=Membership.objects.filter(club=instance.club))
+                            .distinct()))
+
+
+def update_acl_trust(instance, **_kwargs):
+    """
+    A trust relationship can appear in the parameters of the permissions of both users.
+    """
+    from note.models import NoteUser
+
+    if is_enabled():
+        notes = NoteUser.objects.filter(pk__in=[instance.trusting_id, instance.trusted_id]).select_related("user")
+        _rebuild_later([note.user for note in notes])
+
+
+def update_acl_all(**_kwargs):
+    """
+    The permissions themselves changed: everything is rebuilt.
+    """
+    if is_enabled():
+        transaction.on_commit(rebuild_acl)
@@ -2,7 +2,7 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 from django.apps import AppConfig
-from django.db.models.signals import pre_save, pre_delete
+from django.db.models.signals import pre_save, pre_delete, post_save, post_delete, m2m_changed
 
 
 class PermissionConfig(AppConfig):
@@ -12,3 +12,27 @@ class PermissionConfig(AppConfig):
         from . import signals
         pre_save.connect(signals.pre_save_object)
         pre_delete.connect(signals.pre_delete_object)
+
+        # Invalidate cached data that depends on permissions
+        from member.models import Membership
+        from .cache import bump_permission_version
+        from .models import Role
+        for sender in ["permission.Permission", "permission.Role", "member.Club", "member.Membership"]:
+            post_save.connect(bump_permission_version, sender=sender)
+            post_delete.connect(bump_permission_version, sender=sender)
+        m2m_changed.connect(bump_permission_version, sender=Role.permissions.through)
+        m2m_changed.connect(bump_permission_version, sender=Membership.roles.through)
+
+        # Maintain the materialized permissions, if enabled
+        from . import acl
+        post_save.connect(acl.update_acl_membership, sender="member.Membership")
+        post_delete.connect(acl.update_acl_membership, sender="member.Membership")
+        m2m_changed.connect(acl.update_acl_membership_roles, sender=Membership.roles.through)
+        post_save.connect(acl.update_acl_note, sender="note.NoteUser")
+        post_save.connect(acl.update_acl_note, sender="note.NoteClub")
+        post_save.connect(acl.update_acl_trust, sender="note.Trust")
+        post_delete.connect(acl.update_acl_trust, sender="note.Trust")
+        for sender in ["permission.Permission", "permission.PermissionMask", "permission.Role"]:
+            post_save.connect(acl.update_acl_all, sender=sender)
+            post_delete.connect(acl.update_acl_all, sender=sender)
+        m2m_changed.connect(acl.update_acl_all, sender=Role.permissions.through)
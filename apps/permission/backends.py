@@ -1,19 +1,26 @@
 # Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import functools
+import operator
+from copy import copy
 from datetime import date
 
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Q, F
+from django.db import connections, transaction
+from django.db.models import Exists, OuterRef, Q, F
 from django.utils import timezone
 from note.models import Note, NoteUser, NoteClub, NoteSpecial
-from note_kfet.middlewares import get_current_request
+from note_kfet.middlewares import get_current_request, get_permission_mask
 from member.models import Membership, Club
 
+from . import acl
+from .cache import parse_scopes
 from .decorators import memoize
 from .models import Permission
+from .profiling import profiled
 
 
 class PermissionBackend(ModelBackend):
@@ -30,25 +37,22 @@ class PermissionBackend(ModelBackend):
         """
         Query permissions of a certain type for a user, then memoize it.
         :param request: The current request
-        :param t: The type of the permissions: view, change, add or delete
+        :param t: The type of the permissions: view, change, add or delete, or None for all types
         :return: The queryset of the permissions of the user (memoized) grouped by clubs
         """
         if hasattr(request, 'auth') and request.auth is not None and hasattr(request.auth, 'scope'):
             # OAuth2 Authentication
             user = request.auth.user
+            # The scopes of the token are parsed once, then memoized
+            scopes = parse_scopes(request.auth.scope)
 
             def permission_filter(membership_obj):
-                query = Q(pk=-1)
-                for scope in request.auth.scope.split(' '):
-                    permission_id, club_id = scope.split('_')
-                    if int(club_id) == membership_obj.club_id:
-                        query |= Q(pk=permission_id)
-                return query
+                return Q(pk__in=scopes.get(membership_obj.club_id, ()))
         else:
             user = request.user
 
             def permission_filter(membership_obj):
-                return Q(mask__rank__lte=request.session.get("permission_mask", 42))
+                return Q(mask__rank__lte=get_permission_mask(request, 42))
 
         if user.is_anonymous:
             # Unauthenticated users have no permissions
@@ -60,7 +64,10 @@ class PermissionBackend(ModelBackend):
 
         for membership in memberships:
             for role in membership.roles.all():
-                for perm in role.permissions.filter(permission_filter(membership), type=t).all():
+                perms_qs = role.permissions.filter(permission_filter(membership))
+                if t is not None:
+                    perms_qs = perms_qs.filter(type=t)
+                for perm in perms_qs.all():
                     if not perm.permanent:
                         if membership.date_start > date.today() or membership.date_end < date.today():
                             continue
@@ -68,6 +75,15 @@ class PermissionBackend(ModelBackend):
                     perms.append(perm)
         return perms
 
+    @staticmethod
+    def get_scopes(request):
+        """
+        List all OAuth2 scopes that the given request can grant, on the form "permissionid_clubid".
+        :param request: The current request
+        :return: The set of the available scopes
+        """
+        return {f"{p.id}_{p.membership.club_id}" for p in PermissionBackend.get_raw_permissions(request, None)}
+
     @staticmethod
     def permissions(request, model, type):
         """
@@ -88,28 +104,36 @@ class PermissionBackend(ModelBackend):
             if not isinstance(model.model_class()(), permission.model.model_class()) or not permission.membership:
                 continue
 
-            membership = permission.membership
-            club = membership.club
-
-            permission = permission.about(
-                user=user,
-                club=club,
-                membership=membership,
-                User=User,
-                Club=Club,
-                Membership=Membership,
-                Note=Note,
-                NoteUser=NoteUser,
-                NoteClub=NoteClub,
-                NoteSpecial=NoteSpecial,
-                F=F,
-                Q=Q,
-                now=timezone.now(),
-                today=date.today(),
-            )
+            permission = permission.about(**PermissionBackend.get_parameters(user, permission.membership))
             yield permission
 
     @staticmethod
+    def get_parameters(user, membership):
+        """
+        Return the parameters that can be used in the queries of the permissions that are given by a membership.
+        :param user: The user that owns the permissions
+        :param membership: The membership that grants the permissions
+        :return: The dictionary of the parameters
+        """
+        return dict(
+            user=user,
+            club=membership.club,
+            membership=membership,
+            User=User,
+            Club=Club,
+            Membership=Membership,
+            Note=Note,
+            NoteUser=NoteUser,
+            NoteClub=NoteClub,
+            NoteSpecial=NoteSpecial,
+            F=F,
+            Q=Q,
+            now=timezone.now(),
+            today=date.today(),
+        )
+
+    @staticmethod
+    @profiled("filter_queryset", lambda request, model, *args, **kwargs: model)
     @memoize
     def filter_queryset(request, model, t, field=None):
         """
@@ -120,7 +144,8 @@ class PermissionBackend(ModelBackend):
         :param field: The field of the model to test, if concerned
         :return: A query that corresponds to the filter to give to a queryset
         """
-        if hasattr(request, 'auth') and request.auth is not None and hasattr(request.auth, 'scope'):
+        oauth = hasattr(request, 'auth') and request.auth is not None and hasattr(request.auth, 'scope')
+        if oauth:
             # OAuth2 Authentication
             user = request.auth.user
         else:
@@ -130,26 +155,44 @@ class PermissionBackend(ModelBackend):
             # Anonymous users can't do anything
             return Q(pk=-1)
 
-        if user.is_superuser and request.session.get("permission_mask", -1) >= 42:
+        if user.is_superuser and get_permission_mask(request) >= 42:
             # Superusers have all rights
             return Q()
 
         if not isinstance(model, ContentType):
             model = ContentType.objects.get_for_model(model)
 
-        # Never satisfied
-        query = Q(pk=-1)
+        # The most common permissions may be materialized in a table, see permission.acl.
+        # The scopes of OAuth2 tokens are not materialized.
+        acl_model = acl.get_acl_model(model, field) if t == "view" and not oauth else None
+        acl_covered = False
+
+        queries = []
         perms = PermissionBackend.permissions(request, model, t)
         for perm in perms:
             if perm.field and field != perm.field:
                 continue
             if perm.type != t or perm.model != model:
                 continue
+            if acl_model is not None \
+                    and acl.get_right(perm.model, perm.type, perm.field, perm.raw_query) == acl_model.model:
+                acl_covered = True
+                continue
             perm.update_query()
-            query = query | perm.query
-        return query
+            queries.append(perm.query)
+
+        if acl_covered:
+            queries.append(acl.get_query(user, acl_model, get_permission_mask(request, 42)))
+
+        if not queries:
+            # Never satisfied
+            return Q(pk=-1)
+
+        # Merge the permissions and don't join to-many relations, then the queryset never needs a DISTINCT
+        return Permission.optimize_query(functools.reduce(operator.or_, queries), model.model_class())
 
     @staticmethod
+    @profiled("check_perm", lambda request, perm, obj=None: perm if obj is None else obj)
     @memoize
     def check_perm(request, perm, obj=None):
         """
@@ -164,7 +207,6 @@ class PermissionBackend(ModelBackend):
             return False
 
         user_obj = request.user
-        sess = request.session
 
         if hasattr(request, 'auth') and request.auth is not None and hasattr(request.auth, 'scope'):
             # OAuth2 Authentication
@@ -173,7 +215,7 @@ class PermissionBackend(ModelBackend):
         if user_obj is None or user_obj.is_anonymous:
             return False
 
-        if user_obj.is_superuser and sess.get("permission_mask", -1) >= 42:
+        if user_obj.is_superuser and get_permission_mask(request) >= 42:
             return True
 
         if obj is None:
@@ -189,6 +231,136 @@ class PermissionBackend(ModelBackend):
             return True
         return False
 
+    @staticmethod
+    def _get_user(request):
+        """
+        Return the user whose permissions are checked, or None if the request can't have any permission.
+        """
+        if request is None:
+            # Requested by a shell
+            return None
+
+        user_obj = request.user
+
+        if hasattr(request, 'auth') and request.auth is not None and hasattr(request.auth, 'scope'):
+            # OAuth2 Authentication
+            user_obj = request.auth.user
+
+        if user_obj is None or user_obj.is_anonymous:
+            return None
+        return user_obj
+
+    @staticmethod
+    def evaluate_permissions(permissions, pks):
+        """
+        Evaluate several instanced permissions on several objects at once, with one query per concerned model.
+        :param permissions: The list of the instanced permissions
+        :param pks: The primary keys of the objects, that must be saved in the database
+        :return: A dictionary that maps each primary key to the list of the indexes of the permissions that apply
+        """
+        annotations = {}
+        for index, permission in enumerate(permissions):
+            permission.update_query()
+            model_class = permission.model.model_class()
+            annotations.setdefault(model_class, {})[f"permission_{index}"] = \
+                Exists(model_class.objects.filter(permission.query & Q(pk=OuterRef("pk"))))
+
+        result = {pk: [] for pk in pks}
+        for model_class, model_annotations in annotations.items():
+            for row in model_class.objects.filter(pk__in=pks).values("pk", **model_annotations):
+                result[row["pk"]] += [int(key[11:]) for key, applies in row.items() if key != "pk" and applies]
+        return result
+
+    @staticmethod
+    @profiled("get_changeable_fields", lambda request, objs, fields=None: objs[0] if objs else None)
+    def get_changeable_fields_batch(request, objs, fields=None):
+        """
+        Compute the fields of several objects that the given request can change.
+        Instead of checking the permission "change_model_field" for each field and each object,
+        all the change permissions are evaluated at once, with one query per concerned model.
+        :param request: The current request
+        :param objs: The concerned objects, that are already saved and that have the same model
+        :param fields: The names of the fields to check. Defaults to all the fields of the model
+        :return: A dictionary that maps the primary key of each object to the set of the fields that can be changed
+        """
+        if not objs:
+            return {}
+
+        if fields is None:
+            fields = [field.name for field in objs[0]._meta.get_fields() if field.concrete]
+        fields = set(fields)
+
+        user_obj = PermissionBackend._get_user(request)
+        if user_obj is None:
+            return {obj.pk: set() for obj in objs}
+
+        if user_obj.is_superuser and get_permission_mask(request) >= 42:
+            return {obj.pk: set(fields) for obj in objs}
+
+        ct = ContentType.objects.get_for_model(objs[0])
+        permissions = [permission for permission in PermissionBackend.permissions(request, ct, "change")
+                       if not permission.field or permission.field in fields]
+        changeable = {}
+        for pk, indexes in PermissionBackend.evaluate_permissions(permissions, [obj.pk for obj in objs]).items():
+            changeable[pk] = set()
+            for index in indexes:
+                # A permission without field allows to change the whole model
+                changeable[pk] |= {permissions[index].field} if permissions[index].field else fields
+        return changeable
+
+    @staticmethod
+    def get_changeable_fields(request, obj, fields=None):
+        """
+        Compute the fields of an object that the given request can change, from one evaluation
+        of the change permissions.
+        :param request: The current request
+        :param obj: The concerned object, that is already saved
+        :param fields: The names of the fields to check. Defaults to all the fields of the model
+        :return: The set of the names of the fields that can be changed
+        """
+        return PermissionBackend.get_changeable_fields_batch(request, [obj], fields)[obj.pk]
+
+    @staticmethod
+    @profiled("check_add_perms", lambda request, objs: objs[0] if objs else None)
+    def check_add_perms(request, objs):
+        """
+        Check at once if the given request can add several objects, which are not saved yet.
+        As for the check of a single add permission, the objects are inserted in a savepoint that is rolled back,
+        then all the add permissions are evaluated with one query per concerned model.
+        :param request: The current request
+        :param objs: The objects to add, that have the same model
+        :return: The list of the objects that can't be added
+        """
+        if not objs:
+            return []
+
+        user_obj = PermissionBackend._get_user(request)
+        if user_obj is None:
+            return list(objs)
+
+        if user_obj.is_superuser and get_permission_mask(request) >= 42:
+            return []
+
+        model_class = type(objs[0])
+        ct = ContentType.objects.get_for_model(model_class)
+        permissions = list(PermissionBackend.permissions(request, ct, "add"))
+        if not permissions:
+            return list(objs)
+
+        if not connections[model_class.objects.db].features.can_return_rows_from_bulk_insert:
+            # The primary keys of the inserted objects are unknown, check the objects one by one
+            return [obj for obj in objs if not PermissionBackend.check_perm(request, f"{ct.app_label}.add_{ct.model}",
+                                                                            obj)]
+
+        with transaction.atomic():
+            sid = transaction.savepoint()
+            copies = [copy(obj) for obj in objs]
+            model_class._base_manager.bulk_create(copies)
+            applied = PermissionBackend.evaluate_permissions(permissions, [obj.pk for obj in copies])
+            transaction.savepoint_rollback(sid)
+
+        return [obj for obj, copied in zip(objs, copies) if not applied[copied.pk]]
+
     def has_perm(self, user_obj, perm, obj=None):
         # Warning: this does not check that user_obj has the permission,
         # but if the current request has the permission.
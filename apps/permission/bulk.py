@@ -0,0 +1,114 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Save many objects at once, while keeping the guarantees of the signals of the permission and the logs apps.
+
+The signals `pre_save` and `post_save` are sent for each saved object, then saving a thousand objects costs
+thousands of queries. `bulk_save` checks the permissions of the whole batch, writes the objects with
+`bulk_create` and `bulk_update`, and writes the changelogs with a single `bulk_create`.
+"""
+
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.utils.translation import gettext_lazy as _
+
+from .backends import PermissionBackend
+from .signals import EXCLUDED
+
+
+def check_bulk_permissions(request, created, updated, previous):
+    """
+    Check that the given request can add and change the given objects.
+    :param request: The current request
+    :param created: The objects that are created
+    :param updated: The objects that are updated
+    :param previous: A dictionary that maps the primary key of each updated object to its version in the database
+    :raise PermissionDenied: if an object can't be saved
+    """
+    created = [obj for obj in created if not hasattr(obj, "_force_save") and not hasattr(obj, "_no_signal")]
+    updated = [obj for obj in updated if not hasattr(obj, "_force_save") and not hasattr(obj, "_no_signal")]
+    if not created and not updated:
+        return
+
+    meta = (created or updated)[0]._meta
+    app_label, model_name = meta.app_label, meta.model_name
+
+    if PermissionBackend.check_add_perms(request, created):
+        raise PermissionDenied(
+            _("You don't have the permission to add an instance of model {app_label}.{model_name}.")
+            .format(app_label=app_label, model_name=model_name, ))
+
+    # Only the modified fields are checked
+    modified_fields = {}
+    for obj in updated:
+        modified_fields[obj.pk] = [field.name for field in meta.fields
+                                   if getattr(obj, field.attname) != getattr(previous[obj.pk], field.attname)]
+    updated = [obj for obj in updated if modified_fields[obj.pk]]
+    fields = set().union(*modified_fields.values())
+    changeable_fields = PermissionBackend.get_changeable_fields_batch(request, updated, fields)
+    for obj in updated:
+        for field_name in modified_fields[obj.pk]:
+            if field_name not in changeable_fields[obj.pk]:
+                raise PermissionDenied(
+                    _("You don't have the permission to change the field {field} on this instance of model"
+                      " {app_label}.{model_name}.")
+                    .format(field=field_name, app_label=app_label, model_name=model_name, )
+                )
+
+
+@transaction.atomic
+def bulk_save(request, objs, batch_size=500):
+    """
+    Save several objects of the same model at once.
+    Objects whose primary key exists in the database are updated, the other ones are created.
+    Permissions are checked for the whole batch as the permission signals would do, and the changelogs are written
+    as the logs signals would do, but the `save` method of the objects is not called and no signal is sent:
+    objects that need custom logic when they are saved (eg. memberships) must still be saved one by one.
+    The database must return the primary keys of the inserted rows (PostgreSQL, SQLite >= 3.35),
+    since they are stored in the changelogs.
+    :param request: The current request, or None if the modification is done in a shell
+    :param objs: The objects to save, that have the same model
+    :param batch_size: The maximum number of objects that are written in one query
+    :return: The couple (created objects, updated objects)
+    :raise PermissionDenied: if an object can't be saved. Then nothing is saved.
+    """
+    from logs.signals import EXCLUDED as LOGS_EXCLUDED, get_actor, get_changelog
+    from logs.models import Changelog
+
+    objs = list(objs)
+    if not objs:
+        return [], []
+
+    model = type(objs[0])
+    if any(type(obj) is not model for obj in objs):
+        raise ValueError("All the objects must have the same model.")
+    label = model._meta.label_lower
+
+    previous = {}
+    pks = [obj.pk for obj in objs if obj.pk is not None]
+    for i in range(0, len(pks), batch_size):
+        previous.update(model.objects.in_bulk(pks[i:i + batch_size]))
+    created = [obj for obj in objs if obj.pk not in previous]
+    updated = [obj for obj in objs if obj.pk in previous]
+
+    if request is not None and label not in EXCLUDED:
+        for i in range(0, max(len(created), len(updated)), batch_size):
+            check_bulk_permissions(request, created[i:i + batch_size], updated[i:i + batch_size], previous)
+
+    model._base_manager.bulk_create(created, batch_size=batch_size)
+    fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+    if updated:
+        model._base_manager.bulk_update(updated, fields, batch_size=batch_size)
+
+    if label not in LOGS_EXCLUDED:
+        user, ip = get_actor(request)
+        # The changelogs of created objects contain the many-to-many relations, they are fetched at once
+        prefetch_related_objects(created, *[field.name for field in model._meta.many_to_many])
+        changelogs = [get_changelog(obj, previous.get(obj.pk), user, ip) for obj in objs
+                      if not hasattr(obj, "_no_signal")]
+        Changelog.objects.bulk_create([changelog for changelog in changelogs if changelog is not None],
+                                      batch_size=batch_size)
+
+    return created, updated
@@ -0,0 +1,67 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from functools import lru_cache
+from types import MappingProxyType
+from uuid import uuid4
+
+from django.core.cache import cache
+
+PERMISSION_VERSION_KEY = "permission_version"
+
+
+def get_permission_version():
+    """
+    Return the current version of the permission configuration (permissions, roles, clubs and memberships).
+    Any data that is cached and depends on permissions should include this version in its cache key.
+    """
+    version = cache.get(PERMISSION_VERSION_KEY)
+    if version is None:
+        # The version was lost (or never set): we can't trust old cached data anymore
+        version = bump_permission_version()
+    return version
+
+
+def bump_permission_version(**_kwargs):
+    """
+    Invalidate all cached data that depends on permissions.
+    This function can be connected to signals.
+    """
+    version = uuid4().hex
+    cache.set(PERMISSION_VERSION_KEY, version, None)
+    return version
+
+
+@lru_cache(maxsize=1024)
+def parse_scopes(scope):
+    """
+    Parse the scope of an OAuth2 access token, on the form "permissionid_clubid permissionid_clubid …".
+    The result is a frozen mapping {club_id: frozenset(permission_id)}.
+    The parsing is done once per scope string, then it is memoized.
+    """
+    scopes = {}
+    for s in scope.split():
+        try:
+            permission_id, club_id = (int(part) for part in s.split('_'))
+        except ValueError:
+            # Invalid scopes are ignored
+            continue
+        scopes.setdefault(club_id, set()).add(permission_id)
+    return MappingProxyType({club_id: frozenset(permission_ids) for club_id, permission_ids in scopes.items()})
+
+
+def get_scopes_names():
+    """
+    Return the descriptions of the permissions and the names of the clubs that are used to describe OAuth2 scopes.
+    They are cached until the permission version changes.
+    """
+    from member.models import Club
+    from .models import Permission
+
+    cache_key = "permission_scopes_names_" + get_permission_version()
+    names = cache.get(cache_key)
+    if names is None:
+        names = (dict(Permission.objects.values_list("id", "description")),
+                 dict(Club.objects.values_list("id", "name")))
+        cache.set(cache_key, names)
+    return names
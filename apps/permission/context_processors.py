@@ -0,0 +1,64 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+from note_kfet.middlewares import get_permission_mask
+
+from .backends import PermissionBackend
+from .cache import get_permission_version
+
+
+def _can_view_any(request, model):
+    if request.user.is_superuser and get_permission_mask(request) >= 42:
+        return True
+    return model.objects.filter(PermissionBackend.filter_queryset(request, model, "view")).exists()
+
+
+def compute_navigation_permissions(request):
+    """
+    Compute which entries of the navigation bar the user of the given request can see.
+    """
+    from activity.models import Activity
+    from member.models import Club, Membership
+    from note.models import TransactionTemplate
+    from treasury.models import Invoice
+
+    return {
+        "consumptions": _can_view_any(request, TransactionTemplate),
+        "transfer": Membership.objects.filter(user=request.user, club__name="Sinfonie",
+                                              date_start__lte=date.today(), date_end__gte=date.today()).exists(),
+        "users": User.objects.filter(PermissionBackend.filter_queryset(request, User, "view"))[:2].count() >= 2,
+        "clubs": _can_view_any(request, Club),
+        "activities": _can_view_any(request, Activity),
+        "treasury": _can_view_any(request, Invoice),
+        "admin": request.user.is_staff and PermissionBackend.check_perm(request, "", request.user),
+    }
+
+
+def get_navigation_permissions(request):
+    """
+    Return the navigation permissions of the user of the given request.
+    They are computed once per user, permission mask and permission version, then stored in the shared cache.
+    """
+    user = request.user
+    if user is None or not user.is_authenticated:
+        return {}
+
+    cache_key = f"permission_navigation_{user.pk}_{get_permission_mask(request)}_{get_permission_version()}"
+    navigation = cache.get(cache_key)
+    if navigation is None:
+        navigation = compute_navigation_permissions(request)
+        cache.set(cache_key, navigation)
+    return navigation
+
+
+def navigation(request):
+    """
+    Context processor that exposes the navigation permissions to the templates, as `nav_perms`.
+    The permissions are only loaded if the template uses them.
+    """
+    return {"nav_perms": SimpleLazyObject(lambda: get_navigation_permissions(request))}
@@ -7,6 +7,8 @@ from time import time
 from django.contrib.sessions.models import Session
 from note_kfet.middlewares import get_current_request
 
+from .profiling import get_stats
+
 
 def memoize(f):
     """
@@ -48,17 +50,28 @@ def memoize(f):
             last_collect = time()
 
         # If there is no session, then we don't memoize anything.
+        # Requests that are authenticated with an API token are memoized with their token.
         request = get_current_request()
-        if request is None or request.session is None or request.session.session_key is None:
+        if request is None:
             return f(*args, **kwargs)
 
-        sess_key = request.session.session_key
+        sess_key = getattr(request, "auth_token_key", None)
+        if sess_key is None:
+            if request.session is None or request.session.session_key is None:
+                return f(*args, **kwargs)
+            sess_key = request.session.session_key
         if sess_key not in sess_funs:
             # lru_cache makes the job of memoization
             # We store only the 512 latest data per session. It has to be enough.
             sess_funs[sess_key] = lru_cache(512)(f)
         try:
-            return sess_funs[sess_key](*args, **kwargs)
+            stats = get_stats()
+            if stats is None:
+                return sess_funs[sess_key](*args, **kwargs)
+            hits = sess_funs[sess_key].cache_info().hits
+            result = sess_funs[sess_key](*args, **kwargs)
+            stats.memoize(sess_funs[sess_key].cache_info().hits > hits)
+            return result
         except TypeError:  # For add permissions, objects are not hashable (not yet created). Don't memoize this case.
             return f(*args, **kwargs)
 
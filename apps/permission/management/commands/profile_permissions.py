@@ -0,0 +1,65 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+
+from ...models import Permission
+
+
+class Command(BaseCommand):
+    help = "Replay a request as a given user, and print statistics about the permission checks. " \
+           "Nothing is written in the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', type=str, help="The URL to request, eg. /note/transfer/")
+        parser.add_argument('--user', '-u', type=str, required=True, help="The username of the requester.")
+        parser.add_argument('--mask', '-m', type=int, default=42, help="The permission mask of the session.")
+        parser.add_argument('--limit', '-l', type=int, default=20, help="The number of lines of each breakdown.")
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options["user"]).first()
+        if user is None:
+            raise CommandError(f"The user {options['user']} doesn't exist.")
+
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=["*"], PERMISSION_PROFILING=True):
+            client = Client()
+            client.force_login(user)
+            session = client.session
+            session["permission_mask"] = options["mask"]
+            session.save()
+            response = client.get(options["url"])
+            # The request may have written something
+            transaction.set_rollback(True)
+
+        stats = response.permission_stats
+        self.stdout.write(f"{options['url']}: HTTP {response.status_code}")
+        self.stdout.write(f"Permissions: {stats.duration * 1000:.1f} ms, "
+                          f"{stats.queries} SQL queries ({stats.query_duration * 1000:.1f} ms), "
+                          f"compilation: {stats.compile_duration * 1000:.1f} ms")
+        self.stdout.write(f"Memoization: {stats.memoize_hits} hits, {stats.memoize_misses} misses")
+        for kind, counter in sorted(stats.kinds.items()):
+            self.stdout.write(f"{kind}: {counter}")
+
+        descriptions = dict(Permission.objects.filter(pk__in=[pk for pk in stats.permissions if pk is not None])
+                            .values_list("pk", "description"))
+        self.print_breakdown("By model", stats.models, options["limit"])
+        self.print_breakdown("By permission", stats.permissions, options["limit"],
+                             lambda pk: f"{pk}: {descriptions.get(pk, '?')}")
+        self.print_breakdown("Compilations", stats.compilations, options["limit"],
+                             lambda pk: f"{pk}: {descriptions.get(pk, '?')}")
+        self.print_breakdown("By call site", stats.call_sites, options["limit"])
+
+    def print_breakdown(self, title, counters, limit, label=str):
+        """
+        Print the most expensive entries of a breakdown.
+        """
+        self.stdout.write("")
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        entries = sorted(counters.items(), key=lambda item: item[1].duration, reverse=True)
+        for key, counter in entries[:limit]:
+            self.stdout.write(f"  {label(key)}: {counter}")
+        if len(entries) > limit:
+            self.stdout.write(f"  ... {len(entries) - limit} more")
@@ -0,0 +1,31 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+
+from ...acl import is_enabled, rebuild_acl
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialized visibility of notes and transactions (see the setting PERMISSION_ACL)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', '-u', nargs='+', type=str, default=None,
+                            help="Only rebuild the permissions of these users (usernames).")
+        parser.add_argument('--force', '-f', action='store_true',
+                            help="Rebuild the table even if PERMISSION_ACL is disabled.")
+
+    def handle(self, *args, **options):
+        if not is_enabled() and not options["force"]:
+            raise CommandError("The setting PERMISSION_ACL is disabled. Use --force to rebuild the table anyway.")
+
+        users = None
+        if options["user"]:
+            users = list(User.objects.filter(username__in=options["user"]))
+            if len(users) != len(set(options["user"])):
+                raise CommandError("Some users don't exist.")
+
+        count = rebuild_acl(users)
+        if options["verbosity"] >= 1:
+            self.stdout.write(f"{count} rows created.")
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('note', '0003_alter_note_polymorphic_ctype_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('permission', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteVisibility',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('right', models.CharField(choices=[('note', 'view note'), ('transaction', 'view transactions')], max_length=15, verbose_name='right')),
+                ('rank', models.PositiveSmallIntegerField(help_text='Minimal rank of the permission mask that grants this right.', verbose_name='rank')),
+                ('permanent', models.BooleanField(default=False, verbose_name='permanent')),
+                ('date_start', models.DateField(null=True, verbose_name='valid from')),
+                ('date_end', models.DateField(null=True, verbose_name='valid until')),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='note.note', verbose_name='note')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'note visibility',
+                'verbose_name_plural': 'note visibilities',
+                'indexes': [models.Index(fields=['user', 'right', 'note'], name='permission__user_id_26c267_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+COMPUTED_TOTAL = '["MUL", ["F", "amount"], ["F", "quantity"]]'
+STORED_TOTAL = '["F", "total"]'
+
+
+def use_stored_total(apps, schema_editor):
+    """
+    The permissions on transactions read the stored total instead of computing it.
+    """
+    Permission = apps.get_model("permission", "permission")
+    db_alias = schema_editor.connection.alias
+    for permission in Permission.objects.using(db_alias).filter(query__contains=COMPUTED_TOTAL):
+        Permission.objects.using(db_alias).filter(pk=permission.pk)\
+            .update(query=permission.query.replace(COMPUTED_TOTAL, STORED_TOTAL))
+
+
+def use_computed_total(apps, schema_editor):
+    Permission = apps.get_model("permission", "permission")
+    db_alias = schema_editor.connection.alias
+    for permission in Permission.objects.using(db_alias).filter(query__contains=STORED_TOTAL):
+        Permission.objects.using(db_alias).filter(pk=permission.pk)\
+            .update(query=permission.query.replace(STORED_TOTAL, COMPUTED_TOTAL))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('note', '0004_transaction_total'),
+        ('permission', '0002_notevisibility'),
+    ]
+
+    operations = [
+        migrations.RunPython(use_stored_total, use_computed_total),
+    ]
@@ -5,15 +5,19 @@ import functools
 import json
 import operator
 from copy import copy
+from time import perf_counter
 
 from django.contrib.contenttypes.models import ContentType
-from django.core.exceptions import ValidationError
+from django.core.exceptions import FieldDoesNotExist, ValidationError
 from django.core.mail import mail_admins
 from django.db import models, transaction
-from django.db.models import F, Q, Model
+from django.db.models import Exists, F, Q, Model, OuterRef
+from django.db.models.constants import LOOKUP_SEP
 from django.forms import model_to_dict
 from django.utils.translation import gettext_lazy as _
 
+from .profiling import get_stats, profiled_permission
+
 
 class InstancedPermission:
 
@@ -26,6 +30,7 @@ class InstancedPermission:
         self.mask = mask
         self.kwargs = kwargs
 
+    @profiled_permission
     def applies(self, obj, permission_type, field_name=None):
         """
         Returns True if the permission applies to
@@ -81,8 +86,12 @@ class InstancedPermission:
         :return:
         """
         if not self.query:
+            stats = get_stats()
+            start = perf_counter() if stats is not None else None
             # noinspection PyProtectedMember
             self.query = Permission._about(self.raw_query, **self.kwargs)
+            if stats is not None:
+                stats.compiled(getattr(self, "permission_id", None), perf_counter() - start)
 
     def __repr__(self):
         if self.field:
@@ -308,6 +317,81 @@ class Permission(models.Model):
             # TODO: find a better way to crash here
             raise Exception("query {} is wrong".format(query))
 
+    @staticmethod
+    def _is_multivalued(model, lookup):
+        """
+        Check if the given lookup follows a to-many relation of the given model,
+        eg. note__noteuser__user__memberships__club__name.
+        """
+        opts = model._meta
+        for part in lookup.split(LOOKUP_SEP):
+            try:
+                field = opts.get_field(part)
+            except FieldDoesNotExist:
+                # The field path is over (pk, lookup, transform...)
+                return False
+            if not field.is_relation or field.related_model is None:
+                return False
+            if field.many_to_many or field.one_to_many:
+                return True
+            opts = field.related_model._meta
+        return False
+
+    @staticmethod
+    def _contains_multivalued(model, query):
+        """
+        Check if the given Q object joins a to-many relation of the given model.
+        """
+        if isinstance(query, Q):
+            return any(Permission._contains_multivalued(model, child) for child in query.children)
+        if isinstance(query, tuple):
+            return Permission._is_multivalued(model, query[0])
+        return False
+
+    @staticmethod
+    def optimize_query(query, model):
+        """
+        Rewrite a Q object that applies to the given model so that filtering with it never duplicates rows.
+        Identical branches of an OR are merged, and the conditions that follow to-many relations
+        are moved into EXISTS subqueries instead of joins.
+        The filtered querysets don't need any DISTINCT anymore.
+        :param query: The Q object, eg. the union of the queries of some permissions
+        :param model: The model class that is filtered
+        :return: An equivalent Q object
+        """
+        everything = Q(pk=F("pk"))
+
+        if not query.negated and query.connector == Q.OR and len(query.children) > 1:
+            branches = []
+            for child in query.children:
+                child = child if isinstance(child, Q) else Q(child)
+                if child not in branches:
+                    branches.append(child)
+            if everything in branches:
+                # One branch applies to all objects, the others are useless
+                return everything
+            return functools.reduce(operator.or_, [Permission.optimize_query(branch, model) for branch in branches])
+
+        if not Permission._contains_multivalued(model, query):
+            return query
+
+        if query.negated:
+            return Q(Exists(model._base_manager.filter(pk=OuterRef("pk")).filter(query)))
+
+        # The conditions on to-many relations must be checked together, on the same related objects
+        plain, multivalued = [], []
+        for child in query.children:
+            child = child if isinstance(child, Q) else Q(child)
+            if Permission._contains_multivalued(model, child):
+                multivalued.append(child)
+            else:
+                plain.append(child)
+        if query.connector == Q.OR:
+            return functools.reduce(operator.or_, plain + [
+                Q(Exists(model._base_manager.filter(pk=OuterRef("pk")).filter(child))) for child in multivalued])
+        return functools.reduce(operator.and_, plain + [
+            Q(Exists(model._base_manager.filter(pk=OuterRef("pk")).filter(*multivalued)))])
+
     def about(self, **kwargs):
         """
         Return an InstancedPermission with the parameters
@@ -315,7 +399,9 @@ class Permission(models.Model):
         """
         query = json.loads(self.query)
         # query = self._about(query, **kwargs)
-        return InstancedPermission(self.model, query, self.type, self.field, self.mask, **kwargs)
+        instanced = InstancedPermission(self.model, query, self.type, self.field, self.mask, **kwargs)
+        instanced.permission_id = self.pk
+        return instanced
 
     def __str__(self):
         return self.description
@@ -349,3 +435,65 @@ class Role(models.Model):
     class Meta:
         verbose_name = _("role permissions")
         verbose_name_plural = _("role permissions")
+
+
+class NoteVisibility(models.Model):
+    """
+    Materialized permission: the user can see the note, or the transactions that touch the note,
+    as long as the permission mask is high enough and the membership that grants the right is valid.
+    This table is only used if the setting PERMISSION_ACL is enabled. See permission.acl.
+    """
+    RIGHTS = [
+        ('note', _('view note')),
+        ('transaction', _('view transactions')),
+    ]
+
+    user = models.ForeignKey(
+        "auth.User",
+        on_delete=models.CASCADE,
+        related_name="+",
+        verbose_name=_("user"),
+    )
+
+    note = models.ForeignKey(
+        "note.Note",
+        on_delete=models.CASCADE,
+        related_name="+",
+        verbose_name=_("note"),
+    )
+
+    right = models.CharField(
+        max_length=15,
+        choices=RIGHTS,
+        verbose_name=_("right"),
+    )
+
+    rank = models.PositiveSmallIntegerField(
+        verbose_name=_("rank"),
+        help_text=_("Minimal rank of the permission mask that grants this right."),
+    )
+
+    permanent = models.BooleanField(
+        default=False,
+        verbose_name=_("permanent"),
+    )
+
+    date_start = models.DateField(
+        null=True,
+        verbose_name=_("valid from"),
+    )
+
+    date_end = models.DateField(
+        null=True,
+        verbose_name=_("valid until"),
+    )
+
+    class Meta:
+        verbose_name = _("note visibility")
+        verbose_name_plural = _("note visibilities")
+        indexes = [
+            models.Index(fields=["user", "right", "note"]),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.note} ({self.right})"
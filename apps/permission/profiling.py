@@ -0,0 +1,202 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Instrumentation of the permission system.
+
+When the setting PERMISSION_PROFILING is enabled, each request counts the calls to the permission backend,
+the hits of the memoization, the time spent to compile and evaluate the permissions and the SQL queries
+that are issued by permission checks. A Server-Timing header is added to the responses.
+See also `./manage.py profile_permissions`.
+
+When profiling is disabled, each instrumented call only costs a context variable lookup.
+"""
+
+import sys
+from collections import defaultdict
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+
+_current_stats = ContextVar("permission_stats", default=None)
+
+# Modules that are part of the permission system, and that are not interesting call sites
+INTERNAL_MODULES = ("permission.acl", "permission.backends", "permission.decorators",
+                    "permission.models", "permission.profiling")
+
+
+class Counter:
+    """
+    Number of calls, total duration and number of SQL queries of something.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.duration = 0.0
+        self.queries = 0
+
+    def __repr__(self):
+        return f"{self.calls} calls, {self.duration * 1000:.1f} ms, {self.queries} SQL"
+
+
+class PermissionStats:
+    """
+    Statistics of the permission system during one request.
+    """
+
+    def __init__(self):
+        self.kinds = defaultdict(Counter)
+        self.models = defaultdict(Counter)
+        self.permissions = defaultdict(Counter)
+        self.compilations = defaultdict(Counter)
+        self.call_sites = defaultdict(Counter)
+        self.memoize_hits = 0
+        self.memoize_misses = 0
+        self.compile_duration = 0.0
+        # Time spent in outermost permission calls
+        self.duration = 0.0
+        self.queries = 0
+        self.query_duration = 0.0
+        self._stack = []
+
+    def call(self, kind, label, func, args, kwargs):
+        """
+        Call a function of the permission backend and record it.
+        """
+        return self._record([self.kinds[kind], self.models[label]], func, args, kwargs)
+
+    def evaluate(self, permission_id, func, args, kwargs):
+        """
+        Evaluate an instanced permission and record it.
+        """
+        return self._record([self.permissions[permission_id]], func, args, kwargs)
+
+    def compiled(self, permission_id, duration):
+        counter = self.compilations[permission_id]
+        counter.calls += 1
+        counter.duration += duration
+        self.compile_duration += duration
+
+    def _record(self, counters, func, args, kwargs):
+        outermost = not self._stack
+        if outermost:
+            counters.append(self.call_sites[get_call_site()])
+        self._stack.append(counters)
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            duration = perf_counter() - start
+            self._stack.pop()
+            for counter in counters:
+                counter.calls += 1
+                counter.duration += duration
+            if outermost:
+                self.duration += duration
+
+    def memoize(self, hit):
+        if hit:
+            self.memoize_hits += 1
+        else:
+            self.memoize_misses += 1
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        """
+        Database execute wrapper that counts the SQL queries issued inside permission calls.
+        """
+        if not self._stack:
+            return execute(sql, params, many, context)
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_duration += perf_counter() - start
+            # Attribute the query to all running calls, without counting twice the same counter
+            for counter in {id(c): c for counters in self._stack for c in counters}.values():
+                counter.queries += 1
+
+    def server_timing(self):
+        """
+        Value of the Server-Timing header.
+        """
+        checks = self.kinds["check_perm"].calls
+        filters = self.kinds["filter_queryset"].calls
+        return f'permission;dur={self.duration * 1000:.1f};desc="{checks} checks, {filters} filters", ' \
+               f'permission-sql;dur={self.query_duration * 1000:.1f};desc="{self.queries} queries"'
+
+
+def get_stats():
+    """
+    Return the statistics of the current request, or None if profiling is disabled.
+    """
+    return _current_stats.get()
+
+
+def start_profiling():
+    """
+    Start to record statistics in the current context.
+    :return: The new statistics
+    """
+    stats = PermissionStats()
+    _current_stats.set(stats)
+    return stats
+
+
+def stop_profiling():
+    _current_stats.set(None)
+
+
+def get_call_site():
+    """
+    Find the first frame of the stack that is outside the permission system.
+    """
+    frame = sys._getframe(3)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if not module.startswith(INTERNAL_MODULES):
+            return f"{module}:{frame.f_lineno} ({frame.f_code.co_name})"
+        frame = frame.f_back
+    return "?"
+
+
+def _model_label(model):
+    if model is None:
+        return "?"
+    if isinstance(model, str):
+        return model
+    if hasattr(model, "model_class"):
+        # ContentType
+        return f"{model.app_label}.{model.model}"
+    # Model class or instance
+    return model._meta.label_lower
+
+
+def profiled(kind, get_model):
+    """
+    Decorator that records the calls of a function of the permission backend.
+    :param kind: The name of the recorded function
+    :param get_model: Function that takes the arguments of the call, and that returns the concerned model
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            stats = _current_stats.get()
+            if stats is None:
+                return func(*args, **kwargs)
+            return stats.call(kind, _model_label(get_model(*args, **kwargs)), func, args, kwargs)
+        return wrapper
+    return decorator
+
+
+def profiled_permission(func):
+    """
+    Decorator that records the evaluations of an instanced permission.
+    """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        stats = _current_stats.get()
+        if stats is None:
+            return func(self, *args, **kwargs)
+        return stats.evaluate(getattr(self, "permission_id", None), func, (self, *args), kwargs)
+    return wrapper
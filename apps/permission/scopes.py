@@ -1,12 +1,42 @@
 # Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
 # SPDX-License-Identifier: GPL-3.0-or-later
+from collections.abc import Mapping
+
 from oauth2_provider.oauth2_validators import OAuth2Validator
 from oauth2_provider.scopes import BaseScopes
-from member.models import Club
 from note_kfet.middlewares import get_current_request
 
 from .backends import PermissionBackend
-from .models import Permission
+from .cache import get_scopes_names
+
+
+class ScopesDescriptions(Mapping):
+    """
+    Lazy mapping of all OAuth2 scopes to their descriptions.
+    A scope is a couple (permission, club), then the descriptions are computed on demand,
+    without storing the whole cartesian product.
+    """
+
+    def __init__(self, permissions, clubs):
+        self.permissions = permissions
+        self.clubs = clubs
+
+    def __getitem__(self, scope):
+        try:
+            permission_id, club_id = (int(part) for part in scope.split('_'))
+        except (AttributeError, ValueError):
+            raise KeyError(scope)
+        if permission_id not in self.permissions or club_id not in self.clubs:
+            raise KeyError(scope)
+        return f"{self.permissions[permission_id]} (club {self.clubs[club_id]})"
+
+    def __iter__(self):
+        for permission_id in self.permissions:
+            for club_id in self.clubs:
+                yield f"{permission_id}_{club_id}"
+
+    def __len__(self):
+        return len(self.permissions) * len(self.clubs)
 
 
 class PermissionScopes(BaseScopes):
@@ -17,20 +47,17 @@ class PermissionScopes(BaseScopes):
     """
 
     def get_all_scopes(self):
-        return {f"{p.id}_{club.id}": f"{p.description} (club {club.name})"
-                for p in Permission.objects.all() for club in Club.objects.all()}
+        return ScopesDescriptions(*get_scopes_names())
 
     def get_available_scopes(self, application=None, request=None, *args, **kwargs):
         if not application:
             return []
-        return [f"{p.id}_{p.membership.club.id}"
-                for t in Permission.PERMISSION_TYPES
-                for p in PermissionBackend.get_raw_permissions(get_current_request(), t[0])]
+        return list(PermissionBackend.get_scopes(get_current_request()))
 
     def get_default_scopes(self, application=None, request=None, *args, **kwargs):
         if not application:
             return []
-        return [f"{p.id}_{p.membership.club.id}"
+        return [f"{p.id}_{p.membership.club_id}"
                 for p in PermissionBackend.get_raw_permissions(get_current_request(), 'view')]
 
 
@@ -44,13 +71,7 @@ class PermissionOAuth2Validator(OAuth2Validator):
         subset of permissions.
         """
 
-        valid_scopes = set()
-
-        for t in Permission.PERMISSION_TYPES:
-            for p in PermissionBackend.get_raw_permissions(get_current_request(), t[0]):
-                scope = f"{p.id}_{p.membership.club.id}"
-                if scope in scopes:
-                    valid_scopes.add(scope)
+        valid_scopes = PermissionBackend.get_scopes(get_current_request()) & set(scopes)
 
         request.scopes = valid_scopes
 
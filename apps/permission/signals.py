@@ -8,18 +8,23 @@ from permission.backends import PermissionBackend
 
 
 EXCLUDED = [
+    'activity.attendee',
     'cas_server.proxygrantingticket',
     'cas_server.proxyticket',
     'cas_server.serviceticket',
     'cas_server.user',
     'cas_server.userattributes',
     'contenttypes.contenttype',
+    'jobs.job',
     'logs.changelog',
     'migrations.migration',
+    'note.salesstatistic',
     'oauth2_provider.accesstoken',
     'oauth2_provider.grant',
     'oauth2_provider.refreshtoken',
+    'permission.notevisibility',
     'sessions.session',
+    'treasury.periodtotal',
 ]
 
 
@@ -39,25 +44,18 @@ def pre_save_object(sender, instance, **kwargs):
         # Action performed on shell is always granted
         return
 
-    qs = sender.objects.filter(pk=instance.pk).all()
+    previous = sender.objects.filter(pk=instance.pk).first()
     model_name_full = instance._meta.label_lower.split(".")
     app_label = model_name_full[0]
     model_name = model_name_full[1]
 
-    if qs.exists():
-        # We check if the user can change the model
-
-        # If the user has all right on a model, then OK
-        if PermissionBackend.check_perm(request, app_label + ".change_" + model_name, instance):
-            return
-
-        # In the other case, we check if he/she has the right to change one field
-        previous = qs.get()
-
+    if previous is not None:
+        # We check if the user can change the model, or at least the modified fields
+        modified_fields = []
         for field in instance._meta.fields:
-            field_name = field.name
-            old_value = getattr(previous, field.name)
-            new_value = getattr(instance, field.name)
+            # Compare the raw values, related objects don't need to be fetched
+            old_value = getattr(previous, field.attname)
+            new_value = getattr(instance, field.attname)
             # If the field wasn't modified, no need to check the permissions
             if old_value == new_value:
                 continue
@@ -67,8 +65,15 @@ def pre_save_object(sender, instance, **kwargs):
                 # their password. We trust password change form.
                 continue
 
-            if not PermissionBackend.check_perm(request, app_label + ".change_" + model_name + "_" + field_name,
-                                                instance):
+            modified_fields.append(field.name)
+
+        if not modified_fields:
+            return
+
+        # All the fields are checked at once
+        changeable_fields = PermissionBackend.get_changeable_fields(request, instance, modified_fields)
+        for field_name in modified_fields:
+            if field_name not in changeable_fields:
                 raise PermissionDenied(
                     _("You don't have the permission to change the field {field} on this instance of model"
                       " {app_label}.{model_name}.")
@@ -4,7 +4,7 @@
 from django.contrib.contenttypes.models import ContentType
 from django.template.defaultfilters import stringfilter
 from django import template
-from note_kfet.middlewares import get_current_request
+from note_kfet.middlewares import get_current_request, get_permission_mask
 
 from ..backends import PermissionBackend
 
@@ -16,10 +16,9 @@ def not_empty_model_list(model_name):
     """
     request = get_current_request()
     user = request.user
-    session = request.session
     if user is None or not user.is_authenticated:
         return False
-    elif user.is_superuser and session.get("permission_mask", -1) >= 42:
+    elif user.is_superuser and get_permission_mask(request) >= 42:
         return True
     qs = model_list(model_name)
     return qs.exists()
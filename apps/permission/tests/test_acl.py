@@ -0,0 +1,93 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from django.contrib.auth.models import User
+from django.core.management import call_command, CommandError
+from django.test import RequestFactory, TestCase, override_settings
+from member.models import Club, Membership
+from note.models import Note, NoteUser, Transaction
+
+from ..backends import PermissionBackend
+from ..models import NoteVisibility, Role
+
+
+@override_settings(PERMISSION_ACL=True)
+class TestPermissionACL(TestCase):
+    """
+    The permissions to see notes and transactions are materialized in a table.
+    """
+    fixtures = ("initial",)
+
+    def setUp(self):
+        Club.objects.filter(name="BDE").update(membership_end=None)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create(username="toto")
+            NoteUser.objects.create(user=self.user)
+            self.membership = Membership.objects.create(user=self.user, club=Club.objects.get(name="BDE"))
+            self.membership.roles.add(Role.objects.get(name="Adhérent"))
+            self.membership.save()
+
+        self.other = User.objects.create(username="other")
+        NoteUser.objects.create(user=self.other)
+        self.third = User.objects.create(username="third")
+        NoteUser.objects.create(user=self.third)
+
+        Transaction.objects.create(source=self.user.note, destination=self.other.note, quantity=1, amount=100,
+                                   reason="Visible")
+        Transaction.objects.create(source=self.other.note, destination=self.third.note, quantity=1, amount=100,
+                                   reason="Hidden")
+
+        self.request = RequestFactory().get("/")
+        self.request.user = self.user
+        self.request.session = {}
+
+    def visible(self, model):
+        return set(model.objects.filter(PermissionBackend.filter_queryset(self.request, model, "view"))
+                   .values_list("pk", flat=True))
+
+    def test_rows(self):
+        """
+        The own note and the transactions of the own note are materialized.
+        """
+        rows = NoteVisibility.objects.filter(user=self.user)
+        self.assertTrue(rows.filter(note=self.user.note, right="note", permanent=True).exists())
+        self.assertTrue(rows.filter(note=self.user.note, right="transaction").exists())
+        self.assertFalse(rows.filter(note=self.other.note).exists())
+
+    def test_same_result(self):
+        """
+        The materialized permissions give the same results, with a subquery on the table.
+        """
+        for model in [Note, Transaction]:
+            qs = model.objects.filter(PermissionBackend.filter_queryset(self.request, model, "view"))
+            self.assertIn("permission_notevisibility", str(qs.query))
+            visible = self.visible(model)
+            with self.settings(PERMISSION_ACL=False):
+                self.assertEqual(visible, self.visible(model))
+
+        self.assertIn(Transaction.objects.get(reason="Visible").pk, self.visible(Transaction))
+        self.assertNotIn(Transaction.objects.get(reason="Hidden").pk, self.visible(Transaction))
+
+    def test_signals(self):
+        """
+        The table follows the memberships.
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            self.membership.roles.clear()
+        self.assertFalse(NoteVisibility.objects.filter(user=self.user).exists())
+        self.assertEqual(self.visible(Note), set())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.membership.roles.add(Role.objects.get(name="Adhérent"))
+        self.assertTrue(NoteVisibility.objects.filter(user=self.user).exists())
+        self.assertEqual(self.visible(Note), {self.user.note.pk})
+
+    def test_command(self):
+        NoteVisibility.objects.all().delete()
+        call_command("rebuild_permission_acl", verbosity=0)
+        self.assertTrue(NoteVisibility.objects.filter(user=self.user, note=self.user.note).exists())
+
+        with self.settings(PERMISSION_ACL=False):
+            with self.assertRaises(CommandError):
+                call_command("rebuild_permission_acl", verbosity=0)
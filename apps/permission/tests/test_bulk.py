@@ -0,0 +1,94 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import PermissionDenied
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from logs.models import Changelog
+from member.models import Club, Membership
+from note.models import NoteUser
+
+from ..bulk import bulk_save
+from ..models import Role
+
+
+class TestBulkSave(TestCase):
+    """
+    Many objects are saved at once, with permission checks and changelogs.
+    """
+    fixtures = ("initial",)
+
+    def setUp(self):
+        Club.objects.filter(name="BDE").update(membership_end=None)
+        self.user = User.objects.create(username="toto")
+        NoteUser.objects.create(user=self.user)
+        membership = Membership.objects.create(user=self.user, club=Club.objects.get(name="BDE"))
+        membership.roles.add(Role.objects.get(name="Adhérent"))
+        membership.save()
+        self.admin = User.objects.create(username="admin", is_superuser=True)
+
+        self.request = RequestFactory().get("/")
+        self.request.user = self.user
+        self.request.session = {}
+        self.admin_request = RequestFactory().get("/")
+        self.admin_request.user = self.admin
+        self.admin_request.session = {"permission_mask": 42}
+
+    def changelogs(self):
+        return Changelog.objects.filter(model=ContentType.objects.get_for_model(User))
+
+    def test_create_and_update(self):
+        logs = self.changelogs().count()
+        self.user.first_name = "Toto"
+        created, updated = bulk_save(self.admin_request, [User(username=f"user{i}") for i in range(5)] + [self.user])
+        self.assertEqual(len(created), 5)
+        self.assertEqual(updated, [self.user])
+        self.assertTrue(all(user.pk is not None for user in created))
+        self.assertEqual(User.objects.get(pk=self.user.pk).first_name, "Toto")
+
+        self.assertEqual(self.changelogs().count(), logs + 6)
+        changelog = self.changelogs().get(instance_pk=self.user.pk, action="edit")
+        self.assertEqual(changelog.user, self.admin)
+        self.assertIn("Toto", changelog.data)
+        self.assertNotIn("username", changelog.data)
+
+    def test_constant_queries(self):
+        """
+        The number of queries doesn't depend on the number of objects.
+        """
+        with CaptureQueriesContext(connection) as few:
+            bulk_save(self.admin_request, [User(username=f"few{i}") for i in range(2)])
+        with CaptureQueriesContext(connection) as many:
+            bulk_save(self.admin_request, [User(username=f"many{i}") for i in range(20)])
+        self.assertEqual(len(few), len(many))
+
+        users = list(User.objects.filter(username__startswith="many"))
+        for user in users:
+            user.last_name = "Updated"
+        with CaptureQueriesContext(connection) as updates:
+            bulk_save(self.request, [self.user])
+        with CaptureQueriesContext(connection) as admin_updates:
+            bulk_save(self.admin_request, users)
+        self.assertLessEqual(len(admin_updates), len(updates) + 1)
+
+    def test_permissions(self):
+        """
+        Nothing is saved if one object can't be saved.
+        """
+        other = User.objects.create(username="other")
+        self.user.first_name = "Toto"
+        other.first_name = "Other"
+        with self.assertRaises(PermissionDenied):
+            bulk_save(self.request, [self.user, other])
+        self.assertEqual(User.objects.get(pk=self.user.pk).first_name, "")
+
+        with self.assertRaises(PermissionDenied):
+            bulk_save(self.request, [User(username="new")])
+        self.assertFalse(User.objects.filter(username="new").exists())
+
+        # Own data can be changed
+        bulk_save(self.request, [self.user])
+        self.assertEqual(User.objects.get(pk=self.user.pk).first_name, "Toto")
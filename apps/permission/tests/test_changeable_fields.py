@@ -0,0 +1,80 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from member.models import Club, Membership
+from note.models import NoteUser
+from note_kfet.middlewares import _set_current_request
+
+from ..backends import PermissionBackend
+from ..models import Role
+
+
+class TestChangeableFields(TestCase):
+    """
+    The fields that a user can change are computed at once.
+    """
+    fixtures = ("initial",)
+
+    def setUp(self):
+        Club.objects.filter(name="BDE").update(membership_end=None)
+        self.user = User.objects.create(username="toto")
+        NoteUser.objects.create(user=self.user)
+        membership = Membership.objects.create(user=self.user, club=Club.objects.get(name="BDE"))
+        membership.roles.add(Role.objects.get(name="Adhérent"))
+        membership.save()
+        self.other = User.objects.create(username="other")
+
+        self.request = RequestFactory().get("/")
+        self.request.user = self.user
+        self.request.session = {}
+
+    def test_same_result(self):
+        """
+        The changeable fields are the fields that have the change permission.
+        """
+        fields = [field.name for field in User._meta.fields]
+        for obj in [self.user, self.other]:
+            expected = {field for field in fields
+                        if PermissionBackend.check_perm(self.request, f"auth.change_user_{field}", obj)}
+            self.assertEqual(PermissionBackend.get_changeable_fields(self.request, obj, fields), expected)
+
+        changeable = PermissionBackend.get_changeable_fields(self.request, self.user)
+        self.assertIn("first_name", changeable)
+        self.assertNotIn("is_superuser", changeable)
+        self.assertNotIn("first_name", PermissionBackend.get_changeable_fields(self.request, self.other))
+
+        # A permission on the whole model grants all the fields, even the fields that are not in the model
+        changeable = PermissionBackend.get_changeable_fields(self.request, self.user.profile, ["phone_number", "extra"])
+        self.assertEqual(changeable, {"phone_number", "extra"})
+
+    def test_constant_queries(self):
+        """
+        The number of queries doesn't depend on the number of fields.
+        """
+        with CaptureQueriesContext(connection) as one_field:
+            PermissionBackend.get_changeable_fields(self.request, self.user, ["first_name"])
+        with CaptureQueriesContext(connection) as all_fields:
+            PermissionBackend.get_changeable_fields(self.request, self.user)
+        self.assertEqual(len(one_field), len(all_fields))
+
+    def test_signal(self):
+        """
+        The modified fields are checked before saving.
+        """
+        _set_current_request(self.request)
+        try:
+            self.user.first_name = "Toto"
+            self.user.save()
+
+            self.user.is_superuser = True
+            with self.assertRaises(PermissionDenied):
+                self.user.save()
+        finally:
+            _set_current_request(None)
+        self.assertFalse(User.objects.get(pk=self.user.pk).is_superuser)
+        self.assertEqual(User.objects.get(pk=self.user.pk).first_name, "Toto")
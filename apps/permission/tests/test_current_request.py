@@ -0,0 +1,76 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import asyncio
+from threading import Event, Thread
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase
+from note_kfet.middlewares import SessionMiddleware, get_current_request
+
+
+class CurrentRequestTestCase(SimpleTestCase):
+    """
+    The current request is used deep inside models and signals to check permissions.
+    Ensure that concurrent requests never see the request of each other.
+    """
+
+    def test_interleaved_async_requests(self):
+        """
+        Two requests are handled at the same time by an asynchronous server, in the same thread.
+        """
+        factory = RequestFactory()
+        request_a, request_b = factory.get("/a/"), factory.get("/b/")
+        seen = {request_a: [], request_b: []}
+
+        async def scenario():
+            events = {request_a: asyncio.Event(), request_b: asyncio.Event()}
+
+            async def view(request):
+                other = request_b if request is request_a else request_a
+                seen[request].append(get_current_request())
+                events[request].set()
+                # Wait that the other request is in progress
+                await events[other].wait()
+                seen[request].append(get_current_request())
+                # Synchronous code (models, signals, …) is run in a thread with a copy of the context
+                seen[request].append(await sync_to_async(get_current_request)())
+                return HttpResponse()
+
+            middleware = SessionMiddleware(view)
+            await asyncio.gather(middleware(request_a), middleware(request_b))
+            return get_current_request()
+
+        self.assertIsNone(async_to_sync(scenario)())
+        self.assertEqual(seen[request_a], [request_a] * 3)
+        self.assertEqual(seen[request_b], [request_b] * 3)
+        self.assertIsNone(get_current_request())
+
+    def test_interleaved_threaded_requests(self):
+        """
+        Two requests are handled at the same time by two threads of a WSGI server.
+        """
+        factory = RequestFactory()
+        request_a, request_b = factory.get("/a/"), factory.get("/b/")
+        events = {request_a: Event(), request_b: Event()}
+        seen = {request_a: [], request_b: []}
+
+        def view(request):
+            other = request_b if request is request_a else request_a
+            seen[request].append(get_current_request())
+            events[request].set()
+            events[other].wait(5)
+            seen[request].append(get_current_request())
+            return HttpResponse()
+
+        middleware = SessionMiddleware(view)
+        threads = [Thread(target=middleware, args=(request,)) for request in (request_a, request_b)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(seen[request_a], [request_a] * 2)
+        self.assertEqual(seen[request_b], [request_b] * 2)
+        self.assertIsNone(get_current_request())
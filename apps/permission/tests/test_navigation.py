@@ -0,0 +1,59 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from member.models import Club, Membership
+from note.models import NoteUser
+
+from ..context_processors import get_navigation_permissions
+from ..models import Role
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class TestNavigationPermissions(TestCase):
+    """
+    The permissions of the navigation bar are computed once, then read from the cache.
+    """
+    fixtures = ("initial",)
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username="toto")
+        NoteUser.objects.create(user=self.user)
+        self.client.force_login(self.user)
+        # Memberships don't end in the past
+        Club.objects.filter(name="BDE").update(membership_end=None)
+
+    def test_navigation_is_cached(self):
+        response = self.client.get(reverse("permission:rights"))
+        self.assertEqual(response.status_code, 200)
+        navigation = get_navigation_permissions(response.wsgi_request)
+        self.assertFalse(navigation["clubs"])
+        self.assertFalse(navigation["admin"])
+
+        # The second computation doesn't hit the database
+        with self.assertNumQueries(0):
+            self.assertEqual(get_navigation_permissions(response.wsgi_request), navigation)
+
+    def test_navigation_is_invalidated(self):
+        response = self.client.get(reverse("permission:rights"))
+        self.assertFalse(get_navigation_permissions(response.wsgi_request)["clubs"])
+        self.assertNotContains(response, reverse("member:club_list"))
+
+        # Becoming a member changes the permissions
+        membership = Membership.objects.create(user=self.user, club=Club.objects.get(name="BDE"))
+        membership.roles.add(Role.objects.get(name="Adhérent"))
+        membership.save()
+
+        response = self.client.get(reverse("permission:rights"))
+        self.assertTrue(get_navigation_permissions(response.wsgi_request)["clubs"])
+        self.assertContains(response, reverse("member:club_list"))
+
+    def test_anonymous(self):
+        self.client.logout()
+        response = self.client.get(reverse("permission:rights"))
+        self.assertEqual(get_navigation_permissions(response.wsgi_request), {})
+        self.assertNotContains(response, reverse("member:club_list"))
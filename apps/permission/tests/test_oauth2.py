@@ -12,7 +12,9 @@ from member.models import Membership, Club
 from note.models import NoteUser
 from oauth2_provider.models import Application, AccessToken
 
+from ..cache import parse_scopes
 from ..models import Role, Permission
+from ..scopes import PermissionScopes
 
 
 class OAuth2TestCase(TestCase):
@@ -92,3 +94,28 @@ class OAuth2TestCase(TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertIn(self.application, resp.context['scopes'])
         self.assertIn('1_1', resp.context['scopes'][self.application])  # Now the user has this permission
+
+    def test_parse_scopes(self):
+        """
+        Ensure that the scopes of a token are parsed into a frozen structure, and that invalid scopes are ignored.
+        """
+        scopes = parse_scopes("1_2 3_2 4_5 invalid 6_")
+        self.assertEqual(dict(scopes), {2: frozenset({1, 3}), 5: frozenset({4})})
+        # The parsed scopes are shared, then they can't be modified
+        with self.assertRaises(TypeError):
+            scopes[2] = frozenset()
+        self.assertIs(parse_scopes("1_2 3_2 4_5 invalid 6_"), scopes)
+
+    def test_all_scopes(self):
+        """
+        Ensure that all scopes are described without building the whole list of scopes.
+        """
+        bde = Club.objects.get(name="BDE")
+        permission = Permission.objects.get(pk=1)
+
+        all_scopes = PermissionScopes().get_all_scopes()
+        self.assertEqual(all_scopes[f"{permission.pk}_{bde.pk}"], f"{permission.description} (club BDE)")
+        self.assertIn(f"{permission.pk}_{bde.pk}", all_scopes)
+        self.assertNotIn(f"{permission.pk}_0", all_scopes)
+        self.assertNotIn("invalid", all_scopes)
+        self.assertEqual(len(all_scopes), Permission.objects.count() * Club.objects.count())
@@ -1,18 +1,23 @@
 # Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import functools
+import operator
 from datetime import date
 from json.decoder import JSONDecodeError
 
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import FieldError
-from django.db.models import F, Q
-from django.test import TestCase
+from django.db import connection
+from django.db.models import Exists, F, Q
+from django.test import RequestFactory, TestCase
 from django.utils import timezone
 from member.models import Club, Membership, Role
-from note.models import NoteUser, Note, NoteClub, NoteSpecial
+from note.models import Alias, NoteUser, Note, NoteClub, NoteSpecial, Transaction
 
 
+from ..backends import PermissionBackend
 from ..models import Permission
 
 
@@ -62,3 +67,71 @@ class PermissionQueryTestCase(TestCase):
                 if instanced.query:
                     print("Compiled query:", instanced.query)
                 raise
+
+
+class DistinctFreeQueryTestCase(TestCase):
+    """
+    The querysets that are filtered by permissions never contain duplicates, then they don't need any DISTINCT.
+    """
+    fixtures = ('initial', )
+
+    def setUp(self):
+        Club.objects.filter(name__in=["BDE", "BDA"]).update(membership_end=None)
+        self.user = User.objects.create(username="user")
+        NoteUser.objects.create(user=self.user)
+        for club in Club.objects.filter(name__in=["BDE", "BDA"]).order_by("id"):
+            membership = Membership.objects.create(user=self.user, club=club)
+            membership.roles.add(Role.objects.get(name="Adhérent"))
+            membership.save()
+
+        other = User.objects.create(username="other")
+        NoteUser.objects.create(user=other)
+        for name in ["other2", "other3"]:
+            Alias.objects.create(note=other.note, name=name)
+
+        self.request = RequestFactory().get("/")
+        self.request.user = self.user
+        self.request.session = {}
+
+    def assert_no_distinct(self, qs):
+        self.assertNotIn("DISTINCT", str(qs.query).upper())
+        plan = qs.explain()
+        if connection.vendor == "postgresql":
+            self.assertFalse(plan.strip().startswith(("Unique", "HashAggregate")), plan)
+        else:
+            self.assertNotIn("DISTINCT", plan.upper())
+
+    def test_no_distinct(self):
+        for model in [Alias, Note, NoteUser, Transaction, User, Membership, Club]:
+            ct = ContentType.objects.get_for_model(model)
+            with self.subTest(model=model):
+                qs = model.objects.filter(PermissionBackend.filter_queryset(self.request, model, "view"))
+                self.assert_no_distinct(qs)
+                pks = list(qs.values_list("pk", flat=True))
+                self.assertEqual(len(pks), len(set(pks)))
+
+                # The old way: OR the raw queries, that join to-many relations, then remove duplicates
+                queries = [perm.query for perm in PermissionBackend.permissions(self.request, ct, "view")
+                           if perm.model == ct and not perm.field and perm.update_query() is None]
+                if queries:
+                    old_qs = model.objects.filter(functools.reduce(operator.or_, queries)).distinct()
+                    self.assertEqual(set(pks), set(old_qs.values_list("pk", flat=True)))
+
+    def test_optimize_query(self):
+        """
+        Conditions on to-many relations become subqueries, and duplicate branches are merged.
+        """
+        query = Q(username="user") | Q(memberships__club__name="BDE") | Q(username="user")
+        optimized = Permission.optimize_query(query, User)
+        self.assertEqual(len(optimized.children), 2)
+        self.assertEqual(optimized.children[0], ("username", "user"))
+        self.assertIsInstance(optimized.children[1], Exists)
+
+        self.assertEqual(Permission.optimize_query(Q(pk=F("pk")) | Q(username="user"), User), Q(pk=F("pk")))
+
+        qs = User.objects.filter(Q(memberships__club__name__in=["BDE", "BDA"]))
+        self.assertIn("DISTINCT", qs.distinct().explain().upper())
+        self.assertEqual(qs.count(), 2)
+        qs = User.objects.filter(Permission.optimize_query(Q(memberships__club__name__in=["BDE", "BDA"]), User))
+        self.assert_no_distinct(qs)
+        self.assertEqual(qs.count(), 1)
@@ -0,0 +1,63 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from member.models import Club, Membership
+from note.models import NoteUser
+
+from ..models import Role
+from ..profiling import get_stats
+
+
+class TestPermissionProfiling(TestCase):
+    """
+    The permission checks of a request can be profiled.
+    """
+    fixtures = ("initial",)
+
+    def setUp(self):
+        Club.objects.filter(name="BDE").update(membership_end=None)
+        self.user = User.objects.create(username="toto")
+        NoteUser.objects.create(user=self.user)
+        membership = Membership.objects.create(user=self.user, club=Club.objects.get(name="BDE"))
+        membership.roles.add(Role.objects.get(name="Adhérent"))
+        membership.save()
+        self.client.force_login(self.user)
+        session = self.client.session
+        session["permission_mask"] = 42
+        session.save()
+
+    def test_disabled(self):
+        response = self.client.get(reverse("note:transactions", args=(self.user.note.pk,)))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Server-Timing", response)
+        self.assertFalse(hasattr(response, "permission_stats"))
+
+    @override_settings(PERMISSION_PROFILING=True)
+    def test_enabled(self):
+        response = self.client.get(reverse("note:transactions", args=(self.user.note.pk,)))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("permission;dur=", response["Server-Timing"])
+
+        stats = response.permission_stats
+        self.assertGreater(stats.kinds["check_perm"].calls + stats.kinds["filter_queryset"].calls, 0)
+        self.assertIn("note.transaction", stats.models)
+        self.assertTrue(stats.call_sites)
+        self.assertTrue(all(site.split(":")[0] not in ("permission.backends", "permission.models")
+                            for site in stats.call_sites))
+        # Profiling stops at the end of the request
+        self.assertIsNone(get_stats())
+
+    def test_command(self):
+        out = StringIO()
+        call_command("profile_permissions", reverse("note:transactions", args=(self.user.note.pk,)),
+                     user="toto", stdout=out)
+        output = out.getvalue()
+        self.assertIn("HTTP 200", output)
+        self.assertIn("By permission", output)
+        self.assertIn("note.transaction", output)
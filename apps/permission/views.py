@@ -28,7 +28,7 @@ class ProtectQuerysetMixin:
     """
     def get_queryset(self, filter_permissions=True, **kwargs):
         qs = super().get_queryset(**kwargs)
-        return qs.filter(PermissionBackend.filter_queryset(self.request, qs.model, "view")).distinct()\
+        return qs.filter(PermissionBackend.filter_queryset(self.request, qs.model, "view"))\
             if filter_permissions else qs
 
     def get_object(self, queryset=None):
@@ -51,10 +51,9 @@ class ProtectQuerysetMixin:
         # No worry if the user change the hidden fields: a 403 error will be performed if the user tries to make
         # a custom request.
         # We could also delete the field, but some views might be affected.
-        meta = form.instance._meta
+        changeable_fields = PermissionBackend.get_changeable_fields(self.request, self.object, form.base_fields)
         for key in form.base_fields:
-            if not PermissionBackend.check_perm(self.request,
-                                                f"{meta.app_label}.change_{meta.model_name}_" + key, self.object):
+            if key not in changeable_fields:
                 form.fields[key].widget = HiddenInput()
 
         return form
@@ -157,7 +156,8 @@ class ScopesView(LoginRequiredMixin, TemplateView):
         for app in Application.objects.filter(user=self.request.user).all():
             available_scopes = scopes.get_available_scopes(app)
             context["scopes"][app] = OrderedDict()
-            items = [(k, v) for (k, v) in all_scopes.items() if k in available_scopes]
+            # Only describe the available scopes, the list of all scopes is lazy
+            items = [(k, all_scopes[k]) for k in available_scopes if k in all_scopes]
             items.sort(key=lambda x: (int(x[0].split("_")[1]), int(x[0].split("_")[0])))
             for k, v in items:
                 context["scopes"][app][k] = v
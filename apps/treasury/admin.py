@@ -1,11 +1,14 @@
 # Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
 # SPDX-License-Identifier: GPL-3.0-or-lateré
 
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.exceptions import ValidationError
+from django.utils.translation import gettext_lazy as _
 from note_kfet.admin import admin_site
 
 from .forms import ProductForm
-from .models import RemittanceType, Remittance, Invoice, Product
+from .models import RemittanceType, Remittance, Invoice, Product, AccountingPeriod, PeriodTotal
+from .periods import close_period, reopen_period, verify_period
 
 
 @admin.register(RemittanceType, site=admin_site)
@@ -23,6 +26,9 @@ class RemittanceAdmin(admin.ModelAdmin):
     """
     list_display = ('remittance_type', 'date', 'comment', 'count', 'amount', 'closed', )
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_totals().select_related("remittance_type__note")
+
     def has_change_permission(self, request, obj=None):
         return not obj or (not obj.closed and super().has_change_permission(request, obj))
 
@@ -42,3 +48,54 @@ class InvoiceAdmin(admin.ModelAdmin):
     """
     list_display = ('object', 'id', 'bde', 'name', 'date', 'acquitted',)
     inlines = (ProductInline,)
+
+
+class PeriodTotalInline(admin.TabularInline):
+    """
+    Frozen totals of a closed accounting period
+    """
+    model = PeriodTotal
+    fields = ('note', 'transaction_type', 'incoming', 'outgoing', 'incoming_count', 'outgoing_count', )
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(AccountingPeriod, site=admin_site)
+class AccountingPeriodAdmin(admin.ModelAdmin):
+    """
+    Admin customisation for AccountingPeriod
+    """
+    list_display = ('name', 'start', 'end', 'closed_at', 'closed_by', )
+    readonly_fields = ('closed_at', 'closed_by', 'checksum', )
+    inlines = (PeriodTotalInline, )
+    actions = ('close', 'reopen', 'verify', )
+
+    def has_change_permission(self, request, obj=None):
+        return not obj or (not obj.closed and super().has_change_permission(request, obj))
+
+    @admin.action(description=_("Close the selected accounting periods"))
+    def close(self, request, queryset):
+        for period in queryset:
+            try:
+                close_period(period, request.user)
+            except ValidationError as e:
+                self.message_user(request, f"{period}: {' '.join(e.messages)}", messages.ERROR)
+
+    @admin.action(description=_("Reopen the selected accounting periods"))
+    def reopen(self, request, queryset):
+        for period in queryset.filter(closed_at__isnull=False):
+            reopen_period(period)
+
+    @admin.action(description=_("Verify the checksums of the selected accounting periods"))
+    def verify(self, request, queryset):
+        for period in queryset.filter(closed_at__isnull=False):
+            intact, unchanged = verify_period(period)
+            if intact and unchanged:
+                self.message_user(request, _("{period}: the totals are valid.").format(period=period))
+            else:
+                self.message_user(request, _("{period}: the totals don't match the checksum.").format(period=period),
+                                  messages.ERROR)
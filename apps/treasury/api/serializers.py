@@ -61,3 +61,20 @@ class RemittanceSerializer(serializers.ModelSerializer):
     def get_transactions(self, obj):
         return serializers.ListSerializer(child=SpecialTransactionSerializer()).to_representation(obj.transactions)
 
+
+class RemittanceTransactionsSerializer(serializers.Serializer):
+    """
+    Select the special transactions to attach to a remittance or to detach from it,
+    by the list of their ids or by filters. The amounts are given in cents.
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+    remittance_type = serializers.PrimaryKeyRelatedField(queryset=RemittanceType.objects.all(), required=False)
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+    min_amount = serializers.IntegerField(min_value=0, required=False)
+    max_amount = serializers.IntegerField(min_value=0, required=False)
+
+    def validate(self, attrs):
+        if not attrs:
+            raise serializers.ValidationError("Give a list of ids or some filters.")
+        return attrs
@@ -1,12 +1,19 @@
 # Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+from django.core.exceptions import ValidationError
 from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import status
+from rest_framework.decorators import action
 from rest_framework.filters import SearchFilter
+from rest_framework.response import Response
 from api.viewsets import ReadProtectedModelViewSet
+from permission.backends import PermissionBackend
 
-from .serializers import InvoiceSerializer, ProductSerializer, RemittanceTypeSerializer, RemittanceSerializer
-from ..models import Invoice, Product, RemittanceType, Remittance
+from .serializers import InvoiceSerializer, ProductSerializer, RemittanceTypeSerializer, RemittanceSerializer, \
+    RemittanceTransactionsSerializer
+from ..bulk import filter_proxies, set_remittance
+from ..models import Invoice, Product, RemittanceType, Remittance, SpecialTransactionProxy
 
 
 class InvoiceViewSet(ReadProtectedModelViewSet):
@@ -59,3 +66,49 @@ class RemittanceViewSet(ReadProtectedModelViewSet):
     filter_backends = [DjangoFilterBackend, SearchFilter]
     filterset_fields = ['date', 'remittance_type', 'comment', 'closed', 'transaction_proxies__transaction', ]
     search_fields = ['$remittance_type__note__special_type', '$comment', ]
+
+    def set_remittance(self, request, proxies, remittance):
+        """
+        Attach or detach the special transactions that are selected by the body of the request.
+        """
+        serializer = RemittanceTransactionsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        filters = dict(serializer.validated_data)
+
+        proxies = proxies.filter(PermissionBackend.filter_queryset(request, SpecialTransactionProxy, "view"))
+        if "ids" in filters:
+            proxies = proxies.filter(transaction_id__in=filters.pop("ids"))
+        proxies = filter_proxies(proxies, **filters)
+
+        try:
+            changed = set_remittance(request, proxies, remittance)
+        except ValidationError as e:
+            return Response({"detail": " ".join(e.messages)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # The totals are computed once, after all the changes
+        remittance = self.get_object()
+        amount, count = remittance.compute_totals()
+        return Response({
+            "count": len(changed),
+            "ids": [proxy.transaction_id for proxy in changed],
+            "remittance": {"id": remittance.pk, "amount": amount, "count": count},
+        })
+
+    @action(detail=True, methods=["post"])
+    def link(self, request, pk=None):
+        """
+        Attach several special transactions to the remittance, at once.
+        The transactions are given by the list "ids" of the body, or by the filters "remittance_type",
+        "since", "until", "min_amount" and "max_amount". Only the transactions of the type of the remittance
+        are attached.
+        """
+        return self.set_remittance(request, SpecialTransactionProxy.objects.all(), self.get_object())
+
+    @action(detail=True, methods=["post"])
+    def unlink(self, request, pk=None):
+        """
+        Detach several special transactions from the remittance, at once.
+        The transactions are selected as for the action link.
+        """
+        remittance = self.get_object()
+        return self.set_remittance(request, remittance.transaction_proxies.all(), None)
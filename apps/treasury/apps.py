@@ -1,9 +1,9 @@
 # Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from django.apps import AppConfig
+from django.apps import AppConfig, apps
 from django.db.models import Q
-from django.db.models.signals import post_save, post_migrate
+from django.db.models.signals import post_save, post_migrate, pre_delete, pre_save
 from django.utils.translation import gettext_lazy as _
 
 
@@ -17,10 +17,18 @@ class TreasuryConfig(AppConfig):
         """
 
         from . import signals
-        from note.models import SpecialTransaction, NoteSpecial
+        from note.bulk import pre_set_validity
+        from note.models import SpecialTransaction, NoteSpecial, Transaction
         from treasury.models import SpecialTransactionProxy
         post_save.connect(signals.save_special_transaction, sender=SpecialTransaction)
 
+        # Protect the transactions of the closed accounting periods, of any type
+        for model in apps.get_models():
+            if issubclass(model, Transaction):
+                pre_save.connect(signals.protect_closed_transaction, sender=model)
+                pre_delete.connect(signals.protect_closed_transaction, sender=model)
+        pre_set_validity.connect(signals.protect_closed_transactions)
+
         def setup_specialtransactions_proxies(**kwargs):
             # If the treasury app was disabled for any reason during a certain amount of time,
             # we ensure that each special transaction is linked to a proxy
@@ -0,0 +1,120 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Attach many special transactions to a remittance, or detach them, at once.
+
+At the end of a semester, the treasurers link hundreds of cheques, one form per transaction.
+Here the transactions are selected by filters, the type of the remittance is checked by the database,
+and all the proxies are updated with a single UPDATE. The permissions and the changelogs are handled
+as the signals would do.
+"""
+
+from copy import copy
+from datetime import datetime, time, timedelta
+
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from .models import Remittance, SpecialTransactionProxy
+
+
+def filter_proxies(queryset, remittance_type=None, since=None, until=None, min_amount=None, max_amount=None):
+    """
+    Filter special transaction proxies by the type, the date and the amount of their transactions.
+    :param queryset: The proxies to filter
+    :param remittance_type: Only keep the transactions of this type of remittance
+    :param since: Only keep the transactions that are created this day or later
+    :param until: Only keep the transactions that are created this day or before
+    :param min_amount: Minimal total of the transactions, in cents
+    :param max_amount: Maximal total of the transactions, in cents
+    """
+    if remittance_type is not None:
+        queryset = queryset.filter(transaction__source_id=remittance_type.note_id)
+    if since is not None:
+        queryset = queryset.filter(
+            transaction__created_at__gte=timezone.make_aware(datetime.combine(since, time.min)))
+    if until is not None:
+        queryset = queryset.filter(
+            transaction__created_at__lt=timezone.make_aware(datetime.combine(until + timedelta(days=1), time.min)))
+    if min_amount is not None:
+        queryset = queryset.filter(transaction__total__gte=min_amount)
+    if max_amount is not None:
+        queryset = queryset.filter(transaction__total__lte=max_amount)
+    return queryset
+
+
+def _check_permissions(request, proxies):
+    """
+    Check that the given request can change the remittance of the given proxies.
+    """
+    from permission.backends import PermissionBackend
+
+    changeable_fields = PermissionBackend.get_changeable_fields_batch(request, proxies, ["remittance"])
+    for proxy in proxies:
+        if "remittance" not in changeable_fields[proxy.pk]:
+            raise PermissionDenied(
+                _("You don't have the permission to change the field {field} on this instance of model"
+                  " {app_label}.{model_name}.")
+                .format(field="remittance", app_label=proxy._meta.app_label, model_name=proxy._meta.model_name, )
+            )
+
+
+@transaction.atomic
+def set_remittance(request, proxies, remittance):
+    """
+    Attach several special transactions to an open remittance, or detach them from their remittance.
+    The transactions that don't have the type of the remittance and the transactions
+    of closed remittances are left untouched.
+    :param request: The current request, or None if the modification is done in a shell
+    :param proxies: A queryset or a list of primary keys of special transaction proxies
+    :param remittance: The remittance to attach the transactions to, or None to detach them
+    :return: The list of the proxies that changed
+    """
+    from logs.signals import EXCLUDED as LOGS_EXCLUDED, get_actor, get_changelog
+    from logs.models import Changelog
+
+    if not isinstance(proxies, QuerySet):
+        proxies = SpecialTransactionProxy.objects.filter(pk__in=list(proxies))
+    queryset = SpecialTransactionProxy.objects.filter(pk__in=proxies.values("pk"))
+
+    if remittance is not None:
+        # Lock the remittance, that can't be closed meanwhile
+        remittance = Remittance.objects.select_for_update().get(pk=remittance.pk)
+        if remittance.closed:
+            raise ValidationError(_("Remittance is already closed."))
+        # The type of the transactions is checked by the database
+        queryset = queryset.filter(transaction__source_id=remittance.remittance_type.note_id)\
+            .exclude(remittance=remittance)
+    else:
+        queryset = queryset.exclude(remittance=None)
+    # The transactions of a closed remittance never move
+    queryset = queryset.filter(Q(remittance=None) | Q(remittance__in=Remittance.objects.filter(closed=False)))
+
+    previous = list(SpecialTransactionProxy.objects.filter(pk__in=queryset.values("pk"))
+                    .select_for_update().order_by("pk"))
+    if not previous:
+        return []
+
+    if request is not None:
+        _check_permissions(request, previous)
+
+    # One UPDATE for all the proxies
+    SpecialTransactionProxy.objects.filter(pk__in=[proxy.pk for proxy in previous]).update(remittance=remittance)
+
+    # Write the changelogs, as the signals would do
+    user, ip = get_actor(request)
+    changelogs = []
+    changed = []
+    for old in previous:
+        new = copy(old)
+        new.remittance = remittance
+        changed.append(new)
+        if old._meta.label_lower not in LOGS_EXCLUDED:
+            changelogs.append(get_changelog(new, old, user, ip))
+    Changelog.objects.bulk_create([changelog for changelog in changelogs if changelog is not None])
+
+    return changed
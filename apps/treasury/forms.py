@@ -7,7 +7,7 @@ from django import forms
 from django.contrib.auth.models import User
 from django.db import transaction
 from django.utils.translation import gettext_lazy as _
-from note_kfet.inputs import AmountInput, Autocomplete
+from note_kfet.inputs import AmountInput, Autocomplete, DatePickerInput
 
 from .models import Invoice, Product, Remittance, SpecialTransactionProxy
 
@@ -87,7 +87,7 @@ class RemittanceForm(forms.ModelForm):
         # the close button iff it is open and has a linked transaction
         if not self.instance.closed:
             self.helper.add_input(Submit('submit', _("Submit"), attr={'class': 'btn btn-block btn-primary'}))
-            if self.instance.transactions:
+            if self.instance.transactions.exists():
                 self.helper.add_input(Submit("close", _("Close"), css_class='btn btn-success'))
         else:
             # If the remittance is closed, we can't change anything
@@ -160,3 +160,28 @@ class LinkTransactionToRemittanceForm(forms.ModelForm):
         model = SpecialTransactionProxy
         fields = ('remittance', )
 
+
+class RemittanceTransactionsForm(forms.Form):
+    """
+    Select special transactions by their date and their amount, to attach them to a remittance
+    or to detach them, at once.
+    """
+    since = forms.DateField(label=_("Since"), widget=DatePickerInput(), required=False)
+
+    until = forms.DateField(label=_("Until"), widget=DatePickerInput(), required=False)
+
+    min_amount = forms.IntegerField(label=_("Minimal amount"), min_value=0, widget=AmountInput(), required=False)
+
+    max_amount = forms.IntegerField(label=_("Maximal amount"), min_value=0, widget=AmountInput(), required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.helper = FormHelper()
+        self.helper.add_input(Submit("link", _("Attach the transactions"), css_class='btn btn-primary'))
+        self.helper.add_input(Submit("unlink", _("Detach the transactions"), css_class='btn btn-danger'))
+
+    def get_filters(self):
+        """
+        :return: The filters of the form, to give to treasury.bulk.filter_proxies
+        """
+        return {name: value for name, value in self.cleaned_data.items() if value is not None}
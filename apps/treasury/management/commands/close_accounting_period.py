@@ -0,0 +1,65 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from datetime import date
+
+from django.core.exceptions import ValidationError
+from django.core.management import BaseCommand, CommandError
+
+from ...models import AccountingPeriod
+from ...periods import close_period, reopen_period, verify_period
+
+
+class Command(BaseCommand):
+    help = "Close an accounting period: the totals of each note are frozen and the transactions of the period " \
+           "can't be changed anymore. Example: ./manage.py close_accounting_period 2020-2021 " \
+           "--start 2020-09-01 --end 2021-08-31"
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', type=str, help="The name of the accounting period.")
+        parser.add_argument('--start', '-s', type=date.fromisoformat, default=None,
+                            help="The first day of the period (YYYY-MM-DD), to create it.")
+        parser.add_argument('--end', '-e', type=date.fromisoformat, default=None,
+                            help="The last day of the period (YYYY-MM-DD), to create it.")
+        parser.add_argument('--reopen', '-r', action='store_true',
+                            help="Forget the frozen totals of the period, whose transactions can be changed again.")
+        parser.add_argument('--verify', action='store_true',
+                            help="Check that the frozen totals of the period match its checksum "
+                                 "and its transactions.")
+
+    def handle(self, *args, **options):
+        period = AccountingPeriod.objects.filter(name=options["name"]).first()
+        if period is None:
+            if options["start"] is None or options["end"] is None:
+                raise CommandError("The period doesn't exist, give its first and last days to create it.")
+            period = AccountingPeriod(name=options["name"], start=options["start"], end=options["end"])
+            try:
+                period.clean()
+            except ValidationError as e:
+                raise CommandError(" ".join(e.messages))
+            period.save()
+
+        if options["verify"]:
+            if not period.closed:
+                raise CommandError("The period is not closed.")
+            intact, unchanged = verify_period(period)
+            if not intact:
+                raise CommandError("The frozen totals don't match the checksum.")
+            if not unchanged:
+                raise CommandError("The transactions of the period don't match the checksum.")
+            self.stdout.write(f"The totals of {period} are valid (checksum {period.checksum}).")
+            return
+
+        if options["reopen"]:
+            reopen_period(period)
+            if options["verbosity"] >= 1:
+                self.stdout.write(f"{period} is reopened.")
+            return
+
+        try:
+            count = close_period(period)
+        except ValidationError as e:
+            raise CommandError(" ".join(e.messages))
+        if options["verbosity"] >= 1:
+            period.refresh_from_db()
+            self.stdout.write(f"{period} is closed, {count} totals are stored (checksum {period.checksum}).")
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:23
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def freeze_closed_remittances(apps, schema_editor):
+    """
+    Store the totals of the remittances that are already closed.
+    """
+    Remittance = apps.get_model("treasury", "remittance")
+    for remittance in Remittance.objects.filter(closed=True).annotate(
+            amount=Sum("transaction_proxies__transaction__total"), count=Count("transaction_proxies")):
+        Remittance.objects.filter(pk=remittance.pk).update(closed_amount=remittance.amount or 0,
+                                                           closed_count=remittance.count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('note', '0004_transaction_total'),
+        ('treasury', '0002_auto_20220824_1919'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='remittance',
+            name='closed_amount',
+            field=models.BigIntegerField(editable=False, null=True, verbose_name='Closed amount'),
+        ),
+        migrations.AddField(
+            model_name='remittance',
+            name='closed_count',
+            field=models.PositiveIntegerField(editable=False, null=True, verbose_name='Closed transaction count'),
+        ),
+        migrations.RunPython(freeze_closed_remittances, migrations.RunPython.noop),
+    ]
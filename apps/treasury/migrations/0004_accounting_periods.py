@@ -0,0 +1,52 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('note', '0007_note_negative_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('treasury', '0003_remittance_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountingPeriod',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='name')),
+                ('start', models.DateField(verbose_name='start')),
+                ('end', models.DateField(help_text='The last day of the period is included.', verbose_name='end')),
+                ('closed_at', models.DateTimeField(blank=True, editable=False, null=True, verbose_name='closed at')),
+                ('checksum', models.CharField(blank=True, default='', editable=False, help_text='SHA-256 of the frozen totals.', max_length=64, verbose_name='checksum')),
+                ('closed_by', models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='closed by')),
+            ],
+            options={
+                'verbose_name': 'accounting period',
+                'verbose_name_plural': 'accounting periods',
+                'ordering': ('start',),
+            },
+        ),
+        migrations.CreateModel(
+            name='PeriodTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_type', models.CharField(choices=[('transfer', 'Transfer'), ('recurrent', 'Template'), ('membership', 'Membership'), ('special', 'Special'), ('guest', 'Guest')], max_length=31, verbose_name='transaction type')),
+                ('incoming', models.BigIntegerField(default=0, verbose_name='incoming total')),
+                ('outgoing', models.BigIntegerField(default=0, verbose_name='outgoing total')),
+                ('incoming_count', models.PositiveIntegerField(default=0, verbose_name='incoming transactions')),
+                ('outgoing_count', models.PositiveIntegerField(default=0, verbose_name='outgoing transactions')),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='note.note', verbose_name='note')),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='totals', to='treasury.accountingperiod', verbose_name='accounting period')),
+            ],
+            options={
+                'verbose_name': 'period total',
+                'verbose_name_plural': 'period totals',
+                'unique_together': {('period', 'note', 'transaction_type')},
+            },
+        ),
+    ]
@@ -8,12 +8,13 @@ from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.db import models, transaction
-from django.db.models import Q
+from django.db.models import Count, Q, Sum, Value
+from django.db.models.functions import Coalesce
 from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from member.models import Club, Membership
-from note.models import NoteSpecial, SpecialTransaction, MembershipTransaction, NoteUser
+from note.models import Note, NoteSpecial, SpecialTransaction, MembershipTransaction, NoteUser
 
 
 class Invoice(models.Model):
@@ -104,7 +105,24 @@ class Invoice(models.Model):
         # Fill the template with the information
         self.tex = render_to_string("treasury/invoice_sample.tex", dict(obj=self, products=products))
 
-        return super().save(*args, **kwargs)
+        ret = super().save(*args, **kwargs)
+
+        if self.locked:
+            # A locked invoice won't change anymore: it is rendered in advance
+            transaction.on_commit(self.schedule_render)
+
+        return ret
+
+    def schedule_render(self):
+        """
+        Queue the rendering of the PDF file of the invoice, see treasury.rendering.
+        """
+        from .rendering import RenderError, RenderQueueFullError, schedule_render
+        try:
+            schedule_render(self.tex)
+        except (RenderError, RenderQueueFullError):
+            # The invoice will be rendered when it is requested
+            pass
 
     class Meta:
         verbose_name = _("invoice")
@@ -180,6 +198,27 @@ class RemittanceType(models.Model):
         verbose_name_plural = _("remittance types")
 
 
+class RemittanceQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Annotate the remittances with the amount and the count of their transactions, computed by the database.
+        The totals of the closed remittances are read from their stored columns.
+        """
+        return self.annotate(
+            annotated_amount=Coalesce(
+                "closed_amount",
+                Sum("transaction_proxies__transaction__total"),
+                Value(0),
+                output_field=models.BigIntegerField(),
+            ),
+            annotated_count=Coalesce(
+                "closed_count",
+                Count("transaction_proxies"),
+                output_field=models.PositiveIntegerField(),
+            ),
+        )
+
+
 class Remittance(models.Model):
     """
     Treasurers want to regroup checks or bank transfers in bank remittances.
@@ -206,6 +245,21 @@ class Remittance(models.Model):
         verbose_name=_("Closed"),
     )
 
+    # The totals are frozen when the remittance is closed, since its transactions can't change anymore
+    closed_amount = models.BigIntegerField(
+        null=True,
+        editable=False,
+        verbose_name=_("Closed amount"),
+    )
+
+    closed_count = models.PositiveIntegerField(
+        null=True,
+        editable=False,
+        verbose_name=_("Closed transaction count"),
+    )
+
+    objects = RemittanceQuerySet.as_manager()
+
     class Meta:
         verbose_name = _("remittance")
         verbose_name_plural = _("remittances")
@@ -219,25 +273,53 @@ class Remittance(models.Model):
             return SpecialTransaction.objects.none()
         return SpecialTransaction.objects.filter(specialtransactionproxy__remittance=self)
 
+    def compute_totals(self):
+        """
+        Compute the amount and the count of the linked transactions with one query.
+        """
+        if not self.pk:
+            return 0, 0
+        totals = SpecialTransactionProxy.objects.filter(remittance=self).aggregate(
+            amount=Coalesce(Sum("transaction__total"), Value(0), output_field=models.BigIntegerField()),
+            count=Count("pk"),
+        )
+        return totals["amount"], totals["count"]
+
     def count(self):
         """
         Linked transactions count.
         """
-        return self.transactions.count()
+        if self.closed and self.closed_count is not None:
+            return self.closed_count
+        if hasattr(self, "annotated_count"):
+            return self.annotated_count
+        return self.compute_totals()[1]
 
     @property
     def amount(self):
         """
         Total amount of the remittance.
         """
-        return sum(transaction.total for transaction in self.transactions.all())
+        if self.closed and self.closed_amount is not None:
+            return self.closed_amount
+        if hasattr(self, "annotated_amount"):
+            return self.annotated_amount
+        return self.compute_totals()[0]
 
     @transaction.atomic
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
         # Check if all transactions have the right type.
-        if self.transactions.exists() and self.transactions.filter(~Q(source=self.remittance_type.note)).exists():
+        if self.pk and self.transactions.filter(~Q(source=self.remittance_type.note)).exists():
             raise ValidationError("All transactions in a remittance must have the same type")
 
+        # Freeze the totals when the remittance is closed
+        if self.closed and self.closed_amount is None:
+            self.closed_amount, self.closed_count = self.compute_totals()
+            if update_fields is not None:
+                update_fields = set(update_fields) | {"closed_amount", "closed_count"}
+        elif not self.closed:
+            self.closed_amount = self.closed_count = None
+
         return super().save(force_insert, force_update, using, update_fields)
 
     def __str__(self):
@@ -270,3 +352,131 @@ class SpecialTransactionProxy(models.Model):
 
     def __str__(self):
         return str(self.transaction)
+
+
+class AccountingPeriod(models.Model):
+    """
+    A range of days whose accounts can be closed. When a period is closed, the totals of each note are frozen,
+    and the transactions of the period can't be changed anymore.
+    """
+
+    name = models.CharField(
+        max_length=255,
+        verbose_name=_("name"),
+    )
+
+    start = models.DateField(
+        verbose_name=_("start"),
+    )
+
+    end = models.DateField(
+        verbose_name=_("end"),
+        help_text=_("The last day of the period is included."),
+    )
+
+    closed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name=_("closed at"),
+    )
+
+    closed_by = models.ForeignKey(
+        User,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+        verbose_name=_("closed by"),
+    )
+
+    checksum = models.CharField(
+        max_length=64,
+        blank=True,
+        default="",
+        editable=False,
+        verbose_name=_("checksum"),
+        help_text=_("SHA-256 of the frozen totals."),
+    )
+
+    class Meta:
+        verbose_name = _("accounting period")
+        verbose_name_plural = _("accounting periods")
+        ordering = ('start', )
+
+    @property
+    def closed(self):
+        return self.closed_at is not None
+
+    def clean(self):
+        if self.start and self.end:
+            if self.start > self.end:
+                raise ValidationError(_("The end of the period must be after its start."))
+            if AccountingPeriod.objects.filter(start__lte=self.end, end__gte=self.start).exclude(pk=self.pk).exists():
+                raise ValidationError(_("This period overlaps another accounting period."))
+
+    def __str__(self):
+        return self.name
+
+
+class PeriodTotal(models.Model):
+    """
+    Frozen totals of the valid transactions of a note during a closed accounting period, for one type of transaction.
+    """
+
+    TYPES = [
+        ("transfer", _("Transfer")),
+        ("recurrent", _("Template")),
+        ("membership", _("Membership")),
+        ("special", _("Special")),
+        ("guest", _("Guest")),
+    ]
+
+    period = models.ForeignKey(
+        AccountingPeriod,
+        on_delete=models.CASCADE,
+        related_name="totals",
+        verbose_name=_("accounting period"),
+    )
+
+    note = models.ForeignKey(
+        Note,
+        on_delete=models.PROTECT,
+        related_name="+",
+        verbose_name=_("note"),
+    )
+
+    transaction_type = models.CharField(
+        max_length=31,
+        choices=TYPES,
+        verbose_name=_("transaction type"),
+    )
+
+    incoming = models.BigIntegerField(
+        default=0,
+        verbose_name=_("incoming total"),
+    )
+
+    outgoing = models.BigIntegerField(
+        default=0,
+        verbose_name=_("outgoing total"),
+    )
+
+    incoming_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("incoming transactions"),
+    )
+
+    outgoing_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("outgoing transactions"),
+    )
+
+    class Meta:
+        verbose_name = _("period total")
+        verbose_name_plural = _("period totals")
+        unique_together = ('period', 'note', 'transaction_type', )
+
+    def __str__(self):
+        return f"{self.period} - {self.note} ({self.transaction_type})"
@@ -0,0 +1,253 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Close the accounts of an accounting period.
+
+Closing a period computes the incoming and outgoing totals of each note, by type of transaction,
+with one grouped query over the transactions and the archived transactions, and stores them in PeriodTotal
+with a checksum. The transactions of a closed period can't be created, changed or deleted anymore.
+Reports read the frozen totals of the closed periods, and only compute the totals of the other days.
+"""
+
+import hashlib
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum, Value
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from note.models import ArchivedTransaction, Transaction
+
+from .models import AccountingPeriod, PeriodTotal
+
+CLOSED_PERIODS_KEY = "treasury_closed_periods"
+
+# Type of the totals of each kind of transaction, by model
+TRANSACTION_TYPES = {
+    "transaction": "transfer",
+    "recurrenttransaction": "recurrent",
+    "membershiptransaction": "membership",
+    "specialtransaction": "special",
+    "guesttransaction": "guest",
+}
+
+FIELDS = ("incoming", "outgoing", "incoming_count", "outgoing_count")
+
+
+def _start_of(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _date_query(ranges):
+    """
+    Build the query that selects the transactions created during the given ranges of days.
+    A bound that is None is not bounded.
+    """
+    query = Q(pk__in=[])
+    for start, end in ranges:
+        range_query = Q()
+        if start is not None:
+            range_query &= Q(created_at__gte=_start_of(start))
+        if end is not None:
+            range_query &= Q(created_at__lt=_start_of(end + timedelta(days=1)))
+        if not range_query:
+            # The whole history
+            return Q()
+        query |= range_query
+    return query
+
+
+def compute_totals(ranges, notes=None):
+    """
+    Compute the totals of the valid transactions of each note during the given ranges of days,
+    including the archived transactions, with one query.
+    :param ranges: A list of couples (first day, last day), the bounds can be None
+    :param notes: Only compute the totals of these notes
+    :return: A dictionary {(note_id, transaction type): {"incoming": …, "outgoing": …, …}}
+    """
+    from django.contrib.contenttypes.models import ContentType
+
+    totals = defaultdict(lambda: dict.fromkeys(FIELDS, 0))
+    if not ranges:
+        return totals
+
+    query = _date_query(ranges) & Q(valid=True)
+    querysets = []
+    for model in (Transaction, ArchivedTransaction):
+        queryset = model._base_manager.filter(query).exclude(source_id=F("destination_id")).order_by()
+        for field, direction in (("source_id", "outgoing"), ("destination_id", "incoming")):
+            grouped = queryset
+            if notes is not None:
+                grouped = grouped.filter(**{field + "__in": notes})
+            querysets.append(
+                grouped.values(field, "polymorphic_ctype_id")
+                .annotate(direction=Value(direction), amount=Sum("total"), count=Count("pk"))
+                .values_list(field, "polymorphic_ctype_id", "direction", "amount", "count")
+            )
+
+    # All the groups are computed in the same query
+    models = {}
+    for note_id, ctype_id, direction, amount, count in querysets[0].union(*querysets[1:], all=True):
+        if ctype_id not in models:
+            models[ctype_id] = ContentType.objects.get_for_id(ctype_id).model
+        key = (note_id, TRANSACTION_TYPES.get(models[ctype_id], models[ctype_id]))
+        totals[key][direction] += amount
+        totals[key][direction + "_count"] += count
+    return totals
+
+
+def get_checksum(period, totals):
+    """
+    Compute the checksum of the totals of an accounting period.
+    """
+    lines = [f"{period.start.isoformat()}:{period.end.isoformat()}"]
+    for (note_id, transaction_type), values in sorted(totals.items()):
+        lines.append(f"{note_id}:{transaction_type}:" + ":".join(str(values[field]) for field in FIELDS))
+    return hashlib.sha256("\n".join(lines).encode("UTF-8")).hexdigest()
+
+
+def get_frozen_totals(periods, notes=None):
+    """
+    Read the frozen totals of the given closed periods, summed, with one query.
+    """
+    totals = defaultdict(lambda: dict.fromkeys(FIELDS, 0))
+    queryset = PeriodTotal.objects.filter(period__in=periods)
+    if notes is not None:
+        queryset = queryset.filter(note__in=notes)
+    for row in queryset.order_by().values("note_id", "transaction_type")\
+            .annotate(**{field + "_sum": Sum(field) for field in FIELDS}):
+        for field in FIELDS:
+            totals[(row["note_id"], row["transaction_type"])][field] += row[field + "_sum"]
+    return totals
+
+
+def get_closed_periods():
+    """
+    Return the list of the couples (first day, last day) of the closed periods.
+    The list is cached until a period is closed or reopened.
+    """
+    periods = cache.get(CLOSED_PERIODS_KEY)
+    if periods is None:
+        periods = list(AccountingPeriod.objects.filter(closed_at__isnull=False).values_list("start", "end"))
+        cache.set(CLOSED_PERIODS_KEY, periods, None)
+    return periods
+
+
+def clear_closed_periods_cache(**_kwargs):
+    cache.delete(CLOSED_PERIODS_KEY)
+
+
+def get_closed_period_query():
+    """
+    Build the query that selects the transactions of the closed periods.
+    """
+    return _date_query(get_closed_periods())
+
+
+def check_not_closed(created_at):
+    """
+    Refuse to change a transaction that was created during a closed accounting period.
+    :raise ValidationError: if the given date belongs to a closed period
+    """
+    if created_at is None:
+        return
+    day = timezone.localdate(created_at) if timezone.is_aware(created_at) else created_at.date()
+    for start, end in get_closed_periods():
+        if start <= day <= end:
+            raise ValidationError(_("This transaction belongs to a closed accounting period, "
+                                    "it can't be changed anymore."))
+
+
+@transaction.atomic
+def close_period(period, user=None):
+    """
+    Freeze the totals of each note during the given accounting period and forbid changes on its transactions.
+    :return: The number of stored totals
+    """
+    period = AccountingPeriod.objects.select_for_update().get(pk=period.pk)
+    if period.closed:
+        raise ValidationError(_("This accounting period is already closed."))
+    period.clean()
+
+    totals = compute_totals([(period.start, period.end)])
+    PeriodTotal.objects.bulk_create([
+        PeriodTotal(period=period, note_id=note_id, transaction_type=transaction_type, **values)
+        for (note_id, transaction_type), values in totals.items()
+    ])
+    period.checksum = get_checksum(period, totals)
+    period.closed_at = timezone.now()
+    period.closed_by = user
+    period.save()
+
+    clear_closed_periods_cache()
+    transaction.on_commit(clear_closed_periods_cache)
+    return len(totals)
+
+
+@transaction.atomic
+def reopen_period(period):
+    """
+    Forget the frozen totals of an accounting period, whose transactions can be changed again.
+    """
+    PeriodTotal.objects.filter(period=period).delete()
+    period.checksum = ""
+    period.closed_at = None
+    period.closed_by = None
+    period.save()
+
+    clear_closed_periods_cache()
+    transaction.on_commit(clear_closed_periods_cache)
+
+
+def verify_period(period):
+    """
+    Check that the frozen totals of a closed period still match its checksum and its transactions.
+    :return: A couple of booleans (the frozen totals are intact, the transactions still give the same totals)
+    """
+    frozen = get_frozen_totals([period])
+    computed = compute_totals([(period.start, period.end)])
+    return get_checksum(period, frozen) == period.checksum, get_checksum(period, computed) == period.checksum
+
+
+def get_totals(since=None, until=None, notes=None):
+    """
+    Compute the totals of each note between two days, the bounds are included and can be None.
+    The frozen totals of the closed periods that are inside the range are read,
+    and only the other days are computed from the transactions. It costs three queries.
+    :return: A dictionary {(note_id, transaction type): {"incoming": …, "outgoing": …, …}}
+    """
+    periods = AccountingPeriod.objects.filter(closed_at__isnull=False)
+    if since is not None:
+        periods = periods.filter(start__gte=since)
+    if until is not None:
+        periods = periods.filter(end__lte=until)
+    periods = list(periods.order_by("start"))
+
+    # The days that are not covered by a closed period
+    ranges = []
+    cursor = since
+    for period in periods:
+        if cursor is None or cursor < period.start:
+            ranges.append((cursor, period.start - timedelta(days=1)))
+        cursor = period.end + timedelta(days=1)
+    if cursor is None or until is None or cursor <= until:
+        ranges.append((cursor, until))
+
+    totals = get_frozen_totals(periods, notes) if periods else defaultdict(lambda: dict.fromkeys(FIELDS, 0))
+    for key, values in compute_totals(ranges, notes).items():
+        for field in FIELDS:
+            totals[key][field] += values[field]
+    return totals
+
+
+def get_club_totals(club, since=None, until=None):
+    """
+    Compute the totals of the note of a club between two days, by type of transaction.
+    :return: A dictionary {transaction type: {"incoming": …, "outgoing": …, …}}
+    """
+    return {transaction_type: values
+            for (_note_id, transaction_type), values in get_totals(since, until, [club.note.pk]).items()}
@@ -0,0 +1,165 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+Render the invoices as PDF files.
+
+Running XeLaTeX takes seconds, then it is never done in a request. The PDF files are stored in a cache
+that is addressed by the SHA-256 of the tex source: an invoice is rendered again only when its source changes.
+Renderings are background jobs, run by `./manage.py run_jobs` (see jobs.queue), and an invoice is rendered
+in advance when it is locked. The pending renderings are the pending jobs, and the errors are stored next to
+the PDF files, then they are shared by all the processes of the server.
+
+The settings are INVOICE_CACHE_DIR, INVOICE_XELATEX (the binary, that can be replaced by a stub in tests),
+INVOICE_RENDER_ASYNC (False to render in the current request) and INVOICE_RENDER_QUEUE_SIZE.
+"""
+
+import hashlib
+import os
+import shutil
+import subprocess
+from tempfile import mkdtemp
+
+from django.conf import settings
+from jobs.models import Job
+from jobs.queue import enqueue
+
+from .tasks import render_invoice
+
+
+class RenderError(IOError):
+    """
+    XeLaTeX failed to render an invoice.
+    """
+
+
+class RenderQueueFullError(Exception):
+    """
+    Too many invoices are waiting to be rendered.
+    """
+
+
+def get_digest(tex):
+    return hashlib.sha256(tex.encode("UTF-8")).hexdigest()
+
+
+def get_cache_path(digest):
+    """
+    Return the path of the PDF file of the given digest. The files are spread in subdirectories.
+    """
+    return os.path.join(settings.INVOICE_CACHE_DIR, digest[:2], digest + ".pdf")
+
+
+def get_cached_pdf(tex):
+    """
+    Return the path of the rendered PDF file of the given tex source, or None if it is not rendered yet.
+    """
+    path = get_cache_path(get_digest(tex))
+    return path if os.path.exists(path) else None
+
+
+def render(tex):
+    """
+    Render a tex source with XeLaTeX and store the PDF file in the cache.
+    :return: The path of the PDF file
+    :raise RenderError: if XeLaTeX fails
+    """
+    digest = get_digest(tex)
+    path = get_cache_path(digest)
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # We render the file in a temporary directory
+    tmp_dir = mkdtemp(prefix="invoice-", dir=settings.INVOICE_CACHE_DIR)
+    try:
+        with open(os.path.join(tmp_dir, "invoice.tex"), "wb") as f:
+            f.write(tex.encode("UTF-8"))
+
+        # The file has to be rendered twice
+        for _ignored in range(2):
+            error = subprocess.run(
+                [settings.INVOICE_XELATEX, "-interaction=nonstopmode", "invoice.tex"],
+                cwd=tmp_dir,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            ).returncode
+
+            if error:
+                log = ""
+                if os.path.exists(os.path.join(tmp_dir, "invoice.log")):
+                    with open(os.path.join(tmp_dir, "invoice.log"), "r", errors="replace") as f:
+                        log = f.read()
+                raise RenderError("An error attempted while generating a invoice (code=" + str(error) + ")\n\n" + log)
+
+        # The file appears atomically, even if several processes render the same invoice
+        os.replace(os.path.join(tmp_dir, "invoice.pdf"), path)
+    finally:
+        # Delete all temporary files
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return path
+
+
+def get_error_path(digest):
+    """
+    Return the path of the file that holds the error of the last rendering of the given digest.
+    """
+    return os.path.join(settings.INVOICE_CACHE_DIR, digest[:2], digest + ".err")
+
+
+def render_or_save_error(tex):
+    """
+    Render a tex source, and keep the error to report it to the user who is waiting for the invoice.
+    :raise RenderError: if XeLaTeX fails
+    """
+    try:
+        return render(tex)
+    except RenderError as e:
+        with open(get_error_path(get_digest(tex)), "w") as f:
+            f.write(str(e))
+        raise
+
+
+def _get_pending_jobs():
+    return Job.objects.filter(name=f"{render_invoice.__module__}.{render_invoice.__qualname__}",
+                              status__in=[Job.PENDING, Job.RUNNING])
+
+
+def schedule_render(tex):
+    """
+    Queue the rendering of a tex source, unless it is already rendered or queued.
+    When INVOICE_RENDER_ASYNC is False, the source is rendered immediately.
+    :return: The path of the PDF file if it is rendered, else None
+    :raise RenderError: if the source is rendered immediately and XeLaTeX fails
+    :raise RenderQueueFullError: if INVOICE_RENDER_QUEUE_SIZE renderings are already waiting
+    """
+    digest = get_digest(tex)
+    path = get_cache_path(digest)
+    if os.path.exists(path):
+        return path
+
+    if not settings.INVOICE_RENDER_ASYNC:
+        return render(tex)
+
+    pending = _get_pending_jobs()
+    if pending.filter(kwargs__digest=digest).exists():
+        return None
+    if pending.count() >= settings.INVOICE_RENDER_QUEUE_SIZE:
+        raise RenderQueueFullError()
+    # Someone is waiting for the invoice. XeLaTeX fails again with the same source, then the job is not retried.
+    enqueue(render_invoice, kwargs=dict(digest=digest, tex=tex), priority=10, max_attempts=1)
+    return None
+
+
+def pop_error(tex):
+    """
+    Return the error of the last rendering of a tex source, if it failed, and forget it to allow a new try.
+    """
+    try:
+        with open(get_error_path(get_digest(tex))) as f:
+            error = RenderError(f.read())
+        os.remove(get_error_path(get_digest(tex)))
+    except FileNotFoundError:
+        return None
+    return error
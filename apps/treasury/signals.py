@@ -15,3 +15,40 @@ def save_special_transaction(instance, created, **kwargs):
             proxy = SpecialTransactionProxy(transaction=instance, remittance=None)
             proxy._force_save = True
             proxy.save()
+
+
+def protect_closed_transaction(instance, raw=False, signal=None, **_kwargs):
+    """
+    The transactions of a closed accounting period can't be created, changed or deleted.
+    The stored date is also checked, then a transaction can't be moved out of a closed period.
+    """
+    from django.db.models.signals import pre_save
+    from note.models import Transaction
+    from .periods import check_not_closed, get_closed_periods
+
+    if raw or hasattr(instance, "_no_signal"):
+        return
+    check_not_closed(instance.created_at)
+
+    if instance.pk is None or not get_closed_periods():
+        return
+    # When saved, the stored transaction was already locked and read by Transaction.validate
+    old_transaction = getattr(instance, "_old_transaction", None) if signal is pre_save else None
+    if old_transaction is not None and old_transaction.pk == instance.pk:
+        created_at = old_transaction.created_at
+    else:
+        created_at = Transaction.objects.filter(pk=instance.pk).values_list("created_at", flat=True).first()
+    check_not_closed(created_at)
+
+
+def protect_closed_transactions(queryset, **_kwargs):
+    """
+    The validity of the transactions of a closed accounting period can't be changed in bulk.
+    """
+    from django.core.exceptions import ValidationError
+    from django.utils.translation import gettext_lazy as _
+    from .periods import get_closed_period_query
+
+    if queryset.filter(get_closed_period_query()).exists():
+        raise ValidationError(_("This transaction belongs to a closed accounting period, "
+                                "it can't be changed anymore."))
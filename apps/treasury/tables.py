@@ -2,6 +2,7 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import django_tables2 as tables
+from django.db.models import QuerySet
 from django.utils.translation import gettext_lazy as _
 from django_tables2 import A
 from note.models import SpecialTransaction
@@ -62,9 +63,10 @@ class RemittanceTable(tables.Table):
     List all remittances.
     """
 
-    count = tables.Column(verbose_name=_("Transaction count"))
+    # The totals are annotated by Remittance.objects.with_totals()
+    count = tables.Column(verbose_name=_("Transaction count"), order_by="annotated_count")
 
-    amount = tables.Column(verbose_name=_("Amount"))
+    amount = tables.Column(verbose_name=_("Amount"), order_by="annotated_amount")
 
     view = tables.LinkColumn("treasury:remittance_update",
                              verbose_name=_("View"),
@@ -109,6 +111,38 @@ class SpecialTransactionTable(tables.Table):
                                               'a': {'class': 'btn btn-primary btn-danger'}
                                           }, )
 
+    def __init__(self, data=None, *args, **kwargs):
+        # The notes are rendered with their names, they are fetched with the transactions whatever the caller
+        if isinstance(data, QuerySet):
+            data = self.select_related(data)
+        super().__init__(data, *args, **kwargs)
+
+    @staticmethod
+    def select_related(queryset):
+        """
+        Fetch the notes and the proxies of the transactions with the transactions, in the same query.
+        """
+        return queryset.select_related(
+            "specialtransactionproxy",
+            "source__noteuser__user", "source__noteclub__club", "source__notespecial",
+            "destination__noteuser__user", "destination__noteclub__club", "destination__notespecial",
+        )
+
+    @staticmethod
+    def render_note(note):
+        # The notes that are fetched by select_related are not polymorphic
+        for child in ("noteuser", "noteclub", "notespecial"):
+            child_note = getattr(note, child, None)
+            if child_note is not None:
+                return str(child_note)
+        return str(note)
+
+    def render_source(self, value):
+        return self.render_note(value)
+
+    def render_destination(self, value):
+        return self.render_note(value)
+
     def render_amount(self, value):
         return pretty_money(value)
 
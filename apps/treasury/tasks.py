@@ -0,0 +1,14 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from jobs.queue import task
+
+
+@task
+def render_invoice(digest, tex):
+    """
+    Render the PDF file of an invoice in the cache, see treasury.rendering.
+    The digest of the source identifies the pending renderings.
+    """
+    from .rendering import render_or_save_error
+    render_or_save_error(tex)
@@ -0,0 +1,160 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from datetime import date, timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase
+from django.utils import timezone
+from member.models import Club
+from note.archive import archive_transactions
+from note.bulk import set_transactions_validity
+from note.models import NoteSpecial, NoteUser, RecurrentTransaction, SpecialTransaction, TemplateCategory, \
+    Transaction, TransactionTemplate
+
+from ..models import AccountingPeriod, PeriodTotal
+from ..periods import close_period, get_club_totals, get_totals, reopen_period, verify_period
+
+
+class TestAccountingPeriods(TestCase):
+    """
+    The totals of a closed accounting period are frozen, and its transactions can't change.
+    """
+    fixtures = ('initial', )
+
+    def setUp(self):
+        self.user = User.objects.create(username="toto", email="toto@example.com")
+        NoteUser.objects.create(user=self.user)
+        self.club = Club.objects.get(name="BDE")
+        self.template = TransactionTemplate.objects.create(
+            name="Coca",
+            destination=self.club.note,
+            amount=100,
+            category=TemplateCategory.objects.create(name="Period test"),
+        )
+
+        self.last_month = timezone.now() - timedelta(days=30)
+        self.credit = self.create(SpecialTransaction, source=NoteSpecial.objects.get(special_type="Espèces"),
+                                  destination=self.user.note, amount=5000, reason="Credit",
+                                  last_name="Toto", first_name="Toto")
+        self.sale = self.create(RecurrentTransaction, source=self.user.note, destination=self.club.note,
+                                template=self.template, amount=100, quantity=3, reason="Coca")
+        self.transfer = self.create(Transaction, source=self.club.note, destination=self.user.note,
+                                    amount=150, reason="Refund")
+        self.invalid = self.create(Transaction, source=self.user.note, destination=self.club.note,
+                                   amount=10000, reason="Cancelled", valid=False)
+        self.recent = Transaction.objects.create(source=self.user.note, destination=self.club.note,
+                                                 amount=200, reason="Recent")
+
+        self.period = AccountingPeriod.objects.create(
+            name="Last month",
+            start=timezone.localdate(self.last_month) - timedelta(days=5),
+            end=timezone.localdate(self.last_month) + timedelta(days=5),
+        )
+
+    def create(self, model, **kwargs):
+        return model.objects.create(created_at=self.last_month, **kwargs)
+
+    def test_close(self):
+        """
+        The totals are computed by note and by type, and the checksum can be verified.
+        """
+        self.assertEqual(close_period(self.period), 6)
+        self.period.refresh_from_db()
+        self.assertTrue(self.period.closed)
+        self.assertEqual(len(self.period.checksum), 64)
+
+        user_sales = PeriodTotal.objects.get(period=self.period, note=self.user.note, transaction_type="recurrent")
+        self.assertEqual((user_sales.outgoing, user_sales.outgoing_count, user_sales.incoming), (300, 1, 0))
+        club_totals = get_club_totals(self.club, self.period.start, self.period.end)
+        self.assertEqual(club_totals["recurrent"]["incoming"], 300)
+        self.assertEqual(club_totals["transfer"]["outgoing"], 150)
+        # Invalid transactions are not counted
+        self.assertEqual(club_totals["transfer"]["incoming"], 0)
+        self.assertEqual(verify_period(self.period), (True, True))
+
+        # The frozen totals are checked
+        PeriodTotal.objects.filter(pk=user_sales.pk).update(outgoing=1)
+        self.assertEqual(verify_period(self.period), (False, True))
+
+        self.assertRaises(ValidationError, close_period, self.period)
+
+    def test_closed_transactions(self):
+        """
+        The transactions of a closed period can't be created, changed or deleted.
+        """
+        close_period(self.period)
+
+        self.transfer.valid = False
+        self.assertRaises(ValidationError, self.transfer.save)
+        with transaction.atomic():
+            self.assertRaises(ValidationError, self.transfer.delete)
+        self.assertRaises(ValidationError, self.create, Transaction, source=self.user.note,
+                          destination=self.club.note, amount=100, reason="Late")
+        self.assertRaises(ValidationError, set_transactions_validity, None, [self.sale.pk], False)
+        self.assertRaises(ValidationError, set_transactions_validity, None, [self.invalid.pk], True)
+
+        # A transaction can't be moved out of the closed period
+        self.transfer.refresh_from_db()
+        self.transfer.created_at = timezone.now()
+        self.assertRaises(ValidationError, self.transfer.save)
+        self.sale.created_at = timezone.now()
+        self.assertRaises(ValidationError, self.sale.save)
+        with transaction.atomic():
+            self.assertRaises(ValidationError, self.sale.delete)
+        self.transfer.refresh_from_db()
+        self.assertEqual(self.transfer.created_at, self.last_month)
+
+        # Other transactions are not concerned
+        self.recent.valid = False
+        self.recent.save()
+        set_transactions_validity(None, [self.recent.pk], True)
+
+        reopen_period(self.period)
+        self.assertFalse(PeriodTotal.objects.exists())
+        self.transfer.save()
+
+    def test_totals(self):
+        """
+        The reports read the frozen totals of the closed periods and compute the other days.
+        """
+        before = get_totals()
+        close_period(self.period)
+        # The frozen totals are read, even if the transactions are archived
+        archive_transactions(timezone.localdate() - timedelta(days=1))
+
+        with self.assertNumQueries(3):
+            totals = get_totals()
+        self.assertEqual(totals, before)
+        self.assertEqual(totals[(self.user.note.pk, "transfer")]["outgoing"], 200)
+        self.assertEqual(totals[(self.user.note.pk, "special")]["incoming"], 5000)
+
+        totals = get_totals(since=self.period.end + timedelta(days=1))
+        self.assertEqual(totals[(self.user.note.pk, "transfer")],
+                         dict(incoming=0, outgoing=200, incoming_count=0, outgoing_count=1))
+        self.assertNotIn((self.user.note.pk, "special"), totals)
+
+    def test_overlap(self):
+        """
+        Accounting periods can't overlap.
+        """
+        period = AccountingPeriod(name="Overlap", start=self.period.end, end=self.period.end + timedelta(days=10))
+        self.assertRaises(ValidationError, period.clean)
+        period = AccountingPeriod(name="Reversed", start=date(2020, 2, 1), end=date(2020, 1, 1))
+        self.assertRaises(ValidationError, period.clean)
+
+    def test_command(self):
+        """
+        Close and verify a period with the command.
+        """
+        out = StringIO()
+        call_command("close_accounting_period", "Old", start=date(2020, 1, 1), end=date(2020, 12, 31), stdout=out)
+        self.assertTrue(AccountingPeriod.objects.get(name="Old").closed)
+        call_command("close_accounting_period", "Old", verify=True, stdout=out)
+        self.assertIn("valid", out.getvalue())
+        call_command("close_accounting_period", "Old", reopen=True, stdout=out)
+        self.assertFalse(AccountingPeriod.objects.get(name="Old").closed)
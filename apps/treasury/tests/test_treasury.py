@@ -1,17 +1,51 @@
 # Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import os
+import sys
+from datetime import date, timedelta
+from tempfile import TemporaryDirectory
+
 from api.tests import TestAPI
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.db.models import Q
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from jobs.models import Job
+from jobs.queue import claim_job, run_job
 from member.models import Membership, Club
 from note.models import SpecialTransaction, NoteSpecial, Transaction
 
 from ..api.views import InvoiceViewSet, ProductViewSet, RemittanceViewSet, RemittanceTypeViewSet
-from ..models import Invoice, Product, Remittance, RemittanceType
+from ..bulk import filter_proxies, set_remittance
+from ..models import Invoice, Product, Remittance, RemittanceType, SpecialTransactionProxy
+from ..rendering import RenderError, RenderQueueFullError, get_cached_pdf, get_digest, schedule_render
+from ..tables import SpecialTransactionTable
+
+
+def make_xelatex_stub(directory, fail=False):
+    """
+    Write a fake XeLaTeX binary, that writes a fake PDF file or fails, and count its calls.
+    """
+    path = os.path.join(directory, "xelatex")
+    with open(path, "w") as f:
+        f.write(f"""#!{sys.executable}
+import sys
+with open({os.path.join(directory, "calls")!r}, "a") as f:
+    f.write("call\\n")
+if {fail!r}:
+    with open("invoice.log", "w") as f:
+        f.write("Undefined control sequence")
+    sys.exit(1)
+with open(sys.argv[-1][:-4] + ".pdf", "w") as f:
+    f.write("%PDF-1.4 " + open(sys.argv[-1]).read()[:100])
+""")
+    os.chmod(path, 0o755)
+    return path
 
 
 class TestInvoices(TestCase):
@@ -149,7 +183,10 @@ class TestInvoices(TestCase):
         """
         Generate the PDF file of an invoice.
         """
-        response = self.client.get(reverse("treasury:invoice_render", args=(self.invoice.id,)))
+        with TemporaryDirectory() as tmp_dir, \
+                self.settings(INVOICE_XELATEX=make_xelatex_stub(tmp_dir), INVOICE_CACHE_DIR=tmp_dir,
+                              INVOICE_RENDER_ASYNC=False):
+            response = self.client.get(reverse("treasury:invoice_render", args=(self.invoice.id,)))
         self.assertEqual(response.status_code, 200)
 
     def test_invoice_api(self):
@@ -162,6 +199,151 @@ class TestInvoices(TestCase):
         self.assertEqual(response.status_code, 200)
 
 
+class TestInvoiceRendering(TestCase):
+    """
+    The PDF files of the invoices are rendered by background jobs and cached.
+    """
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            username="admintoto",
+            password="totototo",
+            email="admin@example.com",
+        )
+        self.client.force_login(self.user)
+        sess = self.client.session
+        sess["permission_mask"] = 42
+        sess.save()
+
+        self.invoice = Invoice.objects.create(
+            id=1,
+            object="Object",
+            description="Description",
+            name="Me",
+            address="Earth",
+            acquitted=False,
+        )
+
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+        settings = self.settings(INVOICE_XELATEX=make_xelatex_stub(self.tmp_dir),
+                                 INVOICE_CACHE_DIR=os.path.join(self.tmp_dir, "cache"), INVOICE_RENDER_ASYNC=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.url = reverse("treasury:invoice_render", args=(self.invoice.id,))
+
+    def count_calls(self):
+        if not os.path.exists(os.path.join(self.tmp_dir, "calls")):
+            return 0
+        with open(os.path.join(self.tmp_dir, "calls")) as f:
+            return len(f.readlines())
+
+    def get(self):
+        # The rendering is queued once the request is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.get(self.url)
+
+    def run_jobs(self):
+        job = claim_job()
+        while job is not None:
+            run_job(job)
+            job = claim_job()
+
+    def render(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule_render(self.invoice.tex)
+        self.run_jobs()
+        return get_cached_pdf(self.invoice.tex)
+
+    def test_background_rendering(self):
+        """
+        The first request is answered while the invoice is rendered, then the cached file is served.
+        """
+        response = self.get()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response["Location"], self.url)
+        # The pending rendering is found by any process
+        self.assertEqual(self.get().status_code, 202)
+        self.assertEqual(Job.objects.count(), 1)
+        self.run_jobs()
+        # XeLaTeX runs twice
+        self.assertEqual(self.count_calls(), 2)
+
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertTrue(response.content.startswith(b"%PDF"))
+        self.assertEqual(response["ETag"], '"{}"'.format(get_digest(self.invoice.tex)))
+        self.assertEqual(self.count_calls(), 2)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_queue_full(self):
+        with self.settings(INVOICE_RENDER_QUEUE_SIZE=0):
+            self.assertEqual(self.get().status_code, 503)
+            self.assertRaises(RenderQueueFullError, schedule_render, self.invoice.tex)
+        self.assertFalse(Job.objects.exists())
+
+    def test_cache_key(self):
+        """
+        The cache is addressed by the tex source, and the invoice is rendered again when it changes.
+        """
+        path = self.render()
+        self.assertIsNotNone(path)
+        self.assertIn(get_digest(self.invoice.tex), path)
+
+        self.invoice.name = "You"
+        self.invoice.save()
+        self.assertIsNone(get_cached_pdf(self.invoice.tex))
+
+    def test_lock_prerenders(self):
+        """
+        Locking an invoice renders it in advance.
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice.locked = True
+            self.invoice.save()
+        self.run_jobs()
+        self.assertEqual(self.count_calls(), 2)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_range(self):
+        """
+        A byte range of the PDF file can be requested.
+        """
+        path = self.render()
+        with open(path, "rb") as f:
+            content = f.read()
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=2-5")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, content[2:6])
+        self.assertEqual(response["Content-Range"], "bytes 2-5/{:d}".format(len(content)))
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-3")
+        self.assertEqual(response.content, content[-3:])
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes={:d}-".format(len(content) + 10))
+        self.assertEqual(response.status_code, 416)
+
+    def test_render_error(self):
+        """
+        A rendering error is reported once, then the invoice can be rendered again.
+        """
+        with self.settings(INVOICE_XELATEX=make_xelatex_stub(self.tmp_dir, fail=True)):
+            with self.settings(INVOICE_RENDER_ASYNC=False):
+                self.assertRaises(RenderError, schedule_render, self.invoice.tex)
+
+            self.assertEqual(self.get().status_code, 202)
+            self.run_jobs()
+            self.assertEqual(Job.objects.get().status, Job.FAILED)
+            # The error is stored with the cache, then it is reported by any process
+            self.assertRaises(RenderError, self.get)
+            self.assertEqual(self.get().status_code, 202)
+        self.assertIsNone(get_cached_pdf(self.invoice.tex))
+
+
 class TestRemittances(TestCase):
     """
     Create some credits and close remittances.
@@ -220,6 +402,8 @@ class TestRemittances(TestCase):
         """
         response = self.client.get(reverse("treasury:remittance_list"))
         self.assertEqual(response.status_code, 200)
+        # The notes are displayed with their names
+        self.assertNotContains(response, "Note object")
 
     def test_remittance_create(self):
         """
@@ -262,6 +446,77 @@ class TestRemittances(TestCase):
         self.assertRedirects(response, reverse("treasury:remittance_list"), 302, 200)
         self.assertTrue(Remittance.objects.filter(comment="Closed remittance", closed=True).exists())
 
+    def test_remittance_totals(self):
+        """
+        The totals are computed by the database, and stored when the remittance is closed.
+        """
+        self.assertEqual(self.remittance.amount, 4200)
+        self.assertEqual(self.remittance.count(), 1)
+
+        remittance = Remittance.objects.with_totals().get(pk=self.remittance.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(remittance.amount, 4200)
+            self.assertEqual(remittance.count(), 1)
+
+        self.remittance.closed = True
+        self.remittance.save()
+        self.remittance.refresh_from_db()
+        self.assertEqual(self.remittance.closed_amount, 4200)
+        self.assertEqual(self.remittance.closed_count, 1)
+
+        # The stored totals are used once the remittance is closed
+        Remittance.objects.filter(pk=self.remittance.pk).update(closed_amount=1000)
+        self.assertEqual(Remittance.objects.with_totals().get(pk=self.remittance.pk).amount, 1000)
+
+    def test_remittances_list_queries(self):
+        """
+        The number of queries of the remittance list doesn't depend on the number of remittances.
+        """
+        def create_remittances(count):
+            for i in range(count):
+                for closed in (False, True):
+                    remittance = Remittance.objects.create(
+                        remittance_type=RemittanceType.objects.get(),
+                        comment="Remittance {:d}".format(i),
+                    )
+                    for _ignored in range(3):
+                        credit = SpecialTransaction.objects.create(
+                            source=NoteSpecial.objects.get(special_type="Chèque"),
+                            destination=self.user.note,
+                            amount=100,
+                            reason="Credit",
+                            last_name="TOTO",
+                            first_name="Toto",
+                        )
+                        credit.specialtransactionproxy.remittance = remittance
+                        credit.specialtransactionproxy.save()
+                    remittance.closed = closed
+                    remittance.save()
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(reverse("treasury:remittance_list"))
+            self.assertEqual(response.status_code, 200)
+            return len(ctx.captured_queries)
+
+        create_remittances(1)
+        queries = count_queries()
+        create_remittances(5)
+        self.assertEqual(count_queries(), queries)
+
+        # The table fetches the notes itself, even if the caller doesn't
+        def count_table_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                table = SpecialTransactionTable(SpecialTransaction.objects.all())
+                for row in table.rows:
+                    row.get_cell("source")
+                    row.get_cell("destination")
+            return len(ctx.captured_queries)
+
+        queries = count_table_queries()
+        create_remittances(2)
+        self.assertEqual(count_table_queries(), queries)
+
     def test_remittance_link_transaction(self):
         """
         Link a transaction to an open remittance.
@@ -282,6 +537,130 @@ class TestRemittances(TestCase):
         response = self.client.get(reverse("treasury:unlink_transaction", args=(self.credit.pk,)))
         self.assertRedirects(response, reverse("treasury:remittance_list"), 302, 200)
 
+    def create_credits(self, count, special_type="Chèque", amount=1000):
+        credits = []
+        for _ignored in range(count):
+            credits.append(SpecialTransaction.objects.create(
+                source=NoteSpecial.objects.get(special_type=special_type),
+                destination=self.user.note,
+                amount=amount,
+                reason="Credit",
+                last_name="TOTO",
+                first_name="Toto",
+            ))
+        return credits
+
+    def test_bulk_link(self):
+        """
+        Attach many transactions at once, only the transactions of the type of the remittance are attached.
+        """
+        RemittanceType.objects.create(note=NoteSpecial.objects.get(special_type="Virement bancaire"))
+        cheques = self.create_credits(3)
+        transfers = self.create_credits(2, special_type="Virement bancaire")
+
+        proxies = SpecialTransactionProxy.objects.filter(transaction__in=cheques + transfers)
+        with CaptureQueriesContext(connection) as ctx:
+            changed = set_remittance(None, proxies, self.remittance)
+        self.assertEqual(len(changed), 3)
+        self.assertEqual(self.remittance.count(), 4)
+        self.assertEqual(self.remittance.amount, 4200 + 3000)
+        self.assertFalse(SpecialTransactionProxy.objects.filter(transaction__in=transfers)
+                         .exclude(remittance=None).exists())
+        self.assertEqual(len([query for query in ctx.captured_queries
+                              if query["sql"].startswith("UPDATE")]), 1)
+
+        # The number of queries doesn't depend on the number of transactions
+        cheques = self.create_credits(10)
+        with CaptureQueriesContext(connection) as ctx_many:
+            set_remittance(None, SpecialTransactionProxy.objects.filter(transaction__in=cheques), self.remittance)
+        self.assertEqual(len(ctx_many.captured_queries), len(ctx.captured_queries))
+
+        # Detach the transactions
+        self.assertEqual(len(set_remittance(None, self.remittance.transaction_proxies.all(), None)), 14)
+        self.assertEqual(self.remittance.count(), 0)
+
+    def test_bulk_link_filters(self):
+        """
+        Select the transactions by their amount and their date.
+        """
+        self.create_credits(2, amount=500)
+        big_credit, = self.create_credits(1, amount=50000)
+        old_credit, = self.create_credits(1, amount=500)
+        Transaction.objects.filter(pk=old_credit.pk).update(created_at=timezone.now() - timedelta(days=30))
+        # The debit of the setup has a proxy too
+        proxies = filter_proxies(SpecialTransactionProxy.objects.filter(remittance=None),
+                                 remittance_type=RemittanceType.objects.get())
+
+        self.assertEqual(filter_proxies(proxies, min_amount=1000).get().transaction_id, big_credit.pk)
+        self.assertEqual(filter_proxies(proxies, max_amount=500).count(), 3)
+        self.assertEqual(filter_proxies(proxies, max_amount=500, since=date.today() - timedelta(days=1)).count(), 2)
+        self.assertEqual(filter_proxies(proxies, until=date.today() - timedelta(days=20)).get().transaction_id,
+                         old_credit.pk)
+
+    def test_bulk_link_closed(self):
+        """
+        The transactions of a closed remittance can't move, and nothing can be attached to it.
+        """
+        self.remittance.closed = True
+        self.remittance.save()
+        other = Remittance.objects.create(remittance_type=RemittanceType.objects.get(), comment="Other")
+
+        self.assertEqual(set_remittance(None, SpecialTransactionProxy.objects.all(), other), [])
+        self.assertEqual(set_remittance(None, SpecialTransactionProxy.objects.all(), None), [])
+        self.assertEqual(self.remittance.transaction_proxies.count(), 1)
+        self.create_credits(1)
+        self.assertRaises(ValidationError, set_remittance, None, SpecialTransactionProxy.objects.all(),
+                          self.remittance)
+
+    def test_bulk_link_view(self):
+        """
+        Attach and detach transactions with the form.
+        """
+        self.create_credits(2, amount=500)
+        self.create_credits(1, amount=50000)
+        url = reverse("treasury:remittance_transactions", args=(self.remittance.pk,))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.post(url, data=dict(max_amount="10.00", link=True))
+        self.assertRedirects(response, reverse("treasury:remittance_update", args=(self.remittance.pk,)), 302, 200)
+        self.assertEqual(self.remittance.count(), 3)
+
+        response = self.client.post(url, data=dict(min_amount="42.00", unlink=True))
+        self.assertRedirects(response, reverse("treasury:remittance_update", args=(self.remittance.pk,)), 302, 200)
+        self.assertEqual(self.remittance.count(), 2)
+
+        response = self.client.get(reverse("treasury:remittance_transactions", args=(self.remittance.pk + 100,)))
+        self.assertEqual(response.status_code, 404)
+
+        # The transactions of a closed remittance can't be detached, even without the form
+        self.remittance.closed = True
+        self.remittance.save()
+        response = self.client.post(url, data=dict(unlink=True))
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.remittance.count(), 2)
+
+    def test_bulk_link_api(self):
+        """
+        Attach and detach transactions with the API.
+        """
+        credits = self.create_credits(3)
+        url = "/api/treasury/remittance/{:d}/".format(self.remittance.pk)
+
+        response = self.client.post(url + "link/", data={}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(url + "link/", data={"ids": [credits[0].pk, credits[1].pk]},
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 2)
+        self.assertEqual(response.json()["remittance"], {"id": self.remittance.pk, "amount": 6200, "count": 3})
+
+        response = self.client.post(url + "unlink/", data={"min_amount": 2000}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["ids"], [self.credit.pk])
+        self.assertEqual(self.remittance.count(), 2)
+
     def test_invoice_api(self):
         """
         Load some API pages
@@ -2,9 +2,7 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import os
-import shutil
-import subprocess
-from tempfile import mkdtemp
+import re
 
 from crispy_forms.helper import FormHelper
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -12,22 +10,23 @@ from django.core.exceptions import ValidationError, PermissionDenied
 from django.db import transaction
 from django.db.models import Q
 from django.forms import Form
-from django.http import HttpResponse
-from django.shortcuts import redirect
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy
 from django.utils.translation import gettext_lazy as _
 from django.views.generic import UpdateView, DetailView
 from django.views.generic.base import View, TemplateView
-from django.views.generic.edit import BaseFormView, DeleteView
+from django.views.generic.edit import BaseFormView, DeleteView, FormView
 from django_tables2 import SingleTableView
 from note.models import SpecialTransaction, NoteSpecial, Alias
-from note_kfet.settings.base import BASE_DIR
 from permission.backends import PermissionBackend
 from permission.views import ProtectQuerysetMixin, ProtectedCreateView
 
+from .bulk import filter_proxies, set_remittance
 from .forms import InvoiceForm, ProductFormSet, ProductFormSetHelper, RemittanceForm, \
-    LinkTransactionToRemittanceForm
+    LinkTransactionToRemittanceForm, RemittanceTransactionsForm
 from .models import Invoice, Product, Remittance, SpecialTransactionProxy
+from .rendering import RenderQueueFullError, get_cached_pdf, get_digest, pop_error, schedule_render
 from .tables import InvoiceTable, RemittanceTable, SpecialTransactionTable
 
 
@@ -190,7 +189,9 @@ class InvoiceDeleteView(ProtectQuerysetMixin, LoginRequiredMixin, DeleteView):
 
 class InvoiceRenderView(LoginRequiredMixin, View):
     """
-    Render Invoice as a generated PDF with the given information and a LaTeX template
+    Render Invoice as a generated PDF with the given information and a LaTeX template.
+    The PDF files are rendered by background jobs and cached, see treasury.rendering. While an invoice is rendered,
+    the response has the status 202 and the client polls the same URL.
     """
 
     def get(self, request, **kwargs):
@@ -198,43 +199,65 @@ class InvoiceRenderView(LoginRequiredMixin, View):
         invoice = Invoice.objects.filter(PermissionBackend.filter_queryset(request, Invoice, "view")).get(pk=pk)
         tex = invoice.tex
 
-        try:
-            os.mkdir(BASE_DIR + "/tmp")
-        except FileExistsError:
-            pass
-        # We render the file in a temporary directory
-        tmp_dir = mkdtemp(prefix=BASE_DIR + "/tmp/")
-
-        try:
-            with open("{}/invoice-{:d}.tex".format(tmp_dir, pk), "wb") as f:
-                f.write(tex.encode("UTF-8"))
-            del tex
-
-            # The file has to be rendered twice
-            for _ignored in range(2):
-                error = subprocess.Popen(
-                    ["/usr/bin/xelatex", "-interaction=nonstopmode", "invoice-{}.tex".format(pk)],
-                    cwd=tmp_dir,
-                    stdin=open(os.devnull, "r"),
-                    stderr=open(os.devnull, "wb"),
-                    stdout=open(os.devnull, "wb"),
-                ).wait()
-
-                if error:
-                    with open("{}/invoice-{:d}.log".format(tmp_dir, pk), "r") as f:
-                        log = f.read()
-                    raise IOError("An error attempted while generating a invoice (code=" + str(error) + ")\n\n" + log)
-
-            # Display the generated pdf as a HTTP Response
-            pdf = open("{}/invoice-{}.pdf".format(tmp_dir, pk), 'rb').read()
-            response = HttpResponse(pdf, content_type="application/pdf")
-            response['Content-Disposition'] = "inline;filename=Facture%20n°{:d}.pdf".format(pk)
-        except IOError as e:
-            raise e
-        finally:
-            # Delete all temporary files
-            shutil.rmtree(tmp_dir)
-
+        # The PDF file only depends on the tex source
+        etag = '"{}"'.format(get_digest(tex))
+        if etag in [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]:
+            response = HttpResponseNotModified()
+            response["ETag"] = etag
+            return response
+
+        path = get_cached_pdf(tex)
+        if path is None:
+            error = pop_error(tex)
+            if error is not None:
+                raise error
+            try:
+                path = schedule_render(tex)
+            except RenderQueueFullError:
+                response = JsonResponse({"status": "busy"}, status=503)
+                response["Retry-After"] = "10"
+                return response
+            if path is None:
+                response = JsonResponse({"status": "rendering", "url": request.get_full_path()}, status=202)
+                response["Location"] = request.get_full_path()
+                response["Retry-After"] = "2"
+                # Browsers reload the page by themselves
+                response["Refresh"] = "2"
+                return response
+
+        return self.serve_pdf(request, path, etag, "inline;filename=Facture%20n°{:d}.pdf".format(pk))
+
+    @staticmethod
+    def serve_pdf(request, path, etag, content_disposition):
+        """
+        Serve a PDF file, or the single byte range that is requested.
+        """
+        size = os.path.getsize(path)
+        status = 200
+        start, end = 0, size - 1
+
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", request.headers.get("Range", ""))
+        if match and match.group(1) + match.group(2) and request.headers.get("If-Range", etag) == etag:
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                # Suffix range
+                start = max(size - int(match.group(2)), 0)
+            if start > end or start >= size:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = "bytes */{:d}".format(size)
+                return response
+            status = 206
+
+        with open(path, "rb") as f:
+            f.seek(start)
+            response = HttpResponse(f.read(end - start + 1), content_type="application/pdf", status=status)
+        if status == 206:
+            response["Content-Range"] = "bytes {:d}-{:d}/{:d}".format(start, end, size)
+        response["Accept-Ranges"] = "bytes"
+        response["ETag"] = etag
+        response["Content-Disposition"] = content_disposition
         return response
 
 
@@ -258,9 +281,9 @@ class RemittanceCreateView(ProtectQuerysetMixin, ProtectedCreateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        context["table"] = RemittanceTable(
-            data=Remittance.objects.filter(
-                PermissionBackend.filter_queryset(self.request, Remittance, "view")).all())
+        remittances = Remittance.objects.filter(PermissionBackend.filter_queryset(self.request, Remittance, "view"))\
+            .with_totals().select_related("remittance_type__note")
+        context["table"] = RemittanceTable(data=remittances)
         context["special_transactions"] = SpecialTransactionTable(data=SpecialTransaction.objects.none())
 
         return context
@@ -289,26 +312,28 @@ class RemittanceListView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
+        remittances = Remittance.objects.filter(PermissionBackend.filter_queryset(self.request, Remittance, "view"))\
+            .with_totals().select_related("remittance_type__note")
+
         opened_remittances = RemittanceTable(
-            data=Remittance.objects.filter(closed=False).filter(
-                PermissionBackend.filter_queryset(self.request, Remittance, "view")).all(),
+            data=remittances.filter(closed=False),
             prefix="opened-remittances-",
         )
         opened_remittances.paginate(page=self.request.GET.get("opened-remittances-page", 1), per_page=10)
         context["opened_remittances"] = opened_remittances
 
         closed_remittances = RemittanceTable(
-            data=Remittance.objects.filter(closed=True).filter(
-                PermissionBackend.filter_queryset(self.request, Remittance, "view")).all(),
+            data=remittances.filter(closed=True),
             prefix="closed-remittances-",
         )
         closed_remittances.paginate(page=self.request.GET.get("closed-remittances-page", 1), per_page=10)
         context["closed_remittances"] = closed_remittances
 
         no_remittance_tr = SpecialTransactionTable(
-            data=SpecialTransaction.objects.filter(source__in=NoteSpecial.objects.filter(~Q(remittancetype=None)),
-                                                   specialtransactionproxy__remittance=None).filter(
-                PermissionBackend.filter_queryset(self.request, Remittance, "view")).all(),
+            data=SpecialTransaction.objects.filter(
+                source__in=NoteSpecial.objects.filter(~Q(remittancetype=None)),
+                specialtransactionproxy__remittance=None,
+            ).filter(PermissionBackend.filter_queryset(self.request, Remittance, "view")),
             exclude=('remittance_remove', ),
             prefix="no-remittance-",
         )
@@ -316,9 +341,10 @@ class RemittanceListView(LoginRequiredMixin, TemplateView):
         context["special_transactions_no_remittance"] = no_remittance_tr
 
         with_remittance_tr = SpecialTransactionTable(
-            data=SpecialTransaction.objects.filter(source__in=NoteSpecial.objects.filter(~Q(remittancetype=None)),
-                                                   specialtransactionproxy__remittance__closed=False).filter(
-                PermissionBackend.filter_queryset(self.request, Remittance, "view")).all(),
+            data=SpecialTransaction.objects.filter(
+                source__in=NoteSpecial.objects.filter(~Q(remittancetype=None)),
+                specialtransactionproxy__remittance__closed=False,
+            ).filter(PermissionBackend.filter_queryset(self.request, Remittance, "view")),
             exclude=('remittance_add', ),
             prefix="with-remittance-",
         )
@@ -342,8 +368,8 @@ class RemittanceUpdateView(ProtectQuerysetMixin, LoginRequiredMixin, UpdateView)
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        data = SpecialTransaction.objects.filter(specialtransactionproxy__remittance=self.object).filter(
-            PermissionBackend.filter_queryset(self.request, Remittance, "view")).all()
+        data = SpecialTransaction.objects.filter(specialtransactionproxy__remittance=self.object)\
+            .filter(PermissionBackend.filter_queryset(self.request, Remittance, "view"))
         context["special_transactions"] = SpecialTransactionTable(
             data=data,
             exclude=('remittance_add', 'remittance_remove', ) if self.object.closed else ('remittance_add', ))
@@ -351,6 +377,48 @@ class RemittanceUpdateView(ProtectQuerysetMixin, LoginRequiredMixin, UpdateView)
         return context
 
 
+class RemittanceTransactionsView(LoginRequiredMixin, FormView):
+    """
+    Attach special transactions to a remittance, or detach them, at once
+    """
+    form_class = RemittanceTransactionsForm
+    template_name = "treasury/specialtransactionproxy_form.html"
+    extra_context = {"title": _("Attach transactions to a remittance")}
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return self.handle_no_permission()
+        self.object = get_object_or_404(
+            Remittance.objects.filter(PermissionBackend.filter_queryset(request, Remittance, "view")),
+            pk=kwargs["pk"],
+        )
+        # The transactions of a closed remittance never move, even if the form is hidden
+        if self.object.closed:
+            raise PermissionDenied(_("Remittance is already closed."))
+        return super().dispatch(request, *args, **kwargs)
+
+    @transaction.atomic
+    def form_valid(self, form):
+        filters = form.get_filters()
+        if "unlink" in form.data:
+            proxies = self.object.transaction_proxies.all()
+            remittance = None
+        else:
+            proxies = SpecialTransactionProxy.objects.all()
+            remittance = self.object
+        proxies = proxies.filter(PermissionBackend.filter_queryset(self.request, SpecialTransactionProxy, "view"))
+
+        try:
+            set_remittance(self.request, filter_proxies(proxies, **filters), remittance)
+        except ValidationError as e:
+            form.add_error(None, e)
+            return self.form_invalid(form)
+        return super().form_valid(form)
+
+    def get_success_url(self):
+        return reverse_lazy('treasury:remittance_update', args=(self.object.pk,))
+
+
 class LinkTransactionToRemittanceView(ProtectQuerysetMixin, LoginRequiredMixin, UpdateView):
     """
     Attach a special transaction to a remittance
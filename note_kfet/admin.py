@@ -4,16 +4,17 @@
 from django.conf import settings
 from django.contrib.admin import AdminSite
 from django.contrib.sites.admin import Site, SiteAdmin
-
 from member.views import CustomLoginView
 
+from .middlewares import get_permission_mask
+
 
 class StrongAdminSite(AdminSite):
     def has_permission(self, request):
         """
         Authorize only staff that have the correct permission mask
         """
-        return request.user.is_active and request.user.is_staff and request.session.get("permission_mask", -1) >= 42
+        return request.user.is_active and request.user.is_staff and get_permission_mask(request) >= 42
 
     def login(self, request, extra_context=None):
         return CustomLoginView.as_view()(request)
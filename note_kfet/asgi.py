@@ -0,0 +1,20 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+"""
+ASGI config for note_kfet project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+It can be used instead of the WSGI application with an asynchronous server, eg. uvicorn or daphne.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'note_kfet.settings')
+
+application = get_asgi_application()
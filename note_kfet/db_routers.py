@@ -0,0 +1,114 @@
+# Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .middlewares import get_current_request
+
+# Requests that are not supposed to write anything
+SAFE_METHODS = ("GET", "HEAD")
+
+# Name of the cookie that sends the reads of a client to the primary database for a while after a write
+PIN_COOKIE_NAME = "db_pin_primary"
+
+# These applications are used to authenticate users, their data must always be up to date
+PRIMARY_APPS = {"authtoken", "oauth2_provider", "sessions"}
+
+_read_only = ContextVar("db_read_only", default=False)
+
+
+def get_replica():
+    """
+    Return the alias of the read-only replica, or None if no replica is configured.
+    """
+    alias = getattr(settings, "DATABASE_REPLICA", None)
+    return alias if alias in settings.DATABASES else None
+
+
+def is_pinned(request):
+    """
+    A client that wrote something recently must read its own writes, then it uses the primary database.
+    """
+    return getattr(request, "_db_written", False) or PIN_COOKIE_NAME in request.COOKIES
+
+
+def use_primary():
+    """
+    Check if the reads must be done on the primary database, whatever the kind of request.
+    """
+    if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        # Inside a database transaction (eg. the ledger code), read what is going to be written
+        return True
+    request = get_current_request()
+    return request is not None and is_pinned(request)
+
+
+@contextmanager
+def read_only():
+    """
+    The reads that are done in this block may be served by the replica,
+    even outside a safe request (eg. in a management command or an export).
+
+        with read_only():
+            transactions = list(Transaction.objects.filter(...))
+    """
+    token = _read_only.set(True)
+    try:
+        yield
+    finally:
+        _read_only.reset(token)
+
+
+def using_replica(queryset):
+    """
+    Explicitly mark a queryset as read-only: it is read from the replica if it is possible.
+    """
+    replica = get_replica()
+    if replica is None or use_primary():
+        return queryset.using(DEFAULT_DB_ALIAS)
+    return queryset.using(replica)
+
+
+class ReplicaRouter:
+    """
+    Send the reads of safe (GET/HEAD) requests and explicitly read-only reads to the replica,
+    if a replica is configured in the DATABASE_REPLICA setting.
+    Writes, locks (select_for_update) and reads inside a database transaction always use the primary database.
+    After a write, the client is pinned to the primary database for DATABASE_REPLICA_PIN_TIME seconds,
+    see note_kfet.middlewares.DatabasePinMiddleware.
+    """
+
+    def db_for_read(self, model, **hints):
+        replica = get_replica()
+        if replica is None or model._meta.app_label in PRIMARY_APPS or use_primary():
+            return DEFAULT_DB_ALIAS
+
+        if _read_only.get():
+            return replica
+
+        request = get_current_request()
+        if request is not None and request.method in SAFE_METHODS:
+            return replica
+
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        request = get_current_request()
+        if request is not None and model._meta.app_label not in PRIMARY_APPS:
+            # The next reads of this request must see this write
+            request._db_written = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica contains the same data as the primary database
+        databases = {DEFAULT_DB_ALIAS, get_replica()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
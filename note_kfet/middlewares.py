@@ -1,56 +1,125 @@
 # Copyright (C) 2018-2021 by BDE ENS Paris-Saclay
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-from threading import local
+from contextlib import ExitStack
+from contextvars import ContextVar
 
 from django.conf import settings
 from django.contrib.auth import login
 from django.contrib.auth.models import User
+from django.utils.deprecation import MiddlewareMixin
 
 REQUEST_ATTR_NAME = getattr(settings, 'LOCAL_REQUEST_ATTR_NAME', '_current_request')
 
-_thread_locals = local()
+# The current request is stored in a context variable rather than in a thread local:
+# each asynchronous task (ASGI) has its own context, and synchronous code that is run
+# through asgiref gets a copy of the context of its caller.
+_current_request = ContextVar(REQUEST_ATTR_NAME, default=None)
 
 
 def _set_current_request(request=None):
-    setattr(_thread_locals, REQUEST_ATTR_NAME, request)
+    _current_request.set(request)
 
 
 def get_current_request():
-    return getattr(_thread_locals, REQUEST_ATTR_NAME, None)
+    return _current_request.get()
 
 
-class SessionMiddleware(object):
+def get_permission_mask(request, default=-1):
     """
-    This middleware get the current user with his or her IP address on each request.
+    Get the permission mask of the given request.
+    Requests that are authenticated with an API token carry their mask, other requests store it in their session.
     """
+    mask = getattr(request, "permission_mask", None)
+    if mask is not None:
+        return mask
+    return request.session.get("permission_mask", default)
 
-    def __init__(self, get_response):
-        self.get_response = get_response
 
-    def __call__(self, request):
-        # If we authenticate through a token to connect to the API, then we query the good user
+class SessionMiddleware(MiddlewareMixin):
+    """
+    This middleware get the current user with his or her IP address on each request.
+    """
+
+    def process_request(self, request):
+        # If we authenticate through a token to connect to the API, then we query the good user.
+        # The session is not used, the permission mask is given by the request itself.
         if 'HTTP_AUTHORIZATION' in request.META and request.path.startswith("/api"):
             token = request.META.get('HTTP_AUTHORIZATION')
             if token.startswith("Token "):
                 token = token[6:]
-                from rest_framework.authtoken.models import Token
-                if Token.objects.filter(key=token).exists():
-                    token_obj = Token.objects.get(key=token)
-                    user = token_obj.user
+                from api.authentication import get_token_user
+                user = get_token_user(token)
+                if user is not None:
                     request.user = user
-                    session = request.session
-                    session["permission_mask"] = 42
-                    session.save()
+                    request.auth_token_key = token
+                    request.permission_mask = 42
 
         _set_current_request(request)
-        response = self.get_response(request)
+
+    def process_response(self, request, response):
         _set_current_request(None)
+        return response
+
+
+class DatabasePinMiddleware(MiddlewareMixin):
+    """
+    When a read-only replica of the database is used, pin the client to the primary database
+    for a short time after a write, so that he or she always sees his or her own changes.
+    See note_kfet.db_routers.ReplicaRouter.
+    """
+
+    def process_response(self, request, response):
+        from .db_routers import PIN_COOKIE_NAME, SAFE_METHODS, get_replica
+
+        if get_replica() is not None \
+                and (getattr(request, "_db_written", False) or request.method not in SAFE_METHODS):
+            response.set_cookie(
+                PIN_COOKIE_NAME,
+                "1",
+                max_age=getattr(settings, "DATABASE_REPLICA_PIN_TIME", 15),
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
 
+
+class PermissionProfilingMiddleware(MiddlewareMixin):
+    """
+    If the setting PERMISSION_PROFILING is enabled, record statistics about the permission checks
+    of each request, and send them in a Server-Timing header.
+    See permission.profiling.
+    """
+
+    def process_request(self, request):
+        if not getattr(settings, "PERMISSION_PROFILING", False):
+            return
+
+        from django.db import connections
+        from permission.profiling import start_profiling
+
+        stats = start_profiling()
+        request._permission_stats = stats
+        request._permission_profiling = ExitStack()
+        for connection in connections.all():
+            request._permission_profiling.enter_context(connection.execute_wrapper(stats.execute_wrapper))
+
+    def process_response(self, request, response):
+        stats = getattr(request, "_permission_stats", None)
+        if stats is None:
+            return response
+
+        from permission.profiling import stop_profiling
+
+        request._permission_profiling.close()
+        stop_profiling()
+        response["Server-Timing"] = stats.server_timing()
+        response.permission_stats = stats
         return response
 
 
-class LoginByIPMiddleware(object):
+class LoginByIPMiddleware(MiddlewareMixin):
     """
     Allow some users to be authenticated based on their IP address.
     For example, the "note" account should not be used elsewhere than the Kfet computer,
@@ -58,10 +127,7 @@ class LoginByIPMiddleware(object):
     The password that is stored in database should be on the form "ipbased$my.public.ip.address".
     """
 
-    def __init__(self, get_response):
-        self.get_response = get_response
-
-    def __call__(self, request):
+    def process_request(self, request):
         """
         If the user is not authenticated, get the used IP address
         and check if an user is authorized to be automatically logged with this address.
@@ -82,21 +148,14 @@ class LoginByIPMiddleware(object):
                 session["permission_mask"] = 42
                 session.save()
 
-        return self.get_response(request)
 
-
-class TurbolinksMiddleware(object):
+class TurbolinksMiddleware(MiddlewareMixin):
     """
     Send the `Turbolinks-Location` header in response to a visit that was redirected,
     and Turbolinks will replace the browser's topmost history entry.
     """
 
-    def __init__(self, get_response):
-        self.get_response = get_response
-
-    def __call__(self, request):
-        response = self.get_response(request)
-
+    def process_response(self, request, response):
         is_turbolinks = request.META.get('HTTP_TURBOLINKS_REFERRER')
         is_response_redirect = response.has_header('Location')
 
@@ -116,15 +175,12 @@ class TurbolinksMiddleware(object):
         return response
 
 
-class ClacksMiddleware(object):
+class ClacksMiddleware(MiddlewareMixin):
     """
     Add Clacks Overhead header on each response.
     See https://www.gnuterrypratchett.com/
     """
-    def __init__(self, get_response):
-        self.get_response = get_response
 
-    def __call__(self, request):
-        response = self.get_response(request)
+    def process_response(self, request, response):
         response['X-Clacks-Overhead'] = 'GNU Terry Pratchett'
         return response
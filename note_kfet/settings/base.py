@@ -71,6 +71,7 @@ INSTALLED_APPS = [
     # Note apps
     'api',
     'activity',
+    'jobs',
     'logs',
     'member',
     'note',
@@ -93,6 +94,8 @@ MIDDLEWARE = [
     'django.contrib.sites.middleware.CurrentSiteMiddleware',
     'django_htcpcp_tea.middleware.HTCPCPTeaMiddleware',
     'note_kfet.middlewares.SessionMiddleware',
+    'note_kfet.middlewares.PermissionProfilingMiddleware',
+    'note_kfet.middlewares.DatabasePinMiddleware',
     'note_kfet.middlewares.LoginByIPMiddleware',
     'note_kfet.middlewares.TurbolinksMiddleware',
     'note_kfet.middlewares.ClacksMiddleware',
@@ -112,12 +115,14 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'django.template.context_processors.request',
+                'permission.context_processors.navigation',
             ],
         },
     },
 ]
 
 WSGI_APPLICATION = 'note_kfet.wsgi.application'
+ASGI_APPLICATION = 'note_kfet.asgi.application'
 
 
 # Database
@@ -134,6 +139,21 @@ DATABASES = {
     }
 }
 
+# Optional read-only replica of the database, that serves safe requests.
+# See note_kfet/db_routers.py
+if os.getenv('DJANGO_DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.getenv('DJANGO_DB_REPLICA_HOST'),
+        'PORT': os.getenv('DJANGO_DB_REPLICA_PORT', ''),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['note_kfet.db_routers.ReplicaRouter']
+DATABASE_REPLICA = 'replica'
+# After a write, the client reads the primary database during this time (in seconds)
+DATABASE_REPLICA_PIN_TIME = 15
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -250,13 +270,42 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
         'oauth2_provider.contrib.rest_framework.OAuth2Authentication',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
 }
 
+# The owners of API tokens are cached for 5 minutes
+API_TOKEN_CACHE_TIMEOUT = 60 * 5
+
+# Store the most common view permissions on notes and transactions in a table, see apps/permission/acl.py.
+# Run `./manage.py rebuild_permission_acl` after enabling it.
+PERMISSION_ACL = False
+
+# Record statistics about the permission checks of each request, and send them in a Server-Timing header.
+# Only useful to debug performance issues, see also `./manage.py profile_permissions`.
+PERMISSION_PROFILING = False
+
+# Transactions of these types are moved to the archive after TRANSACTION_ARCHIVE_YEARS academic years,
+# see apps/note/archive.py and `./manage.py archive_transactions`.
+TRANSACTION_ARCHIVE_MODELS = ["note.transaction", "note.recurrenttransaction"]
+TRANSACTION_ARCHIVE_YEARS = 2
+
+# Invoices are rendered with XeLaTeX by background jobs, and cached by the hash of their source.
+# See apps/treasury/rendering.py. When INVOICE_RENDER_ASYNC is False, the invoices are rendered in the request.
+INVOICE_XELATEX = "/usr/bin/xelatex"
+INVOICE_CACHE_DIR = os.path.join(BASE_DIR, "tmp", "invoices")
+INVOICE_RENDER_ASYNC = True
+INVOICE_RENDER_QUEUE_SIZE = 32
+
+# Background jobs, run by ./manage.py run_jobs. See apps/jobs/queue.py.
+# A failed job is retried after JOBS_RETRY_DELAY seconds, then the delay doubles up to JOBS_RETRY_MAX_DELAY.
+JOBS_RETRY_DELAY = 30
+JOBS_RETRY_MAX_DELAY = 60 * 60
+JOBS_STALE_TIMEOUT = 60 * 60
+
 # OAuth2 Provider
 OAUTH2_PROVIDER = {
     'SCOPES_BACKEND_CLASS': 'permission.scopes.PermissionScopes',
@@ -21,8 +21,15 @@ if os.getenv("DJANGO_DEV_STORE_METHOD", "sqlite") != "postgresql":
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-        }
+        },
+        # Second database file, that can act as a replica of the first one
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db_replica.sqlite3'),
+        },
     }
+    # Copy db.sqlite3 to db_replica.sqlite3 and set DJANGO_DEV_USE_REPLICA=true to read safe requests from the copy
+    DATABASE_REPLICA = 'replica' if os.getenv("DJANGO_DEV_USE_REPLICA", "false") == "true" else None
 
 # Dummy cache for development
 # https://docs.djangoproject.com/en/2.2/topics/cache/#setting-up-the-cache